@@ -0,0 +1,198 @@
+import os
+import time
+import argparse
+import numpy as np
+from embedding_store import load_embedding_store, read_store_header
+
+ASSIGN_BLOCK_ROWS = 65536
+KMEANS_SAMPLES_PER_LIST = 64
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+# Function to assign every row to its nearest centroid, in blocks so the whole vault is never copied at once
+def _assign(embeddings, centroids):
+    assignments = np.empty(len(embeddings), dtype=np.int32)
+    for start in range(0, len(embeddings), ASSIGN_BLOCK_ROWS):
+        block = _normalize(embeddings[start:start + ASSIGN_BLOCK_ROWS])
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+# Function to train spherical k-means centroids on a sample of the vault embeddings
+def train_centroids(embeddings, n_lists, n_iter=10, seed=0):
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(embeddings), n_lists * KMEANS_SAMPLES_PER_LIST)
+    sample_rows = np.sort(rng.choice(len(embeddings), size=sample_size, replace=False))
+    sample = _normalize(embeddings[sample_rows])
+    centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+    for _ in range(n_iter):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=n_lists)
+        # Reseed empty lists with random sample points so every list stays useful
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+# Inverted-file (IVF) index over the vault embeddings: rows are grouped into lists around k-means
+# centroids and a query only scores the rows of its nprobe closest lists. Scores are cosine
+# similarities, computed against the original (memory-mapped) embedding matrix.
+class IVFIndex:
+    def __init__(self, centroids, list_offsets, list_rows, row_norms, vault_checksum="", nprobe=8):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.row_norms = row_norms
+        self.vault_checksum = vault_checksum
+        self.nprobe = nprobe
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, embeddings, n_lists=None, n_iter=10, vault_checksum="", nprobe=8, seed=0):
+        rows = len(embeddings)
+        if rows == 0:
+            raise ValueError("Cannot build an ANN index over an empty vault")
+        if not n_lists:
+            n_lists = max(1, int(np.sqrt(rows)))
+        n_lists = min(n_lists, rows)
+        centroids = train_centroids(embeddings, n_lists, n_iter=n_iter, seed=seed)
+        assignments = _assign(embeddings, centroids)
+        list_rows = np.argsort(assignments, kind="stable").astype(np.int64)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=list_offsets[1:])
+        row_norms = np.empty(rows, dtype=np.float32)
+        for start in range(0, rows, ASSIGN_BLOCK_ROWS):
+            block = np.asarray(embeddings[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+            row_norms[start:start + len(block)] = np.linalg.norm(block, axis=1)
+        row_norms[row_norms == 0] = 1.0
+        return cls(centroids, list_offsets, list_rows, row_norms, vault_checksum, nprobe)
+
+    # Function to return a new index with rows appended to the lists of their nearest centroids, leaving this
+    # one unchanged for searches in progress. The centroids are not retrained, so lists drift from a fresh
+    # build as the vault grows; the index is rebuilt when the store has changed on the next start.
+    def with_rows(self, new_embeddings, vault_checksum=""):
+        start = len(self.list_rows)
+        assignments = _assign(new_embeddings, self.centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=self.n_lists)
+        # Each new row goes to the end of its list
+        list_rows = np.insert(self.list_rows, np.repeat(self.list_offsets[1:], counts), order + start)
+        list_offsets = self.list_offsets.copy()
+        list_offsets[1:] += np.cumsum(counts)
+        row_norms = np.linalg.norm(np.asarray(new_embeddings, dtype=np.float32), axis=1)
+        row_norms[row_norms == 0] = 1.0
+        return IVFIndex(self.centroids, list_offsets, list_rows, np.concatenate([self.row_norms, row_norms]),
+                        vault_checksum, self.nprobe)
+
+    # Function to return the top_k (row indices, cosine scores) for one query embedding
+    def search(self, query_embedding, embeddings, top_k, nprobe=None):
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        query = _normalize(query_embedding)
+        centroid_scores = self.centroids @ query
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        candidates = np.concatenate([self.list_rows[self.list_offsets[i]:self.list_offsets[i + 1]] for i in probe])
+        if len(candidates) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        # Sorted row ids keep reads from the memory-mapped matrix sequential
+        candidates.sort()
+        scores = (np.asarray(embeddings[candidates], dtype=np.float32) @ query) / self.row_norms[candidates]
+        top_k = min(top_k, len(candidates))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return candidates[best], scores[best]
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(file, centroids=self.centroids, list_offsets=self.list_offsets, list_rows=self.list_rows,
+                     row_norms=self.row_norms, vault_checksum=np.array(self.vault_checksum))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, nprobe=8):
+        with np.load(path) as data:
+            return cls(data["centroids"], data["list_offsets"], data["list_rows"], data["row_norms"],
+                       str(data["vault_checksum"]), nprobe)
+
+# Function to get the index file that lives next to an embedding store
+def index_path_for(store_path):
+    return store_path + ".ivf.npz"
+
+# Function to load the ANN index for an embedding store, rebuilding it if the store has changed
+def load_or_build_index(store_path, embeddings, n_lists=None, nprobe=8):
+    checksum = read_store_header(store_path)["vault_checksum"]
+    path = index_path_for(store_path)
+    if os.path.exists(path):
+        try:
+            index = IVFIndex.load(path, nprobe)
+            if index.vault_checksum == checksum and len(index.list_rows) == len(embeddings):
+                print(f"Loaded ANN index with {index.n_lists} lists from '{path}'.")
+                return index
+            print(f"ANN index '{path}' is out of date. Rebuilding...")
+        except (ValueError, OSError, KeyError) as e:
+            print(f"Could not read ANN index '{path}': {str(e)}")
+    start = time.perf_counter()
+    index = IVFIndex.build(embeddings, n_lists=n_lists, vault_checksum=checksum, nprobe=nprobe)
+    index.save(path)
+    print(f"Built ANN index with {index.n_lists} lists in {time.perf_counter() - start:.1f}s.")
+    return index
+
+# Function to compare ANN results against exact search for a range of nprobe settings
+def recall_report(index, embeddings, top_k=10, n_queries=100, nprobes=(1, 2, 4, 8, 16, 32), seed=0):
+    rng = np.random.default_rng(seed)
+    # Use perturbed vault rows as queries so they look like real in-distribution queries
+    rows = rng.choice(len(embeddings), size=min(n_queries, len(embeddings)), replace=False)
+    queries = np.asarray(embeddings[np.sort(rows)], dtype=np.float32)
+    queries = queries + rng.normal(scale=0.05 * np.abs(queries).mean(), size=queries.shape).astype(np.float32)
+
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    exact = []
+    start = time.perf_counter()
+    for query in queries:
+        scores = (matrix @ _normalize(query)) / index.row_norms
+        k = min(top_k, len(scores))
+        exact.append(set(np.argpartition(-scores, k - 1)[:k].tolist()))
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    print(f"exact      recall@{top_k}=1.000  {exact_ms:8.2f} ms/query")
+
+    report = []
+    for nprobe in nprobes:
+        if nprobe > index.n_lists:
+            break
+        hits = 0
+        start = time.perf_counter()
+        for query, truth in zip(queries, exact):
+            found, _ = index.search(query, embeddings, top_k, nprobe=nprobe)
+            hits += len(truth.intersection(found.tolist()))
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = hits / sum(len(truth) for truth in exact)
+        report.append({"nprobe": nprobe, "recall": recall, "latency_ms": latency_ms})
+        print(f"nprobe={nprobe:<4} recall@{top_k}={recall:.3f}  {latency_ms:8.2f} ms/query")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an ANN index for the vault embeddings and report its recall")
+    parser.add_argument("--embeddings-file", default="vault_embeddings.bin", help="Binary embeddings store")
+    parser.add_argument("--lists", type=int, default=0, help="Number of IVF lists (default: sqrt of the row count)")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the index even if it is up to date")
+    parser.add_argument("--top-k", type=int, default=10, help="k used for the recall report")
+    parser.add_argument("--queries", type=int, default=100, help="Number of sample queries for the recall report")
+    args = parser.parse_args()
+
+    _, embeddings = load_embedding_store(args.embeddings_file)
+    if args.rebuild and os.path.exists(index_path_for(args.embeddings_file)):
+        os.remove(index_path_for(args.embeddings_file))
+    index = load_or_build_index(args.embeddings_file, embeddings, n_lists=args.lists or None)
+    recall_report(index, embeddings, top_k=args.top_k, n_queries=args.queries)
+
+if __name__ == "__main__":
+    main()
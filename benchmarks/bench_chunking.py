@@ -0,0 +1,67 @@
+import os
+import time
+import json
+import random
+import argparse
+import resource
+import tempfile
+from chunking import chunk_text, read_blocks, append_chunks_to_vault
+
+WORDS = ("invoice", "meeting", "report", "quarterly", "budget", "email", "project", "deadline",
+         "customer", "update", "review", "team", "schedule", "payment", "contract", "draft")
+
+# Function to write a synthetic text document of roughly size_mb megabytes
+def write_synthetic_document(path, size_mb, seed=0):
+    rng = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    written = 0
+    with open(path, "w", encoding="utf-8") as file:
+        while written < target:
+            lines = []
+            for _ in range(1000):
+                sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 30)))
+                lines.append(sentence.capitalize() + rng.choice(".!?") + rng.choice(("  ", "\n", " \n\n", " ")))
+            block = "".join(lines)
+            file.write(block)
+            written += len(block)
+    return written
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure chunking throughput on a large synthetic document")
+    parser.add_argument("--size-mb", type=int, default=256, help="Size of the synthetic input in MB (default: 256)")
+    parser.add_argument("--max-length", type=int, default=1000, help="Chunk size in characters (default: 1000)")
+    parser.add_argument("--overlap", type=int, default=0, help="Chunk overlap in characters (default: 0)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, "input.txt")
+        vault_path = os.path.join(tmp_dir, "vault.txt")
+        print(f"Writing {args.size_mb} MB synthetic document...")
+        size = write_synthetic_document(input_path, args.size_mb)
+        rss_before = peak_rss_mb()
+
+        start = time.perf_counter()
+        with open(input_path, "r", encoding="utf-8") as file:
+            count = append_chunks_to_vault(chunk_text(read_blocks(file), args.max_length, args.overlap), vault_path)
+        elapsed = time.perf_counter() - start
+
+        results = {
+            "benchmark": "chunking",
+            "input_mb": size / (1024 * 1024),
+            "chunks": count,
+            "seconds": elapsed,
+            "mb_per_s": size / (1024 * 1024) / elapsed,
+            "peak_rss_mb": peak_rss_mb(),
+            "peak_rss_before_mb": rss_before,
+        }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
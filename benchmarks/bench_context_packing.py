@@ -0,0 +1,82 @@
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import numpy as np
+from chunking import chunk_text
+from context_packing import ContextPacker
+from retrieval import VaultRetriever
+from token_counter import count_tokens
+from vault_store import VaultStore, append_records
+from benchmarks.stub_ollama import stub_embedding
+from benchmarks.synthetic import synthetic_chunk
+from benchmarks.run_benchmarks import QUESTIONS
+
+# Context tokens sent per question with the retrieved chunks joined verbatim against packed with
+# ContextPacker, on a synthetic vault that has what real vaults have: documents chunked with overlap, and
+# the same passages ingested more than once (re-uploaded files, quoted email replies). Prompt-eval time is
+# estimated from --prompt-eval-rate (tokens/s of your model on your hardware; CPU inference of an 8B model
+# is in the tens to low hundreds).
+
+# Function to write documents chunked with overlap, a share of them ingested twice under another source
+def write_vault(path, documents, duplicate_share, chunk_length, overlap, seed=0):
+    rng = random.Random(seed)
+    for doc in range(documents):
+        text = " ".join(synthetic_chunk(rng, 40) for _ in range(rng.randint(4, 12)))
+        chunks = list(chunk_text(text, chunk_length, overlap))
+        append_records(path, chunks, {"source": f"doc{doc}.txt"})
+        if rng.random() < duplicate_share:
+            append_records(path, chunks, {"source": f"copy_of_doc{doc}.txt"})
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the context tokens saved by context packing")
+    parser.add_argument("--documents", type=int, default=500, help="Synthetic documents in the vault (default: 500)")
+    parser.add_argument("--duplicate-share", type=float, default=0.3, help="Share of documents ingested twice (default: 0.3)")
+    parser.add_argument("--chunk-length", type=int, default=1000, help="Chunk length in characters (default: 1000)")
+    parser.add_argument("--overlap", type=int, default=200, help="Characters repeated between chunks (default: 200)")
+    parser.add_argument("--dim", type=int, default=256, help="Embedding dimension (default: 256)")
+    parser.add_argument("--top-k", type=int, default=7, help="Chunks retrieved per question (default: 7, as config.yaml)")
+    parser.add_argument("--max-tokens", type=int, default=1024, help="Context token budget (default: 1024)")
+    parser.add_argument("--queries", type=int, default=100, help="Questions to run (default: 100)")
+    parser.add_argument("--prompt-eval-rate", type=float, default=100, help="Prompt tokens evaluated per second, for the time estimate (default: 100)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        vault_path = os.path.join(work_dir, "vault.txt")
+        write_vault(vault_path, args.documents, args.duplicate_share, args.chunk_length, args.overlap)
+        vault_content = VaultStore(vault_path)
+        embeddings = np.array([stub_embedding(line, args.dim) for line in vault_content], dtype=np.float32)
+        retriever = VaultRetriever(embeddings)
+        packer = ContextPacker(args.max_tokens, embeddings=embeddings)
+        rng = random.Random(1)
+        before, after, pack_s = [], [], []
+        for i in range(args.queries):
+            query = rng.choice(QUESTIONS) + " " + synthetic_chunk(rng, 30)
+            embedding = [stub_embedding(query, args.dim)]
+            top_indices = retriever.search_merged(embedding, args.top_k)
+            before.append(sum(count_tokens(vault_content[row].strip()) for row in top_indices))
+            start = time.perf_counter()
+            packed = packer.pack(top_indices, vault_content)
+            pack_s.append(time.perf_counter() - start)
+            after.append(sum(count_tokens(passage) for passage in packed))
+        vault_content.close()
+
+    saved = np.asarray(before) - np.asarray(after)
+    results = {"rows": len(embeddings), "top_k": args.top_k, "max_tokens": args.max_tokens,
+               "tokens_before_mean": float(np.mean(before)), "tokens_after_mean": float(np.mean(after)),
+               "tokens_saved_mean": float(saved.mean()), "tokens_saved_pct": float(100 * saved.sum() / max(sum(before), 1)),
+               "prompt_eval_saved_s_mean": float(saved.mean() / args.prompt_eval_rate),
+               "pack_ms_p50": float(np.percentile(pack_s, 50) * 1000), "pack_ms_p99": float(np.percentile(pack_s, 99) * 1000)}
+    print(f"{results['rows']} chunks, top_k={args.top_k}: ~{results['tokens_before_mean']:.0f} -> "
+          f"~{results['tokens_after_mean']:.0f} context tokens per question ({results['tokens_saved_pct']:.1f}% saved, "
+          f"~{results['prompt_eval_saved_s_mean']:.2f}s less prompt eval at {args.prompt_eval_rate:.0f} tokens/s), "
+          f"packing p50 {results['pack_ms_p50']:.2f} ms")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import os
+import json
+import time
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from email import policy
+from email.parser import BytesParser
+from bs4 import BeautifulSoup
+import email_parse
+from benchmarks.stub_imap import make_message
+
+# Function with the previous parse path: every text part decoded (both alternatives) and HTML through BeautifulSoup
+def legacy_extract_text(email_bytes):
+    msg = BytesParser(policy=policy.default).parsebytes(email_bytes)
+    text_content = ""
+    for part in msg.walk():
+        if part.get_content_type() == 'text/plain':
+            text_content += part.get_payload(decode=True).decode(part.get_content_charset('utf-8'))
+        elif part.get_content_type() == 'text/html':
+            html_content = part.get_payload(decode=True).decode(part.get_content_charset('utf-8'))
+            text_content += BeautifulSoup(html_content, 'lxml').get_text()
+    return text_content
+
+def measure(name, messages, parse):
+    start = time.perf_counter()
+    chunks = parse()
+    seconds = time.perf_counter() - start
+    size = sum(len(raw) for _, raw in messages)
+    print(f"{name}: {len(messages) / seconds:.0f} emails/s, {chunks} chunks")
+    return {"seconds": seconds, "emails_per_s": len(messages) / seconds, "mb_per_s": size / (1024 * 1024) / seconds,
+            "chunks": chunks}
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure email parse throughput without IMAP")
+    parser.add_argument("--messages", type=int, default=5000, help="Number of synthetic emails (default: 5000)")
+    parser.add_argument("--attachment-kb", type=int, default=64, help="Size of the attachment on every third email (default: 64)")
+    parser.add_argument("--workers", type=int, default=0, help="Parse processes (default: CPU count)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    messages = [(uid, make_message(uid, rng, args.attachment_kb)) for uid in range(1, args.messages + 1)]
+    workers = args.workers or os.cpu_count() or 1
+    results = {"benchmark": "email_parse", "messages": args.messages,
+               "input_mb": sum(len(raw) for _, raw in messages) / (1024 * 1024), "workers": workers}
+
+    results["legacy"] = measure("legacy", messages, lambda: sum(
+        len(email_parse.chunk_email_text(legacy_extract_text(raw))) for _, raw in messages))
+    results["single_process"] = measure("single_process", messages, lambda: sum(
+        len(chunks) for _, chunks in email_parse.parse_batch(messages)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Start the workers before timing
+        list(pool.map(abs, range(workers)))
+        tasks = [messages[i:i + 20] for i in range(0, len(messages), 20)]
+        results["process_pool"] = measure("process_pool", messages, lambda: sum(
+            len(chunks) for batch in pool.map(email_parse.parse_batch, tasks) for _, chunks in batch))
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
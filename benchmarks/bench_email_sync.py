@@ -0,0 +1,73 @@
+import os
+import json
+import time
+import random
+import imaplib
+import argparse
+import tempfile
+import collect_emails
+from benchmarks.stub_imap import StubMailbox, StubIMAPServer, populate, make_message
+
+# Function to run one sync of the stub mailbox and return (seconds, emails processed)
+def run_sync(port, state, batch_size, text_only):
+    client = imaplib.IMAP4("127.0.0.1", port)
+    client.login("bench", "bench")
+    start = time.perf_counter()
+    try:
+        client.select("inbox", readonly=True)
+        count = collect_emails.search_and_process_emails(client, "Stub", "", None, None, state, "Stub:bench/inbox",
+                                                         batch_size, text_only)
+    finally:
+        client.logout()
+    return time.perf_counter() - start, count
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure email sync time against a local IMAP stand-in server")
+    parser.add_argument("--messages", type=int, default=2000, help="Emails in the mailbox (default: 2000)")
+    parser.add_argument("--new-messages", type=int, default=30, help="Emails added before the incremental run (default: 30)")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Simulated server round-trip time (default: 20)")
+    parser.add_argument("--batch-size", type=int, default=collect_emails.FETCH_BATCH_SIZE, help="UIDs per fetch")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    mailbox = StubMailbox()
+    populate(mailbox, args.messages)
+    server = StubIMAPServer(("127.0.0.1", 0), mailbox, args.latency_ms)
+    server.start()
+    port = server.server_address[1]
+
+    results = {"benchmark": "email_sync", "messages": args.messages, "latency_ms": args.latency_ms}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # collect_emails appends to vault.txt in the working directory
+        os.chdir(tmp_dir)
+        try:
+            runs = [
+                ("per_message_full", 1, False),
+                ("batched_full", args.batch_size, False),
+                ("batched_text_only", args.batch_size, True),
+            ]
+            for name, batch_size, text_only in runs:
+                state = collect_emails.SyncState(os.path.join(tmp_dir, f"{name}_state.json"))
+                seconds, count = run_sync(port, state, batch_size, text_only)
+                results[name] = {"seconds": seconds, "emails": count, "emails_per_s": count / seconds}
+                print(f"{name}: {count} emails in {seconds:.2f}s")
+
+            rng = random.Random(1)
+            for _ in range(args.new_messages):
+                mailbox.add_message(make_message(mailbox.next_uid, rng))
+            seconds, count = run_sync(port, state, args.batch_size, True)
+            results["incremental"] = {"seconds": seconds, "emails": count}
+            print(f"incremental: {count} new emails in {seconds:.2f}s")
+        finally:
+            os.chdir(cwd)
+            server.shutdown()
+            server.server_close()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+from embedding_store import save_embedding_store, load_embedding_store
+from quantization import QuantizedIndex, QUANTIZATIONS
+from retrieval import VaultRetriever
+
+# Function to generate clustered synthetic embeddings (topics with noise) so neighbours are meaningful
+def synthetic_embeddings(rows, dim, clusters=256, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    # A shared offset, like the non-zero mean of real embedding models
+    offset = rng.normal(scale=0.5, size=dim).astype(np.float32)
+    embeddings = np.empty((rows, dim), dtype=np.float32)
+    for start in range(0, rows, 65536):
+        count = min(65536, rows - start)
+        labels = rng.integers(clusters, size=count)
+        embeddings[start:start + count] = centers[labels] + offset + rng.normal(scale=0.8, size=(count, dim))
+    return embeddings
+
+# Function to build query embeddings as perturbed vault rows, like real in-distribution queries
+def synthetic_queries(embeddings, count, seed=1):
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(embeddings), size=count, replace=False)
+    queries = np.asarray(embeddings[np.sort(rows)], dtype=np.float32)
+    return queries + rng.normal(scale=0.3 * np.abs(queries).mean(), size=queries.shape).astype(np.float32)
+
+def recall(results, truth):
+    hits = sum(len(set(found).intersection(expected)) for (found, _), expected in zip(results, truth))
+    return hits / sum(len(expected) for expected in truth)
+
+# Function to time a search function over the queries, one query at a time as in the chat loop
+def timed_search(search, queries):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.extend(search([query.tolist()]))
+    return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare int8/binary search with rescoring against exact float search")
+    parser.add_argument("--rows", type=int, default=100000, help="Number of synthetic vault embeddings (default: 100000)")
+    parser.add_argument("--dim", type=int, default=1024, help="Embedding dimension (default: 1024, as mxbai-embed-large)")
+    parser.add_argument("--queries", type=int, default=100, help="Number of queries (default: 100)")
+    parser.add_argument("--top-k", type=int, default=10, help="k for recall@k (default: 10)")
+    parser.add_argument("--oversample", type=int, nargs="+", default=[1, 2, 4, 8], help="Oversampling factors to test")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store_path = os.path.join(tmp_dir, "vault_embeddings.bin")
+        print(f"Writing {args.rows} x {args.dim} synthetic embeddings...")
+        embeddings = synthetic_embeddings(args.rows, args.dim)
+        queries = synthetic_queries(embeddings, args.queries)
+        keys = [row.to_bytes(16, "little") for row in range(args.rows)]
+        save_embedding_store(store_path, embeddings, keys, "synthetic", "")
+        del embeddings
+        _, embeddings = load_embedding_store(store_path)
+
+        # Baseline: the exact float search used by get_relevant_context
+        retriever = VaultRetriever(embeddings)
+        exact, exact_ms = timed_search(lambda q: retriever.search(q, args.top_k), queries)
+        truth = [set(indices) for indices, _ in exact]
+        float_mb = embeddings.nbytes / (1024 * 1024)
+        print(f"exact float32      {float_mb:8.1f} MB  recall@{args.top_k}=1.000  {exact_ms:8.2f} ms/query")
+        results = {"benchmark": "quantization", "rows": args.rows, "dim": args.dim, "top_k": args.top_k,
+                   "exact": {"memory_mb": float_mb, "latency_ms": exact_ms, "recall": 1.0}}
+
+        for kind in QUANTIZATIONS:
+            start = time.perf_counter()
+            index = QuantizedIndex.build(embeddings, kind)
+            build_s = time.perf_counter() - start
+            memory_mb = index.nbytes / (1024 * 1024)
+            results[kind] = {"memory_mb": memory_mb, "build_s": build_s, "oversample": []}
+            for oversample in args.oversample:
+                found, latency_ms = timed_search(
+                    lambda q: [(i.tolist(), s.tolist()) for i, s in index.search(q, embeddings, args.top_k, oversample)],
+                    queries)
+                kind_recall = recall(found, truth)
+                results[kind]["oversample"].append({"oversample": oversample, "recall": kind_recall, "latency_ms": latency_ms})
+                print(f"{kind:<6} oversample={oversample:<3} {memory_mb:8.1f} MB  recall@{args.top_k}={kind_recall:.3f}  "
+                      f"{latency_ms:8.2f} ms/query")
+        del retriever, embeddings
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
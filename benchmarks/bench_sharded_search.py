@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+from embedding_store import save_embedding_store, load_embedding_store, KEY_SIZE
+from sharded_search import ShardedBackend
+from vector_backend import NumpyBackend
+from benchmarks.synthetic import SyntheticEmbeddings
+
+# Scaling of the sharded exact search from 1 to N worker processes on a synthetic memory-mapped store,
+# against the single-process NumPy search. Every configuration answers the same queries, and the results
+# are checked against the single-process top-k. Scaling flattens once the shards together saturate the
+# memory bandwidth, so compare --rows large enough that the store does not fit in the CPU caches.
+
+def default_workers():
+    counts, workers = [], 1
+    while workers < (os.cpu_count() or 1):
+        counts.append(workers)
+        workers *= 2
+    return counts + [os.cpu_count() or 1]
+
+def time_searches(backend, matrix, inv_norms, queries, top_k, batch):
+    seconds, results = [], []
+    for start in range(0, len(queries), batch):
+        begin = time.perf_counter()
+        results += backend.top_k(matrix, inv_norms, queries[start:start + batch], top_k)
+        seconds.append(time.perf_counter() - begin)
+    return np.asarray(seconds), results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sharded multi-process search from 1 to N workers")
+    parser.add_argument("--rows", type=int, default=1000000, help="Rows in the synthetic store (default: 1000000)")
+    parser.add_argument("--dim", type=int, default=1024, help="Embedding dimension (default: 1024)")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32", help="Store dtype (default: float32)")
+    parser.add_argument("--workers", type=int, nargs="+", default=default_workers(), help="Worker counts to time (default: 1 2 4 ... cores)")
+    parser.add_argument("--queries", type=int, default=50, help="Queries per configuration (default: 50)")
+    parser.add_argument("--batch", type=int, default=1, help="Queries per search call (default: 1, as in chat)")
+    parser.add_argument("--top-k", type=int, default=10, help="Results per query (default: 10)")
+    parser.add_argument("--store", help="Reuse or keep the synthetic store at this path (default: a temporary file)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    temp_dir = None if args.store else tempfile.TemporaryDirectory()
+    store_path = args.store or os.path.join(temp_dir.name, "store.bin")
+    if not os.path.exists(store_path):
+        print(f"Writing a synthetic store with {args.rows} x {args.dim} {args.dtype} rows...")
+        save_embedding_store(store_path, SyntheticEmbeddings(args.rows, args.dim), [b"\0" * KEY_SIZE] * args.rows,
+                             "synthetic", "", args.dtype)
+    _, matrix = load_embedding_store(store_path)
+    queries = SyntheticEmbeddings(args.queries, args.dim, seed=1)[0:args.queries]
+
+    baseline = NumpyBackend()
+    start = time.perf_counter()
+    base_matrix, base_norms = baseline.prepare(matrix)
+    prepare_s = time.perf_counter() - start
+    time_searches(baseline, base_matrix, base_norms, queries[:args.batch], args.top_k, args.batch)
+    seconds, expected = time_searches(baseline, base_matrix, base_norms, queries, args.top_k, args.batch)
+    results = {"rows": len(matrix), "dim": args.dim, "dtype": args.dtype, "batch": args.batch, "cpus": os.cpu_count(),
+               "single_process": {"prepare_s": prepare_s, "p50_ms": float(np.median(seconds) * 1000)}, "sharded": []}
+    print(f"single process      prepare {prepare_s:6.2f}s  search p50 {results['single_process']['p50_ms']:8.2f} ms")
+
+    one_worker_ms = None
+    for workers in args.workers:
+        backend = ShardedBackend(workers)
+        start = time.perf_counter()
+        shard_matrix, shard_norms = backend.prepare(matrix)
+        prepare_s = time.perf_counter() - start
+        time_searches(backend, shard_matrix, shard_norms, queries[:args.batch], args.top_k, args.batch)
+        seconds, found = time_searches(backend, shard_matrix, shard_norms, queries, args.top_k, args.batch)
+        backend.close()
+        p50_ms = float(np.median(seconds) * 1000)
+        one_worker_ms = one_worker_ms or p50_ms
+        matches = np.mean([set(a[0]) == set(b[0]) for a, b in zip(found, expected)])
+        result = {"workers": workers, "prepare_s": prepare_s, "p50_ms": p50_ms,
+                  "queries_per_s": args.queries / seconds.sum(), "speedup": one_worker_ms / p50_ms,
+                  "efficiency": one_worker_ms / p50_ms / workers, "same_top_k": float(matches)}
+        results["sharded"].append(result)
+        print(f"{workers:3d} workers  prepare {prepare_s:6.2f}s  search p50 {p50_ms:8.2f} ms  "
+              f"speedup {result['speedup']:5.2f}x  efficiency {100 * result['efficiency']:5.1f}%  same top-k {100 * matches:.0f}%")
+
+    del matrix, base_matrix
+    if temp_dir is not None:
+        temp_dir.cleanup()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
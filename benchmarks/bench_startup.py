@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import statistics
+import yaml
+from benchmarks.stub_ollama import StubOllamaServer
+from benchmarks.synthetic import write_synthetic_corpus
+
+# Cold-start benchmark: how long each chat script takes from launch to its first "Ask a question" prompt,
+# and the peak resident memory of the process, for each vector backend. The scripts run as fresh
+# processes on a synthetic vault whose embedding store is already built, against the stub Ollama server,
+# so the numbers are the import, load and index time a user waits for before they can type.
+# Run from the repository root: python -m benchmarks.bench_startup
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = ("localrag.py", "localrag_no_rewrite.py", "emailrag2.py")
+BACKENDS = ("numpy", "torch")
+PROMPT_MARKER = b"(or type 'quit' to exit)"
+EMBEDDING_MODEL = "mxbai-embed-large"
+
+# Function to build the command line of a script for a backend (emailrag2 reads it from its config file)
+def script_command(script, backend, work_dir, python_args=()):
+    command = [sys.executable, *python_args, os.path.join(REPO_DIR, script)]
+    if script == "emailrag2.py":
+        config_path = os.path.join(work_dir, f"config_{backend}.yaml")
+        with open(os.path.join(REPO_DIR, "config.yaml"), "r", encoding="utf-8") as file:
+            config = yaml.safe_load(file)
+        config.update(vector_backend=backend, query_cache_file="", trace_file="", metrics_port=0)
+        with open(config_path, "w", encoding="utf-8") as file:
+            yaml.safe_dump(config, file)
+        return command + ["--config", config_path]
+    return command + ["--backend", backend]
+
+# Function to run a script until it shows its prompt, then quit it: returns (seconds to prompt, peak RSS in MB, stderr)
+def run_to_prompt(command, work_dir, env, timeout):
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=work_dir, env=env, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # Set when the prompt shows up or stdout closes (the script exited early)
+    waited = threading.Event()
+    prompted = []
+    stderr = []
+
+    def read_stdout():
+        output = b""
+        while True:
+            data = os.read(process.stdout.fileno(), 65536)
+            if not data:
+                waited.set()
+                return
+            if not waited.is_set():
+                output = output[-len(PROMPT_MARKER):] + data
+                if PROMPT_MARKER in output:
+                    prompted.append(time.perf_counter() - start)
+                    waited.set()
+
+    readers = [threading.Thread(target=read_stdout, daemon=True),
+               threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)]
+    for reader in readers:
+        reader.start()
+    waited.wait(timeout)
+    seconds = prompted[0] if prompted else None
+    try:
+        process.stdin.write(b"quit\n")
+        process.stdin.close()
+    except OSError:
+        pass
+    if seconds is None:
+        process.kill()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    for reader in readers:
+        reader.join(5)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return seconds, peak_mb, b"".join(stderr).decode("utf-8", "replace")
+
+# Function to list the slowest imports from the stderr of a python -X importtime run
+def slowest_imports(stderr, count):
+    imports = []
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit() and not name.startswith("  "):
+                imports.append((int(cumulative) / 1000, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold start to the first prompt and peak RSS of the chat scripts")
+    parser.add_argument("--scripts", nargs="+", choices=SCRIPTS, default=list(SCRIPTS), help="Scripts to start (default: all)")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS), help="Vector backends to compare (default: numpy torch)")
+    parser.add_argument("--rows", type=int, default=10000, help="Chunks in the synthetic vault (default: 10000)")
+    parser.add_argument("--dim", type=int, default=1024, help="Embedding dimension (default: 1024)")
+    parser.add_argument("--runs", type=int, default=5, help="Timed starts per script and backend (default: 5)")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for a prompt (default: 300)")
+    parser.add_argument("--importtime", type=int, default=0, metavar="N", help="Also list the N slowest top-level imports of each script")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    stub = StubOllamaServer(("127.0.0.1", 0), args.dim)
+    stub.start()
+    env = dict(os.environ, OLLAMA_HOST=stub.url, PYTHONUNBUFFERED="1")
+    env.pop("RAG_TRACE_FILE", None)
+    env.pop("RAG_METRICS_PORT", None)
+    results = {"rows": args.rows, "dim": args.dim, "runs": args.runs, "results": []}
+    with tempfile.TemporaryDirectory() as work_dir:
+        print(f"Writing synthetic vault with {args.rows} chunks...")
+        write_synthetic_corpus(os.path.join(work_dir, "vault.txt"), os.path.join(work_dir, "vault_embeddings.bin"),
+                               args.rows, args.dim, EMBEDDING_MODEL)
+        try:
+            for script in args.scripts:
+                for backend in args.backends:
+                    command = script_command(script, backend, work_dir)
+                    # Untimed first start builds the BM25 index and warms the page cache
+                    seconds, _, stderr = run_to_prompt(command, work_dir, env, args.timeout)
+                    if seconds is None:
+                        print(f"{script} --backend {backend} did not reach its prompt:\n{stderr[-2000:]}")
+                        continue
+                    starts, peaks = [], []
+                    for _ in range(args.runs):
+                        seconds, peak_mb, _ = run_to_prompt(command, work_dir, env, args.timeout)
+                        starts.append(seconds)
+                        peaks.append(peak_mb)
+                    result = {"script": script, "backend": backend, "median_s": statistics.median(starts),
+                              "min_s": min(starts), "max_s": max(starts), "peak_rss_mb": max(peaks)}
+                    if args.importtime:
+                        _, _, stderr = run_to_prompt(script_command(script, backend, work_dir, ("-X", "importtime")),
+                                                     work_dir, env, args.timeout)
+                        result["slowest_imports"] = slowest_imports(stderr, args.importtime)
+                    print(f"{script:<24} {backend:<6} to prompt median {result['median_s']:.2f}s "
+                          f"(min {result['min_s']:.2f}s)  peak RSS {result['peak_rss_mb']:.0f} MB")
+                    for import_ms, name in result.get("slowest_imports", []):
+                        print(f"    {import_ms:8.1f} ms  {name}")
+                    results["results"].append(result)
+        finally:
+            stub.shutdown()
+            stub.server_close()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from vault_store import VaultStore, offsets_path_for
+
+WORDS = ("invoice", "meeting", "report", "quarterly", "budget", "email", "project", "deadline",
+         "customer", "update", "review", "team", "schedule", "payment", "contract", "draft")
+
+# Function to write a synthetic vault of roughly size_mb megabytes, one chunk of up to 1000 characters per line
+def write_synthetic_vault(path, size_mb, seed=0):
+    rng = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    written = 0
+    lines = 0
+    with open(path, "w", encoding="utf-8") as file:
+        while written < target:
+            block = "".join(" ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 140))) + ".\n"
+                            for _ in range(1000))
+            file.write(block)
+            written += len(block)
+            lines += 1000
+    return written, lines
+
+# Function to measure the Python memory held after load() and how long it took
+def measure_load(load):
+    tracemalloc.start()
+    start = time.perf_counter()
+    content = load()
+    seconds = time.perf_counter() - start
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return content, seconds, held / (1024 * 1024)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare readlines() with the indexed vault store")
+    parser.add_argument("--size-mb", type=int, default=512, help="Size of the synthetic vault in MB (default: 512)")
+    parser.add_argument("--reads", type=int, default=10000, help="Random row reads to time (default: 10000)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        vault_path = os.path.join(tmp_dir, "vault.txt")
+        print(f"Writing {args.size_mb} MB synthetic vault...")
+        size, lines = write_synthetic_vault(vault_path, args.size_mb)
+
+        def readlines():
+            with open(vault_path, "r", encoding="utf-8") as vault_file:
+                return vault_file.readlines()
+
+        content, readlines_s, readlines_mb = measure_load(readlines)
+        del content
+        store, build_s, _ = measure_load(lambda: VaultStore(vault_path))
+        store.close()
+        store, open_s, store_mb = measure_load(lambda: VaultStore(vault_path))
+
+        rng = random.Random(1)
+        rows = [rng.randrange(len(store)) for _ in range(args.reads)]
+        start = time.perf_counter()
+        for row in rows:
+            store.text(row)
+        read_us = (time.perf_counter() - start) / args.reads * 1e6
+
+        results = {
+            "benchmark": "vault_store",
+            "vault_mb": size / (1024 * 1024),
+            "rows": len(store),
+            "readlines_s": readlines_s,
+            "readlines_python_mb": readlines_mb,
+            "index_build_s": build_s,
+            "index_mb": os.path.getsize(offsets_path_for(vault_path)) / (1024 * 1024),
+            "store_open_s": open_s,
+            "store_python_mb": store_mb,
+            "random_read_us": read_us,
+        }
+        store.close()
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
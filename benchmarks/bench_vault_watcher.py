@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import numpy as np
+from bm25_index import load_or_build_bm25
+from embedding_store import load_or_build_embeddings
+from retrieval import VaultRetriever
+from vault_store import VaultStore, append_records
+from vault_watcher import VaultWatcher
+from benchmarks.stub_ollama import stub_embedding
+from benchmarks.synthetic import write_synthetic_corpus, synthetic_chunk
+
+# Live vault watching on a synthetic vault: records are appended in batches (as upload.py or
+# collect_emails.py would) while the main thread keeps searching, hybrid retrieval as in the chat
+# scripts. Reports the freshness lag (ingest to searchable) and the cost of each update, the search
+# latency while updates are applied against an idle baseline, and the restart a user needed before:
+# reopening the vault and reloading the embeddings and lexical index. Embedding goes through the stub
+# embedder with --embed-ms of simulated Ollama time per batch.
+# Run from the repository root: python -m benchmarks.bench_vault_watcher
+EMBEDDING_MODEL = "mxbai-embed-large"
+
+def percentiles(values):
+    values = np.asarray(values) * 1000
+    if not len(values):
+        return {"p50_ms": 0.0, "p99_ms": 0.0}
+    return {"p50_ms": float(np.percentile(values, 50)), "p99_ms": float(np.percentile(values, 99))}
+
+# Function to time searches against the latest epoch until stop is set (or count searches are done)
+def run_searches(watcher, queries, top_k, stop=None, count=None):
+    seconds, i = [], 0
+    while (stop is None or not stop.is_set()) and (count is None or i < count):
+        text, embedding = queries[i % len(queries)]
+        retriever = watcher.current.retriever
+        start = time.perf_counter()
+        retriever.fuse_lexical([text], retriever.search_merged([embedding], top_k * 4), top_k)
+        seconds.append(time.perf_counter() - start)
+        i += 1
+    return seconds
+
+# Function to load everything a chat script loads at startup, as a restart after new records would
+def restart(vault_path, store_path, dim):
+    start = time.perf_counter()
+    store = VaultStore(vault_path)
+    embeddings = load_or_build_embeddings(store, store_path, EMBEDDING_MODEL, lambda texts: [stub_embedding(text, dim) for text in texts])
+    lexical_index = load_or_build_bm25(store, vault_path + ".bm25.npz")
+    VaultRetriever(embeddings, EMBEDDING_MODEL, None, None, lexical_index, "hybrid")
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure freshness lag, update cost and search latency of live vault watching")
+    parser.add_argument("--rows", type=int, default=100000, help="Chunks in the synthetic vault at start (default: 100000)")
+    parser.add_argument("--dim", type=int, default=1024, help="Embedding dimension (default: 1024)")
+    parser.add_argument("--batches", type=int, default=20, help="Batches of records appended while searching (default: 20)")
+    parser.add_argument("--batch-rows", type=int, default=50, help="Records per appended batch (default: 50)")
+    parser.add_argument("--append-interval", type=float, default=0.5, help="Seconds between appended batches (default: 0.5)")
+    parser.add_argument("--watch-interval", type=float, default=0.2, help="Seconds between checks of the vault (default: 0.2)")
+    parser.add_argument("--embed-ms", type=float, default=0, help="Simulated Ollama time per embedding call (default: 0)")
+    parser.add_argument("--top-k", type=int, default=7, help="Results per search (default: 7)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        vault_path = os.path.join(work_dir, "vault.txt")
+        store_path = os.path.join(work_dir, "vault_embeddings.bin")
+        print(f"Writing synthetic vault with {args.rows} chunks...")
+        write_synthetic_corpus(vault_path, store_path, args.rows, args.dim, EMBEDDING_MODEL)
+        restart(vault_path, store_path, args.dim)
+
+        def embed(texts):
+            time.sleep(args.embed_ms / 1000)
+            return [stub_embedding(text, args.dim) for text in texts]
+
+        vault_content = VaultStore(vault_path)
+        embeddings = load_or_build_embeddings(vault_content, store_path, EMBEDDING_MODEL, embed)
+        lexical_index = load_or_build_bm25(vault_content, vault_path + ".bm25.npz")
+        retriever = VaultRetriever(embeddings, EMBEDDING_MODEL, None, None, lexical_index, "hybrid")
+        updates = []
+        watcher = VaultWatcher(vault_path, store_path, retriever, vault_content, embed, args.watch_interval,
+                               lambda snapshot: updates.append((watcher.last_lag_s, watcher.last_update_s)))
+        rng = random.Random(1)
+        queries = [(text, stub_embedding(text, args.dim)) for text in (synthetic_chunk(rng, 20) for _ in range(50))]
+        idle = run_searches(watcher, queries, args.top_k, count=200)
+
+        done = threading.Event()
+
+        def append_batches():
+            for _ in range(args.batches):
+                append_records(vault_path, [synthetic_chunk(rng, 150) for _ in range(args.batch_rows)], {"source": "bench"})
+                time.sleep(args.append_interval)
+            # Wait until the watcher has indexed the last batch
+            while len(watcher.current.vault_content) < args.rows + args.batches * args.batch_rows and not watcher.errors:
+                time.sleep(0.01)
+            done.set()
+
+        watcher.start()
+        appender = threading.Thread(target=append_batches)
+        appender.start()
+        busy = run_searches(watcher, queries, args.top_k, stop=done)
+        appender.join()
+        watcher.stop()
+        stats = watcher.stats()
+        restart_s = restart(vault_path, store_path, args.dim)
+
+    lags = [lag for lag, _ in updates]
+    costs = [seconds for _, seconds in updates]
+    results = {"rows": args.rows, "dim": args.dim, "rows_added": stats["rows_added"], "updates": stats["updates"],
+               "errors": stats["errors"], "freshness_lag": percentiles(lags), "update_cost": percentiles(costs),
+               "search_idle": percentiles(idle), "search_during_updates": percentiles(busy), "restart_s": restart_s}
+    print(f"{stats['rows_added']} chunks added to {args.rows} in {stats['updates']} updates ({stats['errors']} errors)")
+    print(f"  freshness lag   p50 {results['freshness_lag']['p50_ms']:.0f} ms  p99 {results['freshness_lag']['p99_ms']:.0f} ms")
+    print(f"  update cost     p50 {results['update_cost']['p50_ms']:.1f} ms  p99 {results['update_cost']['p99_ms']:.1f} ms")
+    print(f"  search idle     p50 {results['search_idle']['p50_ms']:.2f} ms  p99 {results['search_idle']['p99_ms']:.2f} ms")
+    print(f"  search updating p50 {results['search_during_updates']['p50_ms']:.2f} ms  "
+          f"p99 {results['search_during_updates']['p99_ms']:.2f} ms")
+    print(f"  restart to pick up new records instead: {restart_s:.2f}s")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+import httpx
+
+QUESTIONS = ("What did the invoice from last quarter say?", "When is the project deadline?",
+             "Summarize the meeting notes about the budget.", "Who reviewed the contract draft?",
+             "What payment terms were agreed with the customer?", "Which team owns the schedule update?",
+             "List the open items from the quarterly report.", "What changed in the latest draft?")
+
+# Function to return the given percentile of a sorted list of latencies
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+# One simulated user: sends requests back to back over its own keep-alive connection, keeping its chat session
+async def run_user(client, user, args, latencies, errors, rng):
+    session = f"load-test-{user}"
+    for i in range(args.requests):
+        question = rng.choice(QUESTIONS)
+        if args.unique:
+            # Distinct text per request so every query needs an embedding instead of a cache hit
+            question += f" (user {user}, request {i})"
+        if args.endpoint == "chat":
+            path, body = "/chat", {"session": session, "message": question}
+        else:
+            path, body = "/query", {"query": question}
+        start = time.perf_counter()
+        try:
+            response = await client.post(path, json=body)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        except httpx.HTTPError as e:
+            errors.append(str(e))
+    if args.endpoint == "chat":
+        await client.delete(f"/sessions/{session}")
+
+async def run(args):
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        before = (await client.get("/stats")).json()
+        start = time.perf_counter()
+        await asyncio.gather(*(run_user(client, user, args, latencies, errors, random.Random(user))
+                               for user in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        after = (await client.get("/stats")).json()
+
+    latencies.sort()
+    embedding_requests = after["embedding"]["requests"] - before["embedding"]["requests"]
+    embedded_texts = after["embedding"]["batched_texts"] - before["embedding"]["batched_texts"]
+    return {
+        "benchmark": "rag_server",
+        "endpoint": args.endpoint,
+        "concurrency": args.concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "seconds": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+        "embedding_requests": embedding_requests,
+        "avg_embedding_batch": embedded_texts / embedding_requests if embedding_requests else 0.0,
+        "first_error": errors[0] if errors else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for rag_server.py: throughput and latency percentiles")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Server URL (default: http://127.0.0.1:8000)")
+    parser.add_argument("--endpoint", choices=["query", "chat"], default="query", help="Endpoint to load (default: query)")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent users (default: 32)")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per user (default: 20)")
+    parser.add_argument("--unique", action="store_true", help="Make every question distinct so the query embedding cache never hits")
+    parser.add_argument("--timeout", type=float, default=120, help="Request timeout in seconds (default: 120)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import io
+import os
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import numpy as np
+import ollama
+from openai import OpenAI
+from ann_index import IVFIndex
+from bm25_index import BM25Index
+from embedder import BatchEmbedder
+from embedding_store import load_or_build_embeddings
+from ingest import ingest_files
+from quantization import QuantizedIndex
+from retrieval import VaultRetriever
+from streaming import stream_chat_completion
+from vault_store import VaultStore
+from benchmarks.bench_chunking import write_synthetic_document
+from benchmarks.stub_ollama import StubOllamaServer
+from benchmarks.synthetic import write_synthetic_corpus, synthetic_chunk
+
+# Offline benchmark suite: everything runs against the stub Ollama server and synthetic data, so results
+# are comparable between runs and machines without network access or models. Each benchmark adds one
+# section to the results JSON; --compare prints the change of every metric against an earlier run.
+BENCHMARKS = ("ingest", "embedding", "cache_load", "retrieval", "chat")
+INDEXES = ("exact", "ann", "int8", "binary")
+EMBEDDING_MODEL = "mxbai-embed-large"
+QUESTIONS = ("What is the status of the project deadline?", "Which invoice is overdue?",
+             "Summarize the quarterly budget report.", "Who attended the meeting?",
+             "What were the renewal terms of the contract?", "Was there an outage after the release?")
+
+def percentiles(seconds):
+    values = np.asarray(seconds) * 1000
+    return {"p50_ms": float(np.percentile(values, 50)), "p99_ms": float(np.percentile(values, 99)),
+            "mean_ms": float(values.mean())}
+
+def bench_ingest(args, work_dir, stub):
+    document = os.path.join(work_dir, "ingest_input.txt")
+    vault_path = os.path.join(work_dir, "ingest_vault.txt")
+    size = write_synthetic_document(document, args.ingest_mb)
+    stats = ingest_files([document], vault_path, os.path.join(work_dir, "ingest_manifest.json"), workers=1)
+    return {"input_mb": size / (1024 * 1024), "chunks": stats["chunks"], "seconds": stats["seconds"],
+            "mb_per_s": size / (1024 * 1024) / stats["seconds"], "chunks_per_s": stats["chunks"] / stats["seconds"]}
+
+def bench_embedding(args, work_dir, stub):
+    rng = random.Random(0)
+    texts = [synthetic_chunk(rng) for _ in range(args.embed_chunks)]
+    results = {"chunks": len(texts)}
+    # One request per chunk, as the scripts used to embed the vault, against the batching embedder
+    for name, batch_size, concurrency, count in (("per_chunk", 1, 1, min(len(texts), 500)),
+                                                 ("batched", 32, 4, len(texts))):
+        embedder = BatchEmbedder(EMBEDDING_MODEL, batch_size=batch_size, concurrency=concurrency, host=stub.url)
+        start = time.perf_counter()
+        embedder.embed(texts[:count], show_progress=False)
+        seconds = time.perf_counter() - start
+        results[name] = {"chunks": count, "seconds": seconds, "chunks_per_s": count / seconds}
+    return results
+
+def corpus_paths(work_dir, rows, args):
+    vault_path = os.path.join(work_dir, f"vault_{rows}.txt")
+    store_path = os.path.join(work_dir, f"vault_{rows}.bin")
+    if not os.path.exists(store_path):
+        print(f"Writing synthetic vault with {rows} chunks...")
+        write_synthetic_corpus(vault_path, store_path, rows, args.dim, EMBEDDING_MODEL)
+    return vault_path, store_path
+
+def no_embedding(texts):
+    raise RuntimeError("The synthetic embedding store should cover every chunk")
+
+def bench_cache_load(args, work_dir, stub):
+    results = []
+    for rows in args.sizes:
+        vault_path, store_path = corpus_paths(work_dir, rows, args)
+        start = time.perf_counter()
+        vault_content = VaultStore(vault_path)
+        embeddings = load_or_build_embeddings(vault_content, store_path, EMBEDDING_MODEL, no_embedding)
+        seconds = time.perf_counter() - start
+        results.append({"rows": rows, "seconds": seconds, "store_mb": os.path.getsize(store_path) / (1024 * 1024)})
+        del embeddings
+        vault_content.close()
+    return results
+
+def build_retriever(index, embeddings, vault_content):
+    if index == "ann":
+        return VaultRetriever(embeddings, EMBEDDING_MODEL, ann_index=IVFIndex.build(embeddings))
+    if index in ("int8", "binary"):
+        return VaultRetriever(embeddings, EMBEDDING_MODEL, quantized_index=QuantizedIndex.build(embeddings, index))
+    if index == "hybrid":
+        lexical_index = BM25Index()
+        lexical_index.add_documents(vault_content)
+        return VaultRetriever(embeddings, EMBEDDING_MODEL, lexical_index=lexical_index, mode="hybrid")
+    return VaultRetriever(embeddings, EMBEDDING_MODEL)
+
+def bench_retrieval(args, work_dir, stub):
+    client = ollama.Client(host=stub.url)
+    rng = random.Random(1)
+    queries = [rng.choice(QUESTIONS) + f" #{i}" for i in range(args.queries)]
+    results = []
+    for rows in args.sizes:
+        vault_path, store_path = corpus_paths(work_dir, rows, args)
+        vault_content = VaultStore(vault_path)
+        embeddings = load_or_build_embeddings(vault_content, store_path, EMBEDDING_MODEL, no_embedding)
+        for index in args.indexes:
+            retriever = build_retriever(index, embeddings, vault_content)
+            embed_s, search_s, total_s = [], [], []
+            for query in queries:
+                start = time.perf_counter()
+                embedding = client.embed(model=EMBEDDING_MODEL, input=[query])["embeddings"]
+                embedded = time.perf_counter()
+                top_indices = retriever.fuse_lexical([query], retriever.search_merged(embedding, args.top_k), args.top_k)
+                [vault_content[idx].strip() for idx in top_indices]
+                end = time.perf_counter()
+                embed_s.append(embedded - start)
+                search_s.append(end - embedded)
+                total_s.append(end - start)
+            result = {"rows": rows, "index": index, **percentiles(total_s),
+                      "search": percentiles(search_s), "embed": percentiles(embed_s)}
+            print(f"retrieval rows={rows:<9} {index:<7} p50={result['p50_ms']:8.2f} ms  p99={result['p99_ms']:8.2f} ms  "
+                  f"(search p50={result['search']['p50_ms']:.2f} ms)")
+            results.append(result)
+            del retriever
+        del embeddings
+        vault_content.close()
+    return results
+
+def bench_chat(args, work_dir, stub):
+    client = OpenAI(base_url=stub.url + "/v1", api_key="stub")
+    messages = [{"role": "system", "content": "You are a helpful assistant"},
+                {"role": "user", "content": "Summarize the quarterly budget report.\n\nRelevant Context:\n" +
+                 "\n".join(synthetic_chunk(random.Random(i)) for i in range(3))}]
+    ttft, total, tokens_per_s = [], [], []
+    for _ in range(args.chat_turns):
+        _, stats = stream_chat_completion(client, "llama3", messages, out=io.StringIO(), max_tokens=2000)
+        ttft.append(stats["ttft_s"])
+        total.append(stats["total_s"])
+        tokens_per_s.append(stats["tokens_per_s"])
+    return {"turns": args.chat_turns, "ttft": percentiles(ttft), "total": percentiles(total),
+            "tokens_per_s": float(np.mean(tokens_per_s))}
+
+# Function to flatten the results into {"section.rows=N.index=X.metric": value} for comparison
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        items = {}
+        for key, child in value.items():
+            items.update(flatten(child, f"{prefix}.{key}" if prefix else key))
+        return items
+    if isinstance(value, list):
+        items = {}
+        for i, child in enumerate(value):
+            label = ".".join(f"{key}={child[key]}" for key in ("rows", "index") if isinstance(child, dict) and key in child)
+            items.update(flatten(child, f"{prefix}.{label or i}"))
+        return items
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+def compare(previous, current):
+    before, after = flatten(previous), flatten(current)
+    print(f"{'metric':<60} {'before':>12} {'after':>12} {'change':>8}")
+    for key in sorted(before.keys() & after.keys()):
+        if key.startswith(("config.", "platform.")) or key.rsplit(".", 1)[-1] in ("rows", "index"):
+            continue
+        change = f"{100 * (after[key] / before[key] - 1):+.1f}%" if before[key] else ""
+        print(f"{key:<60} {before[key]:>12.4g} {after[key]:>12.4g} {change:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite against a stub Ollama server")
+    parser.add_argument("--benchmarks", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS), help="Benchmarks to run (default: all)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Vault sizes in chunks for cache_load and retrieval (default: 1000 10000 100000, up to 10M with enough disk)")
+    parser.add_argument("--dim", type=int, default=1024, help="Embedding dimension of the synthetic vaults (default: 1024)")
+    parser.add_argument("--indexes", nargs="+", choices=INDEXES + ("hybrid",), default=["exact"], help="Retrieval variants to time: exact, ann, int8, binary or hybrid (default: exact)")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per retrieval benchmark (default: 200)")
+    parser.add_argument("--top-k", type=int, default=3, help="Chunks retrieved per query (default: 3)")
+    parser.add_argument("--ingest-mb", type=int, default=16, help="Size of the document for the ingest benchmark (default: 16)")
+    parser.add_argument("--embed-chunks", type=int, default=2000, help="Chunks for the embedding benchmark (default: 2000)")
+    parser.add_argument("--chat-turns", type=int, default=20, help="Streamed chat turns (default: 20)")
+    parser.add_argument("--embed-latency-ms", type=float, default=2, help="Stub latency per embedding request (default: 2)")
+    parser.add_argument("--embed-item-ms", type=float, default=0.2, help="Stub latency per embedded text (default: 0.2)")
+    parser.add_argument("--chat-latency-ms", type=float, default=20, help="Stub latency before the first chat token (default: 20)")
+    parser.add_argument("--token-latency-ms", type=float, default=1, help="Stub latency per chat token (default: 1)")
+    parser.add_argument("--work-dir", help="Keep the synthetic data in this directory (default: a temporary directory)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to compare against")
+    args = parser.parse_args()
+
+    stub = StubOllamaServer(("127.0.0.1", 0), args.dim, args.embed_latency_ms, args.embed_item_ms,
+                            args.chat_latency_ms, args.token_latency_ms)
+    stub.start()
+    results = {"suite": "easy-local-rag", "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "work_dir")},
+               "platform": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()}}
+    functions = {"ingest": bench_ingest, "embedding": bench_embedding, "cache_load": bench_cache_load,
+                 "retrieval": bench_retrieval, "chat": bench_chat}
+    temp_dir = None if args.work_dir else tempfile.TemporaryDirectory()
+    work_dir = args.work_dir or temp_dir.name
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        for name in args.benchmarks:
+            print(f"== {name} ==")
+            start = time.perf_counter()
+            results[name] = functions[name](args, work_dir, stub)
+            print(f"{name} finished in {time.perf_counter() - start:.1f}s")
+    finally:
+        stub.shutdown()
+        stub.server_close()
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            compare(json.load(file), results)
+
+if __name__ == "__main__":
+    main()
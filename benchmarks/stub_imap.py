@@ -0,0 +1,249 @@
+import re
+import time
+import random
+import argparse
+import threading
+import socketserver
+from datetime import datetime, timedelta, timezone
+from email import message_from_bytes
+from email.message import EmailMessage
+from email.utils import format_datetime, parsedate_to_datetime
+
+# Minimal IMAP4rev1 server holding one in-memory mailbox, for testing and benchmarking collect_emails.py
+# without a real account. It accepts any login and supports the commands the sync uses: CAPABILITY,
+# LOGIN, SELECT/EXAMINE, UID SEARCH (UID ranges and BODY, dates are ignored), UID FETCH (UID,
+# BODYSTRUCTURE, BODY[] / BODY.PEEK[] with HEADER, TEXT and part sections), NOOP and LOGOUT.
+# Point an account at it with e.g. GMAIL_IMAP_HOST=127.0.0.1 GMAIL_IMAP_PORT=1143 GMAIL_IMAP_SSL=0.
+WORDS = ("invoice", "meeting", "report", "quarterly", "budget", "email", "project", "deadline",
+         "customer", "update", "review", "team", "schedule", "payment", "contract", "draft")
+FETCH_ITEM = re.compile(rb'BODY(?:\.PEEK)?\[([^\]]*)\]|BODYSTRUCTURE|INTERNALDATE|UID', re.I)
+SEARCH_TOKEN = re.compile(rb'"((?:[^"\\]|\\.)*)"|[^\s()]+')
+
+# Function to build a synthetic email: plain text, plain + HTML alternative, or with an attachment
+def make_message(index, rng, attachment_kb=64):
+    body = ". ".join(" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 20))).capitalize()
+                     for _ in range(rng.randint(3, 12))) + "."
+    msg = EmailMessage()
+    msg["From"] = f"sender{index % 17}@example.com"
+    msg["To"] = "me@example.com"
+    msg["Subject"] = f"Message {index}"
+    msg["Date"] = format_datetime(datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(hours=index))
+    msg.set_content(body)
+    kind = index % 3
+    if kind >= 1:
+        msg.add_alternative(f"<html><body><p>{body}</p></body></html>", subtype="html")
+    if kind == 2 and attachment_kb:
+        msg.add_attachment(rng.randbytes(attachment_kb * 1024), maintype="application", subtype="octet-stream",
+                           filename=f"attachment{index}.bin")
+    return msg.as_bytes()
+
+def _quote(value):
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+# Function to render the BODYSTRUCTURE of a parsed message
+def body_structure(part):
+    if part.is_multipart():
+        return "(" + "".join(body_structure(p) for p in part.get_payload()) + f" {_quote(part.get_content_subtype())})"
+    params = part.get_params()[1:] if part.get_params() else []
+    params = "(" + " ".join(f"{_quote(k)} {_quote(v)}" for k, v in params) + ")" if params else "NIL"
+    payload = part.get_payload().encode("ascii", "surrogateescape")
+    encoding = part.get("Content-Transfer-Encoding", "7bit")
+    fields = f"{_quote(part.get_content_maintype())} {_quote(part.get_content_subtype())} {params} NIL NIL {_quote(encoding)} {len(payload)}"
+    if part.get_content_maintype() == "text":
+        lines = payload.count(b"\n")
+        fields += f" {lines}"
+    disposition = part.get_content_disposition()
+    fields += f" NIL ({_quote(disposition)} NIL) NIL NIL" if disposition else " NIL NIL NIL NIL"
+    return f"({fields})"
+
+# Function to return the bytes of a body section ("", "HEADER", "TEXT" or a part number like "1.2")
+def body_section(raw, section):
+    header, _, text = raw.partition(b"\r\n\r\n") if b"\r\n\r\n" in raw else raw.partition(b"\n\n")
+    section = section.upper()
+    if section == "":
+        return raw
+    if section == "HEADER":
+        return header + b"\r\n\r\n"
+    if section == "TEXT":
+        return text
+    part = message_from_bytes(raw)
+    for number in section.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(number) - 1]
+    return part.get_payload().encode("ascii", "surrogateescape")
+
+# Function to render the INTERNALDATE of a message from its Date header
+def internal_date(raw):
+    try:
+        date = parsedate_to_datetime(message_from_bytes(raw)["Date"])
+    except (TypeError, ValueError):
+        date = datetime.now(timezone.utc)
+    return date.strftime("%d-%b-%Y %H:%M:%S %z")
+
+# Function to expand an IMAP UID set like "1:3,7,9:*" against the UIDs in the mailbox
+def match_uid_set(uid_set, uids):
+    max_uid = uids[-1] if uids else 0
+    wanted = []
+    for item in uid_set.split(","):
+        first, _, last = item.partition(":")
+        first = max_uid if first == "*" else int(first)
+        last = first if not last else max_uid if last == "*" else int(last)
+        wanted.append((min(first, last), max(first, last)))
+    return [uid for uid in uids if any(a <= uid <= b for a, b in wanted)]
+
+class StubMailbox:
+    def __init__(self, uidvalidity=1):
+        self.uidvalidity = uidvalidity
+        self.messages = {}
+        self.next_uid = 1
+        self.lock = threading.Lock()
+
+    def add_message(self, raw):
+        with self.lock:
+            uid = self.next_uid
+            self.messages[uid] = raw
+            self.next_uid += 1
+            return uid
+
+class StubIMAPHandler(socketserver.StreamRequestHandler):
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def send(self, line):
+        self.wfile.write(line + b"\r\n")
+
+    def handle(self):
+        self.send(b"* OK [CAPABILITY IMAP4rev1] stub IMAP server ready")
+        self.wfile.flush()
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            tag, _, rest = line.strip().partition(b" ")
+            command, _, args = rest.partition(b" ")
+            command = command.upper()
+            if command == b"UID":
+                command, _, args = args.partition(b" ")
+                command = b"UID " + command.upper()
+            handler = {
+                b"CAPABILITY": self.capability, b"LOGIN": self.ok, b"NOOP": self.ok,
+                b"SELECT": self.select, b"EXAMINE": self.select,
+                b"UID SEARCH": self.uid_search, b"UID FETCH": self.uid_fetch,
+            }.get(command)
+            if command == b"LOGOUT":
+                self.send(b"* BYE logging out")
+                self.send(tag + b" OK LOGOUT completed")
+                self.wfile.flush()
+                return
+            if handler is None:
+                self.send(tag + b" BAD unsupported command")
+                self.wfile.flush()
+                continue
+            handler(args)
+            self.send(tag + b" OK " + command + b" completed")
+            self.wfile.flush()
+
+    def ok(self, args):
+        pass
+
+    def capability(self, args):
+        self.send(b"* CAPABILITY IMAP4rev1")
+
+    def select(self, args):
+        mailbox = self.server.mailbox
+        with mailbox.lock:
+            self.send(b"* %d EXISTS" % len(mailbox.messages))
+            self.send(b"* OK [UIDVALIDITY %d] UIDs valid" % mailbox.uidvalidity)
+            self.send(b"* OK [UIDNEXT %d] predicted next UID" % mailbox.next_uid)
+
+    def uid_search(self, args):
+        mailbox = self.server.mailbox
+        with mailbox.lock:
+            uids = sorted(mailbox.messages)
+            messages = dict(mailbox.messages)
+        tokens = [m.group(1) if m.group(1) is not None else m.group(0) for m in SEARCH_TOKEN.finditer(args)]
+        i = 0
+        while i < len(tokens):
+            key = tokens[i].upper()
+            if key == b"UID":
+                uids = match_uid_set(tokens[i + 1].decode(), uids)
+                i += 2
+            elif key == b"BODY":
+                keyword = tokens[i + 1].lower()
+                uids = [uid for uid in uids if keyword in body_section(messages[uid], "TEXT").lower()]
+                i += 2
+            elif key in (b"SINCE", b"BEFORE", b"ON"):
+                i += 2
+            else:
+                i += 1
+        self.send(b"* SEARCH" + b"".join(b" %d" % uid for uid in uids))
+
+    def uid_fetch(self, args):
+        uid_set, _, items = args.partition(b" ")
+        mailbox = self.server.mailbox
+        with mailbox.lock:
+            uids = match_uid_set(uid_set.decode(), sorted(mailbox.messages))
+            messages = {uid: mailbox.messages[uid] for uid in uids}
+            sequence = {uid: i + 1 for i, uid in enumerate(sorted(mailbox.messages))}
+        requested = [(m.group(0).upper(), m.group(1)) for m in FETCH_ITEM.finditer(items)]
+        for uid in uids:
+            raw = messages[uid]
+            out = [b"* %d FETCH (UID %d" % (sequence[uid], uid)]
+            for item, section in requested:
+                if item == b"UID":
+                    continue
+                if item == b"INTERNALDATE":
+                    out.append(b' INTERNALDATE "' + internal_date(raw).encode() + b'"')
+                elif item == b"BODYSTRUCTURE":
+                    out.append(b" BODYSTRUCTURE " + body_structure(message_from_bytes(raw)).encode())
+                else:
+                    data = body_section(raw, section.decode())
+                    out.append(b" BODY[%s] {%d}\r\n" % (section.upper(), len(data)) + data)
+            self.wfile.write(b"".join(out) + b")\r\n")
+
+class StubIMAPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, mailbox, latency_ms=0):
+        super().__init__(address, StubIMAPHandler)
+        self.mailbox = mailbox
+        self.latency = latency_ms / 1000
+
+    # Function to serve on a background thread; returns the thread
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+# Function to fill a mailbox with count synthetic messages
+def populate(mailbox, count, seed=0, attachment_kb=64):
+    rng = random.Random(seed)
+    for _ in range(count):
+        mailbox.add_message(make_message(mailbox.next_uid, rng, attachment_kb))
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local IMAP stand-in server with synthetic emails")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=1143, help="Port to listen on (default: 1143)")
+    parser.add_argument("--messages", type=int, default=1000, help="Number of synthetic emails (default: 1000)")
+    parser.add_argument("--attachment-kb", type=int, default=64, help="Size of the attachment on every third email (default: 64)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay added to every command, to simulate a remote server")
+    parser.add_argument("--uidvalidity", type=int, default=1, help="UIDVALIDITY reported for the mailbox (default: 1)")
+    args = parser.parse_args()
+
+    mailbox = StubMailbox(args.uidvalidity)
+    populate(mailbox, args.messages, attachment_kb=args.attachment_kb)
+    server = StubIMAPServer((args.host, args.port), mailbox, args.latency_ms)
+    print(f"Stub IMAP server with {args.messages} emails listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import re
+import json
+import time
+import zlib
+import argparse
+import threading
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+# Minimal stand-in for an Ollama server, for testing and benchmarking without a model or network access.
+# It serves the endpoints the scripts use:
+#   POST /api/embed, /api/embeddings, /v1/embeddings   deterministic embeddings
+#   POST /v1/chat/completions                          OpenAI-compatible chat, streamed (SSE) or not
+#   POST /api/chat                                     native chat, streamed (NDJSON) or not
+#   GET  /api/tags, /api/version
+# Embeddings are a normalized sum of one fixed random vector per word, so the same text always gets the
+# same vector and texts sharing words are close. Latency is configurable per request, per embedded text,
+# before the first chat token and per streamed token.
+# Point the scripts at it with OLLAMA_HOST=http://127.0.0.1:11435 and --ollama-host / ollama_api.base_url.
+WORD_PATTERN = re.compile(r"\w+")
+STUB_RESPONSE_WORDS = ("Based", "on", "the", "provided", "context,", "the", "answer", "is", "in", "the",
+                       "relevant", "documents", "from", "your", "vault.")
+
+@lru_cache(maxsize=65536)
+def word_vector(word, dim):
+    return np.random.default_rng(zlib.crc32(word.encode("utf-8"))).standard_normal(dim).astype(np.float32)
+
+# Function to compute the deterministic embedding of a text
+def stub_embedding(text, dim=1024):
+    words = WORD_PATTERN.findall(text.lower()) or [""]
+    vector = np.sum([word_vector(word, dim) for word in words], axis=0)
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm > 0 else vector).tolist()
+
+# Function to estimate the token count of a text (about four characters per token)
+def count_tokens(text):
+    return max(1, len(text) // 4)
+
+def stub_response_tokens(count):
+    return [STUB_RESPONSE_WORDS[i % len(STUB_RESPONSE_WORDS)] + " " for i in range(count)]
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self.send_json({"models": [{"name": "stub:latest", "model": "stub:latest"}]})
+        elif self.path == "/api/version":
+            self.send_json({"version": "0.0.0-stub"})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0) or 0)) or b"{}")
+        except ValueError:
+            self.send_json({"error": "invalid JSON"}, 400)
+            return
+        self.server.count(self.path)
+        handler = {
+            "/api/embed": self.embed, "/api/embeddings": self.embed_legacy, "/v1/embeddings": self.embed_openai,
+            "/v1/chat/completions": self.chat_openai, "/api/chat": self.chat_native,
+        }.get(self.path)
+        if handler is None:
+            self.send_json({"error": "not found"}, 404)
+            return
+        handler(body)
+
+    def _embed(self, texts):
+        server = self.server
+        time.sleep(server.embed_latency + server.embed_item_latency * len(texts))
+        return [stub_embedding(text, server.dim) for text in texts]
+
+    def embed(self, body):
+        texts = body.get("input", "")
+        texts = [texts] if isinstance(texts, str) else texts
+        self.send_json({"model": body.get("model", ""), "embeddings": self._embed(texts),
+                        "prompt_eval_count": sum(count_tokens(text) for text in texts)})
+
+    def embed_legacy(self, body):
+        self.send_json({"embedding": self._embed([body.get("prompt", "")])[0]})
+
+    def embed_openai(self, body):
+        texts = body.get("input", "")
+        texts = [texts] if isinstance(texts, str) else texts
+        tokens = sum(count_tokens(text) for text in texts)
+        self.send_json({"object": "list", "model": body.get("model", ""),
+                        "data": [{"object": "embedding", "index": i, "embedding": embedding}
+                                 for i, embedding in enumerate(self._embed(texts))],
+                        "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    def _chat_tokens(self, body):
+        prompt_tokens = sum(count_tokens(str(message.get("content", ""))) for message in body.get("messages", []))
+        limit = body.get("max_tokens") or (body.get("options") or {}).get("num_predict") or self.server.response_tokens
+        time.sleep(self.server.chat_latency)
+        return prompt_tokens, stub_response_tokens(min(self.server.response_tokens, limit))
+
+    def chat_openai(self, body):
+        model = body.get("model", "")
+        prompt_tokens, tokens = self._chat_tokens(body)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}
+        created = int(time.time())
+        if not body.get("stream"):
+            time.sleep(self.server.token_latency * len(tokens))
+            self.send_json({"id": "chatcmpl-stub", "object": "chat.completion", "created": created, "model": model,
+                            "choices": [{"index": 0, "finish_reason": "stop",
+                                         "message": {"role": "assistant", "content": "".join(tokens)}}],
+                            "usage": usage})
+            return
+        self.start_chunked("text/event-stream")
+        for token in tokens:
+            time.sleep(self.server.token_latency)
+            chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {"role": "assistant", "content": token}, "finish_reason": None}]}
+            self.send_chunk(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+        final = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        self.send_chunk(b"data: " + json.dumps(final).encode("utf-8") + b"\n\n")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage_chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created,
+                           "model": model, "choices": [], "usage": usage}
+            self.send_chunk(b"data: " + json.dumps(usage_chunk).encode("utf-8") + b"\n\n")
+        self.send_chunk(b"data: [DONE]\n\n")
+        self.send_chunk(b"")
+
+    def chat_native(self, body):
+        model = body.get("model", "")
+        prompt_tokens, tokens = self._chat_tokens(body)
+        done = {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "done": True,
+                "done_reason": "stop", "prompt_eval_count": prompt_tokens, "eval_count": len(tokens)}
+        if body.get("stream") is False:
+            time.sleep(self.server.token_latency * len(tokens))
+            self.send_json({**done, "message": {"role": "assistant", "content": "".join(tokens)}})
+            return
+        self.start_chunked("application/x-ndjson")
+        for token in tokens:
+            time.sleep(self.server.token_latency)
+            chunk = {"model": model, "created_at": done["created_at"], "done": False,
+                     "message": {"role": "assistant", "content": token}}
+            self.send_chunk(json.dumps(chunk).encode("utf-8") + b"\n")
+        self.send_chunk(json.dumps({**done, "message": {"role": "assistant", "content": ""}}).encode("utf-8") + b"\n")
+        self.send_chunk(b"")
+
+class StubOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, dim=1024, embed_latency_ms=0, embed_item_ms=0, chat_latency_ms=0,
+                 token_latency_ms=0, response_tokens=64):
+        super().__init__(address, StubOllamaHandler)
+        self.dim = dim
+        self.embed_latency = embed_latency_ms / 1000
+        self.embed_item_latency = embed_item_ms / 1000
+        self.chat_latency = chat_latency_ms / 1000
+        self.token_latency = token_latency_ms / 1000
+        self.response_tokens = response_tokens
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, path):
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    # Function to serve on a background thread; returns the thread
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local Ollama stand-in server with deterministic responses")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=11435, help="Port to listen on (default: 11435)")
+    parser.add_argument("--dim", type=int, default=1024, help="Embedding dimension (default: 1024, as mxbai-embed-large)")
+    parser.add_argument("--embed-latency-ms", type=float, default=0, help="Delay added to every embedding request")
+    parser.add_argument("--embed-item-ms", type=float, default=0, help="Delay added per embedded text")
+    parser.add_argument("--chat-latency-ms", type=float, default=0, help="Delay before the first chat token")
+    parser.add_argument("--token-latency-ms", type=float, default=0, help="Delay per generated chat token")
+    parser.add_argument("--response-tokens", type=int, default=64, help="Tokens in every chat response (default: 64)")
+    args = parser.parse_args()
+
+    server = StubOllamaServer((args.host, args.port), args.dim, args.embed_latency_ms, args.embed_item_ms,
+                              args.chat_latency_ms, args.token_latency_ms, args.response_tokens)
+    print(f"Stub Ollama server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import random
+import numpy as np
+from embedding_store import save_embedding_store, chunk_key, vault_checksum
+from vault_store import VaultStore
+
+# Synthetic vaults for the benchmarks, from a few thousand to tens of millions of chunks. Everything is
+# generated and written in blocks, so the size is limited by disk space, not memory.
+TOPICS = (
+    ("invoice", "payment", "amount", "due", "paid", "overdue", "billing", "receipt"),
+    ("meeting", "agenda", "notes", "attendees", "minutes", "call", "calendar", "room"),
+    ("project", "deadline", "milestone", "scope", "plan", "risk", "delivery", "status"),
+    ("contract", "clause", "signature", "legal", "terms", "renewal", "draft", "review"),
+    ("budget", "quarterly", "forecast", "spend", "revenue", "report", "cost", "finance"),
+    ("customer", "support", "ticket", "issue", "request", "feedback", "escalation", "reply"),
+    ("team", "hiring", "onboarding", "schedule", "vacation", "manager", "training", "update"),
+    ("server", "deploy", "outage", "backup", "database", "release", "incident", "monitoring"),
+)
+COMMON_WORDS = ("the", "a", "for", "with", "about", "from", "and", "to", "of", "on", "is", "was", "this", "next")
+GENERATE_BLOCK_ROWS = 8192
+
+# Function to generate one synthetic chunk: sentences mostly about one topic
+def synthetic_chunk(rng, max_words=150):
+    topic = rng.choice(TOPICS)
+    words = [rng.choice(topic) if rng.random() < 0.6 else rng.choice(COMMON_WORDS) for _ in range(rng.randint(20, max_words))]
+    return " ".join(words).capitalize() + "."
+
+# Function to write a synthetic vault of rows chunks, one per line
+def write_synthetic_vault(path, rows, seed=0):
+    rng = random.Random(seed)
+    size = 0
+    with open(path, "w", encoding="utf-8") as file:
+        for start in range(0, rows, GENERATE_BLOCK_ROWS):
+            block = "".join(synthetic_chunk(rng) + "\n" for _ in range(min(GENERATE_BLOCK_ROWS, rows - start)))
+            file.write(block)
+            size += len(block)
+    return size
+
+# Clustered synthetic embeddings generated on demand by block, deterministic for a given seed.
+# Slicing returns float32 rows, so it can be passed to save_embedding_store without holding the matrix.
+class SyntheticEmbeddings:
+    def __init__(self, rows, dim, seed=0, clusters=256):
+        self.rows = rows
+        self.dim = dim
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+
+    def __len__(self):
+        return self.rows
+
+    def _block(self, index):
+        rng = np.random.default_rng((self.seed, index))
+        count = min(GENERATE_BLOCK_ROWS, self.rows - index * GENERATE_BLOCK_ROWS)
+        labels = rng.integers(len(self.centers), size=count)
+        return self.centers[labels] + rng.standard_normal((count, self.dim), dtype=np.float32)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(self.rows)
+            if stop <= start:
+                return np.zeros((0, self.dim), dtype=np.float32)
+            first, last = start // GENERATE_BLOCK_ROWS, (stop - 1) // GENERATE_BLOCK_ROWS
+            blocks = np.concatenate([self._block(i) for i in range(first, last + 1)])
+            offset = first * GENERATE_BLOCK_ROWS
+            return blocks[start - offset:stop - offset]
+        if index < 0:
+            index += self.rows
+        return self[index:index + 1][0]
+
+# Function to write a synthetic vault and a matching embedding store, so load_or_build_embeddings
+# finds every chunk already embedded (the same keys and checksum a real run would write)
+def write_synthetic_corpus(vault_path, store_path, rows, dim=1024, model="mxbai-embed-large", seed=0):
+    size = write_synthetic_vault(vault_path, rows, seed)
+    store = VaultStore(vault_path)
+    keys = [chunk_key(line, model) for line in store]
+    checksum = vault_checksum(store)
+    store.close()
+    save_embedding_store(store_path, SyntheticEmbeddings(rows, dim, seed), keys, model, checksum)
+    return size
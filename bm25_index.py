@@ -0,0 +1,165 @@
+import os
+import re
+import json
+import time
+from array import array
+from itertools import islice
+import numpy as np
+from embedding_store import vault_digest
+
+# Identifiers such as email addresses, invoice numbers and error codes are kept as one token
+# ("inv-2024-0042", "jane.doe@example.com") and also indexed by their alphanumeric parts.
+TOKEN_PATTERN = re.compile(r"\w(?:[\w.@+/-]*\w)?")
+PART_PATTERN = re.compile(r"[^\W_]+")
+MAX_TF = 65535
+
+def tokenize(text):
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = PART_PATTERN.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+# BM25 inverted index over the vault lines. Postings are append-only typed arrays (row ids as uint32,
+# term frequencies as uint16), so new vault lines can be added incrementally without rebuilding.
+class BM25Index:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+        self.postings_rows = []
+        self.postings_tfs = []
+        self.doc_lengths = array("I")
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    # Function to index new documents; row ids continue from the current document count
+    def add_documents(self, texts):
+        for text in texts:
+            row = len(self.doc_lengths)
+            counts = {}
+            tokens = tokenize(text)
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                term_id = self.vocab.get(token)
+                if term_id is None:
+                    term_id = self.vocab[token] = len(self.postings_rows)
+                    self.postings_rows.append(array("I"))
+                    self.postings_tfs.append(array("H"))
+                self.postings_rows[term_id].append(row)
+                self.postings_tfs[term_id].append(min(tf, MAX_TF))
+            self.doc_lengths.append(len(tokens))
+            self.total_length += len(tokens)
+
+    # Function to return a new index with texts added, leaving this one unchanged for searches in progress.
+    # Unchanged postings are shared; only the postings of terms in the new texts are copied.
+    def with_documents(self, texts):
+        texts = list(texts)
+        index = BM25Index(self.k1, self.b)
+        index.vocab = dict(self.vocab)
+        index.postings_rows = list(self.postings_rows)
+        index.postings_tfs = list(self.postings_tfs)
+        index.doc_lengths = self.doc_lengths[:]
+        index.total_length = self.total_length
+        for token in {token for text in texts for token in tokenize(text)}:
+            term_id = index.vocab.get(token)
+            if term_id is not None:
+                index.postings_rows[term_id] = self.postings_rows[term_id][:]
+                index.postings_tfs[term_id] = self.postings_tfs[term_id][:]
+        index.add_documents(texts)
+        return index
+
+    # Function to return the top_k (row indices, BM25 scores) for a query
+    def search(self, query, top_k):
+        if len(self) == 0:
+            return [], []
+        doc_lengths = np.frombuffer(self.doc_lengths, dtype=np.uint32).astype(np.float32)
+        avg_length = max(self.total_length / len(self), 1e-9)
+        norms = self.k1 * (1 - self.b + self.b * doc_lengths / avg_length)
+        scores = np.zeros(len(self), dtype=np.float32)
+        for token in set(tokenize(query)):
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                continue
+            rows = np.frombuffer(self.postings_rows[term_id], dtype=np.uint32)
+            tfs = np.frombuffer(self.postings_tfs[term_id], dtype=np.uint16).astype(np.float32)
+            idf = np.log(1 + (len(self) - len(rows) + 0.5) / (len(rows) + 0.5))
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norms[rows])
+        matched = np.flatnonzero(scores)
+        if len(matched) == 0:
+            return [], []
+        top_k = min(top_k, len(matched))
+        best = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        best = best[np.argsort(-scores[best])]
+        return best.tolist(), scores[best].tolist()
+
+    def save(self, path, checksum):
+        terms = [None] * len(self.vocab)
+        for token, term_id in self.vocab.items():
+            terms[term_id] = token
+        lengths = np.array([len(rows) for rows in self.postings_rows], dtype=np.int64)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(
+                file,
+                terms=np.frombuffer(json.dumps(terms).encode("utf-8"), dtype=np.uint8),
+                posting_lengths=lengths,
+                rows=np.frombuffer(b"".join(rows.tobytes() for rows in self.postings_rows), dtype=np.uint32),
+                tfs=np.frombuffer(b"".join(tfs.tobytes() for tfs in self.postings_tfs), dtype=np.uint16),
+                doc_lengths=np.frombuffer(self.doc_lengths, dtype=np.uint32),
+                checksum=np.array(checksum),
+                params=np.array([self.k1, self.b]),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            k1, b = data["params"].tolist()
+            index = cls(k1, b)
+            terms = json.loads(data["terms"].tobytes().decode("utf-8"))
+            offsets = np.concatenate([[0], np.cumsum(data["posting_lengths"])])
+            rows, tfs = data["rows"], data["tfs"]
+            for term_id, token in enumerate(terms):
+                index.vocab[token] = term_id
+                index.postings_rows.append(array("I", rows[offsets[term_id]:offsets[term_id + 1]].tobytes()))
+                index.postings_tfs.append(array("H", tfs[offsets[term_id]:offsets[term_id + 1]].tobytes()))
+            index.doc_lengths = array("I", data["doc_lengths"].tobytes())
+            index.total_length = int(data["doc_lengths"].sum())
+            return index, str(data["checksum"])
+
+# Function to load the BM25 index for the vault, indexing only lines appended since it was saved.
+# The vault lines are streamed (checksum of the indexed prefix, then the new lines), never held in a list.
+def load_or_build_bm25(vault_content, path):
+    index = None
+    digest = None
+    if os.path.exists(path):
+        try:
+            index, checksum = BM25Index.load(path)
+            if len(index) <= len(vault_content):
+                digest = vault_digest(islice(vault_content, len(index)))
+            if digest is None or digest.hexdigest() != checksum:
+                print(f"Lexical index '{path}' does not match the vault. Rebuilding...")
+                index = None
+        except (ValueError, OSError, KeyError) as e:
+            print(f"Could not read lexical index '{path}': {str(e)}")
+            index = None
+    if index is not None and len(index) == len(vault_content):
+        print(f"Loaded lexical index with {len(index)} lines from '{path}'.")
+        return index
+    if index is None:
+        index, digest = BM25Index(), vault_digest([])
+    start = time.perf_counter()
+    new_lines = len(vault_content) - len(index)
+    first = len(index)
+    index.add_documents(vault_content[row] for row in range(first, len(vault_content)))
+    for row in range(first, len(vault_content)):
+        digest.update(vault_content[row].encode("utf-8"))
+    index.save(path, digest.hexdigest())
+    print(f"Indexed {new_lines} new lines for lexical search in {time.perf_counter() - start:.1f}s.")
+    return index
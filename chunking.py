@@ -0,0 +1,101 @@
+import re
+from vault_store import append_records
+
+# Streaming sentence chunker shared by upload.py and collect_emails.py.
+# Input is any iterable of text pieces (file blocks, PDF pages, JSON encoder output), so a document
+# never has to be loaded into one string. Only the unfinished tail sentence is carried between pieces,
+# and that carry is bounded by max_length, so memory stays bounded and the work stays linear.
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?]) +')  # spaces following sentence-ending punctuation
+WHITESPACE = re.compile(r'\s+')
+READ_BLOCK_SIZE = 1 << 20
+VAULT_WRITE_BATCH = 1024
+
+# Function to read a text file object in fixed-size blocks
+def read_blocks(file, block_size=READ_BLOCK_SIZE):
+    while True:
+        block = file.read(block_size)
+        if not block:
+            return
+        yield block
+
+# Function to turn a stream of text pieces into whitespace-normalized sentences
+def iter_sentences(pieces, max_length=1000):
+    carry = ""
+    for piece in pieces:
+        if not piece:
+            continue
+        text = WHITESPACE.sub(" ", carry + piece)
+        sentences = SENTENCE_BOUNDARY.split(text)
+        carry = sentences.pop()
+        for sentence in sentences:
+            sentence = sentence.strip()
+            if sentence:
+                yield sentence
+        # Break long runs without sentence punctuation at a space so the carry stays bounded
+        while len(carry) >= max_length:
+            cut = carry.rfind(" ", 1, max_length - 1)
+            if cut <= 0:
+                cut = max_length - 1
+            head = carry[:cut].strip()
+            if head:
+                yield head
+            carry = carry[cut:]
+    carry = carry.strip()
+    if carry:
+        yield carry
+
+# Function to split a sentence that is too long for one chunk at word boundaries
+def _split_long(sentence, max_length):
+    while len(sentence) >= max_length:
+        cut = sentence.rfind(" ", 1, max_length - 1)
+        if cut <= 0:
+            cut = max_length - 1
+        yield sentence[:cut].strip()
+        sentence = sentence[cut:].strip()
+    if sentence:
+        yield sentence
+
+# Function to pack sentences into chunks shorter than max_length characters.
+# With overlap > 0, up to overlap characters of trailing sentences are repeated at the start of the next chunk.
+def iter_chunks(sentences, max_length=1000, overlap=0):
+    parts = []
+    length = 0
+    for sentence in sentences:
+        for piece in _split_long(sentence, max_length):
+            if parts and length + len(piece) + 1 >= max_length:
+                yield " ".join(parts)
+                tail = []
+                tail_length = -1
+                for part in reversed(parts):
+                    if tail_length + len(part) + 1 > overlap:
+                        break
+                    tail.insert(0, part)
+                    tail_length += len(part) + 1
+                if tail and tail_length + len(piece) + 1 >= max_length:
+                    tail, tail_length = [], -1
+                parts, length = tail, max(tail_length, 0)
+            length += len(piece) + (1 if parts else 0)
+            parts.append(piece)
+    if parts:
+        yield " ".join(parts)
+
+# Function to chunk a text or a stream of text pieces
+def chunk_text(text, max_length=1000, overlap=0):
+    pieces = [text] if isinstance(text, str) else text
+    return iter_chunks(iter_sentences(pieces, max_length), max_length, overlap)
+
+# Function to append chunks to the vault, one per line, writing in batches. Each batch is one atomic
+# append to the record store (see vault_store.py); metadata (e.g. {"source": path}) is stored with every chunk.
+def append_chunks_to_vault(chunks, vault_path="vault.txt", batch_size=VAULT_WRITE_BATCH, metadata=None):
+    count = 0
+    batch = []
+    for chunk in chunks:
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            count += append_records(vault_path, batch, metadata)
+            batch.clear()
+    count += append_records(vault_path, batch, metadata)
+    return count
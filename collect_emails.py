@@ -1,112 +1,347 @@
 import imaplib
 import email
-from email import policy
-from email.parser import BytesParser
 from datetime import datetime, timedelta
 import os
 import re
+import json
+import time
 import argparse
-from bs4 import BeautifulSoup
-import lxml
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from dotenv import load_dotenv
+import tracing
+import chunking
+import email_parse
+from dedup import DEFAULT_THRESHOLD, load_or_build_dedup, dedup_index_path_for
 
 load_dotenv()  # Load environment variables from .env file
 
-def chunk_text(text, max_length=1000):
-    # Normalize Unicode characters to the closest ASCII representation
-    text = text.encode('ascii', 'ignore').decode('ascii')
-
-    # Remove sequences of '>' used in email threads
-    text = re.sub(r'\s*(?:>\s*){2,}', ' ', text)
-
-    # Remove sequences of dashes, underscores, or non-breaking spaces
-    text = re.sub(r'-{3,}', ' ', text)
-    text = re.sub(r'_{3,}', ' ', text)
-    text = re.sub(r'\s{2,}', ' ', text)  # Collapse multiple spaces into one
-
-    # Replace URLs with a single space, or remove them
-    text = re.sub(r'https?://\S+|www\.\S+', '', text)
-
-    # Normalize whitespace to single spaces, strip leading/trailing whitespace
-    text = re.sub(r'\s+', ' ', text).strip()
-
-    # Split text into sentences while preserving punctuation
-    sentences = re.split(r'(?<=[.!?]) +', text)
-    chunks = []
-    current_chunk = ""
-    
-    for sentence in sentences:
-        if len(current_chunk) + len(sentence) + 1 < max_length:
-            current_chunk += (sentence + " ").strip()
-        else:
-            chunks.append(current_chunk)
-            current_chunk = sentence + " "
-    if current_chunk:
-        chunks.append(current_chunk)
+SYNC_STATE_PATH = "email_sync_state.json"
+FETCH_BATCH_SIZE = 100
+PARSE_TASK_SIZE = 20
+TEXT_CONTENT_TYPES = ("text/plain", "text/html")
 
-    return chunks
+# Accounts to sync: (display name, environment variable prefix, default IMAP host). Each account reads
+# <PREFIX>_USERNAME and <PREFIX>_PASSWORD, and optionally <PREFIX>_IMAP_HOST, <PREFIX>_IMAP_PORT and
+# <PREFIX>_IMAP_SSL=0 to point it at another server (e.g. python benchmarks/stub_imap.py for testing).
+ACCOUNTS = [
+    ("Gmail", "GMAIL", "imap.gmail.com"),
+    ("Outlook", "OUTLOOK", "imap-mail.outlook.com"),
+]
 
-def save_chunks_to_vault(chunks):
-    vault_path = "vault.txt"
-    with open(vault_path, "a", encoding="utf-8") as vault_file:
-        for chunk in chunks:
-            vault_file.write(chunk.strip() + "\n")
+# Tokens of an IMAP response: parentheses, quoted strings and atoms. Literals are replaced by
+# a "\0<index>" placeholder atom before parsing (see parse_fetch_response).
+IMAP_TOKEN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+FETCH_START = re.compile(rb'^\d+ \(')
+LITERAL_SUFFIX = re.compile(rb'\{(\d+)\}$')
+
+# Both accounts are synced concurrently, so appends to the vault go through one lock
+vault_lock = threading.Lock()
+# Drops chunks already in the vault, such as quoted replies (set up in main)
+deduplicator = None
+
+# Function to clean up email text and split it into chunks (see email_parse.chunk_email_text)
+def chunk_text(text, max_length=1000):
+    return email_parse.chunk_email_text(text, max_length)
+
+def save_chunks_to_vault(chunks, metadata=None):
+    with vault_lock:
+        chunking.append_chunks_to_vault(deduplicator.filter(chunks) if deduplicator else chunks, "vault.txt",
+                                        metadata=metadata)
 
 def get_text_from_html(html_content):
-    soup = BeautifulSoup(html_content, 'lxml')
-    return soup.get_text()
+    return email_parse.html_to_text(html_content)
 
 def save_plain_text_content(email_bytes, email_id):
-    msg = BytesParser(policy=policy.default).parsebytes(email_bytes)
-    text_content = ""
-    if msg.is_multipart():
-        for part in msg.walk():
-            if part.get_content_type() == 'text/plain':
-                text_content += part.get_payload(decode=True).decode(part.get_content_charset('utf-8'))
-            elif part.get_content_type() == 'text/html':
-                html_content = part.get_payload(decode=True).decode(part.get_content_charset('utf-8'))
-                text_content += get_text_from_html(html_content)
-    else:
-        if msg.get_content_type() == 'text/plain':
-            text_content = msg.get_payload(decode=True).decode(msg.get_content_charset('utf-8'))
-        elif msg.get_content_type() == 'text/html':
-            text_content = get_text_from_html(msg.get_payload(decode=True).decode(msg.get_content_charset('utf-8')))
-
+    text_content = email_parse.extract_text(email_bytes)
     chunks = chunk_text(text_content)
     save_chunks_to_vault(chunks)
     return text_content
 
-def search_and_process_emails(imap_client, email_source, search_keyword, start_date, end_date):
+# Per-mailbox sync position (UIDVALIDITY and the last UID processed), so re-runs only fetch new messages
+class SyncState:
+    def __init__(self, path=SYNC_STATE_PATH):
+        self.path = path
+        self.mailboxes = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as file:
+                    self.mailboxes = json.load(file)["mailboxes"]
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Could not read sync state '{path}': {str(e)}")
+
+    # Function to return the last UID processed, or 0 when the mailbox is new or its UIDVALIDITY changed
+    def last_uid(self, key, uidvalidity):
+        with self.lock:
+            entry = self.mailboxes.get(key)
+        if entry is None or entry["uidvalidity"] != uidvalidity:
+            return 0
+        return entry["last_uid"]
+
+    def update(self, key, uidvalidity, last_uid):
+        with self.lock:
+            self.mailboxes[key] = {"uidvalidity": uidvalidity, "last_uid": last_uid, "synced_at": time.time()}
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump({"mailboxes": self.mailboxes}, file, indent=2)
+            os.replace(tmp_path, self.path)
+
+# Function to parse an IMAP parenthesized list into nested lists of strings (NIL becomes None).
+# Placeholder atoms "\0<index>" are replaced by the matching entry of literals.
+def parse_imap_list(data, literals=()):
+    stack = [[]]
+    for match in IMAP_TOKEN.finditer(data):
+        open_paren, close_paren, quoted, atom = match.groups()
+        if open_paren:
+            stack.append([])
+        elif close_paren:
+            if len(stack) > 1:
+                item = stack.pop()
+                stack[-1].append(item)
+        elif quoted is not None:
+            stack[-1].append(re.sub(rb'\\(.)', rb'\1', quoted).decode('utf-8', 'replace'))
+        elif atom.startswith(b"\0"):
+            stack[-1].append(literals[int(atom[1:])])
+        elif atom.upper() == b"NIL":
+            stack[-1].append(None)
+        else:
+            stack[-1].append(atom.decode('utf-8', 'replace'))
+    return stack[0]
+
+# Function to turn the data of a UID FETCH into {uid: {item name: value}}, e.g. {42: {"BODY[1]": b"..."}}
+def parse_fetch_response(data):
+    responses = []
+    for item in data:
+        prefix, literal = item if isinstance(item, tuple) else (item, None)
+        if not isinstance(prefix, bytes):
+            continue
+        if FETCH_START.match(prefix) or not responses:
+            responses.append([b"", []])
+        text, literals = responses[-1]
+        if literal is not None:
+            prefix = LITERAL_SUFFIX.sub(b"\0%d" % len(literals), prefix)
+            literals.append(literal)
+        responses[-1][0] = text + prefix
+    messages = {}
+    for text, literals in responses:
+        parsed = parse_imap_list(text, literals)
+        if len(parsed) < 2 or not isinstance(parsed[1], list):
+            continue
+        items = parsed[1]
+        fields = {str(items[i]).upper(): items[i + 1] for i in range(0, len(items) - 1, 2)}
+        if "UID" in fields:
+            messages[int(fields["UID"])] = fields
+    return messages
+
+# Function to compress UIDs into an IMAP sequence set, e.g. [1, 2, 3, 7] -> "1:3,7"
+def uid_set(uids):
+    ranges = []
+    for uid in sorted(uids):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+# Function to list the text parts of a BODYSTRUCTURE as (section, content type, charset, encoding),
+# skipping attachments and attached messages. Like email_parse.select_text_parts, only one alternative
+# of a multipart/alternative is kept (text/plain when there is one).
+def text_sections(structure, section=""):
+    if structure and isinstance(structure[0], list):
+        children = []
+        for part in structure:
+            if not isinstance(part, list):
+                break
+            number = str(len(children) + 1)
+            children.append(text_sections(part, f"{section}.{number}" if section else number))
+        subtype = structure[len(children)] if len(structure) > len(children) else None
+        if str(subtype).lower() == "alternative":
+            children = [sections for sections in children if sections]
+            plain = [sections for sections in children if any(s[1] == "text/plain" for s in sections)]
+            return (plain or children or [[]])[0]
+        return [s for sections in children for s in sections]
+    content_type = f"{structure[0]}/{structure[1]}".lower()
+    if content_type not in TEXT_CONTENT_TYPES:
+        return []
+    disposition = structure[9] if len(structure) > 9 else None
+    if isinstance(disposition, list) and disposition and str(disposition[0]).lower() == "attachment":
+        return []
+    params = structure[2] if isinstance(structure[2], list) else []
+    charset = next((params[i + 1] for i in range(0, len(params) - 1, 2) if str(params[i]).lower() == "charset"), None)
+    # The body of a single-part message is section 1
+    return [(section or "1", content_type, charset, structure[5])]
+
+# Function to convert an INTERNALDATE ("17-Jul-2024 02:44:25 -0700") to ISO 8601
+def internal_date(value):
+    try:
+        return datetime.strptime(str(value).strip(), "%d-%b-%Y %H:%M:%S %z").isoformat()
+    except ValueError:
+        return None
+
+# Function to fetch a batch of messages in full; returns [(uid, raw message bytes)] and {uid: received date}
+def fetch_full_messages(imap_client, uids):
+    typ, data = imap_client.uid('FETCH', uid_set(uids), '(UID INTERNALDATE BODY.PEEK[])')
+    if typ != 'OK':
+        raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+    messages = parse_fetch_response(data)
+    dates = {uid: internal_date(fields.get("INTERNALDATE")) for uid, fields in messages.items()}
+    return [(uid, messages[uid]["BODY[]"]) for uid in uids if uid in messages and "BODY[]" in messages[uid]], dates
+
+# Function to fetch only the text parts of a batch of messages;
+# returns [(uid, [(content type, charset, transfer encoding, section bytes)])] and {uid: received date}.
+# One BODYSTRUCTURE request finds the text sections, then messages sharing the same layout are fetched together.
+def fetch_text_parts(imap_client, uids):
+    typ, data = imap_client.uid('FETCH', uid_set(uids), '(UID INTERNALDATE BODYSTRUCTURE)')
+    if typ != 'OK':
+        raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+    layouts = {}
+    dates = {}
+    for uid, fields in parse_fetch_response(data).items():
+        dates[uid] = internal_date(fields.get("INTERNALDATE"))
+        structure = fields.get("BODYSTRUCTURE")
+        if isinstance(structure, list):
+            sections = tuple(text_sections(structure))
+            if sections:
+                layouts.setdefault(sections, []).append(uid)
+    results = {}
+    for sections, group in layouts.items():
+        items = " ".join(f"BODY.PEEK[{section}]" for section, _, _, _ in sections)
+        typ, data = imap_client.uid('FETCH', uid_set(group), f'(UID {items})')
+        if typ != 'OK':
+            raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+        for uid, fields in parse_fetch_response(data).items():
+            results[uid] = [
+                (content_type, charset, encoding, fields[f"BODY[{section}]"])
+                for section, content_type, charset, encoding in sections
+                if isinstance(fields.get(f"BODY[{section}]"), bytes)
+            ]
+    return [(uid, results[uid]) for uid in uids if uid in results], dates
+
+# Function to sync one mailbox: only messages with a UID above the last one processed are fetched,
+# in batches of batch_size UIDs. Each batch goes to the parse stage (parse_pool, a process pool shared by
+# all accounts; a single thread when not given) while the next batch downloads. Parsed chunks are written
+# in UID order and the sync position is saved after each written batch, so an interrupted run resumes
+# where it stopped.
+def search_and_process_emails(imap_client, email_source, search_keyword, start_date, end_date, state=None,
+                              state_key=None, batch_size=FETCH_BATCH_SIZE, text_only=False, parse_pool=None,
+                              max_pending_batches=2):
     search_criteria = 'ALL'
     if start_date and end_date:
         search_criteria = f'(SINCE "{start_date}" BEFORE "{end_date}")'
     if search_keyword:
         search_criteria += f' BODY "{search_keyword}"'  # Ensure the correct combination of conditions
 
+    uidvalidity = int(imap_client.response('UIDVALIDITY')[1][-1] or 0)
+    uidnext = int(imap_client.response('UIDNEXT')[1][-1] or 0)
+    # The sync position is kept per search, so a different keyword or date range starts from the beginning
+    state_key = f"{state_key or email_source}|{search_criteria}"
+    last_uid = state.last_uid(state_key, uidvalidity) if state is not None else 0
+    if last_uid:
+        search_criteria = f'UID {last_uid + 1}:* {search_criteria}'
+
     print(f"Using search criteria for {email_source}: {search_criteria}")
-    typ, data = imap_client.search(None, search_criteria)
-    if typ == 'OK':
-        email_ids = data[0].split()
-        print(f"Found {len(email_ids)} emails matching criteria in {email_source}.")
-
-        for num in email_ids:
-            typ, email_data = imap_client.fetch(num, '(RFC822)')
-            if typ == 'OK':
-                email_id = num.decode('utf-8')
-                print(f"Downloading and processing email ID: {email_id} from {email_source}")
-                save_plain_text_content(email_data[0][1], email_id)
-            else:
-                print(f"Failed to fetch email ID: {num.decode('utf-8')} from {email_source}")
-    else:
+    with tracing.span("imap_search"):
+        typ, data = imap_client.uid('SEARCH', None, search_criteria)
+    if typ != 'OK':
         print(f"Failed to find emails with given criteria in {email_source}. No emails found.")
+        return 0
+    # "UID n:*" always matches the highest UID, even when it is below n
+    uids = sorted(uid for uid in map(int, data[0].split()) if uid > last_uid)
+    print(f"Found {len(uids)} new emails matching criteria in {email_source}.")
 
+    processed = 0
+    pending = deque()
+    source = state_key.split("|", 1)[0]
+
+    def write_next():
+        nonlocal processed
+        futures, dates, batch_last_uid = pending.popleft()
+        for future in futures:
+            # Time spent here is parsing that has not caught up with the fetches
+            with tracing.span("parse_wait"):
+                results = future.result()
+            with tracing.span("vault_write", emails=len(results)) as span:
+                chunk_count = 0
+                for uid, chunks in results:
+                    print(f"Processing email UID: {uid} from {email_source} ({len(chunks)} chunks)")
+                    save_chunks_to_vault(chunks, {"source": source, "uid": uid, "date": dates.get(uid)})
+                    chunk_count += len(chunks)
+                    processed += 1
+                span.set(chunks=chunk_count)
+        if state is not None:
+            state.update(state_key, uidvalidity, batch_last_uid)
+
+    pool = parse_pool or ThreadPoolExecutor(max_workers=1)
+    try:
+        for start in range(0, len(uids), batch_size):
+            batch = uids[start:start + batch_size]
+            with tracing.span("imap_fetch", emails=len(batch), text_only=text_only) as span:
+                messages, dates = fetch_text_parts(imap_client, batch) if text_only else fetch_full_messages(imap_client, batch)
+                span.set(bytes=sum(len(content) if not text_only else sum(len(part[3]) for part in content)
+                                   for _, content in messages))
+            futures = [pool.submit(email_parse.parse_batch, messages[i:i + PARSE_TASK_SIZE], text_only)
+                       for i in range(0, len(messages), PARSE_TASK_SIZE)]
+            pending.append((futures, dates, batch[-1]))
+            while len(pending) > max_pending_batches:
+                write_next()
+        while pending:
+            write_next()
+    finally:
+        if parse_pool is None:
+            pool.shutdown()
+    # Nothing below UIDNEXT is left to match, so the next run can start there even if the last matches were filtered out
+    if state is not None and (uids or uidnext):
+        state.update(state_key, uidvalidity, max(uids[-1] if uids else 0, uidnext - 1, last_uid))
+    return processed
+
+# Function to connect to an account's IMAP server; returns (client, username), or (None, None) when its credentials are not set
+def connect_account(email_source, prefix, default_host):
+    username = os.getenv(f'{prefix}_USERNAME')
+    password = os.getenv(f'{prefix}_PASSWORD')
+    if not username or not password:
+        print(f"Skipping {email_source}: {prefix}_USERNAME and {prefix}_PASSWORD are not set.")
+        return None, None
+    host = os.getenv(f'{prefix}_IMAP_HOST', default_host)
+    use_ssl = os.getenv(f'{prefix}_IMAP_SSL', '1') != '0'
+    port = int(os.getenv(f'{prefix}_IMAP_PORT', '993' if use_ssl else '143'))
+    client = imaplib.IMAP4_SSL(host, port) if use_ssl else imaplib.IMAP4(host, port)
+    client.login(username, password)
+    return client, username
+
+# Function to sync one account over its own connection
+@tracing.traced("email_sync")
+def sync_account(account, mailbox, search_keyword, start_date, end_date, state, batch_size, text_only, parse_pool=None):
+    email_source, prefix, default_host = account
+    client, username = connect_account(email_source, prefix, default_host)
+    if client is None:
+        return 0
+    try:
+        # Read-only, and messages are fetched with BODY.PEEK, so syncing does not mark anything as read
+        client.select(mailbox, readonly=True)
+        return search_and_process_emails(client, email_source, search_keyword, start_date, end_date, state,
+                                         f"{email_source}:{username}/{mailbox}", batch_size, text_only, parse_pool)
+    finally:
+        client.logout()
 
 def main():
     parser = argparse.ArgumentParser(description="Search and process emails based on optional keyword and date range.")
     parser.add_argument("--keyword", help="The keyword to search for in the email bodies.", default="")
     parser.add_argument("--startdate", help="Start date in DD.MM.YYYY format.", required=False)
     parser.add_argument("--enddate", help="End date in DD.MM.YYYY format.", required=False)
+    parser.add_argument("--mailbox", help="Mailbox to sync (default: inbox).", default="inbox")
+    parser.add_argument("--batch-size", type=int, default=FETCH_BATCH_SIZE, help=f"Messages fetched per request (default: {FETCH_BATCH_SIZE}).")
+    parser.add_argument("--text-only", action="store_true", help="Fetch only the text parts of each message, skipping attachments.")
+    parser.add_argument("--state-file", default=SYNC_STATE_PATH, help=f"Where the last synced UID of each mailbox is kept (default: {SYNC_STATE_PATH}).")
+    parser.add_argument("--parse-workers", type=int, default=0, help="Processes parsing emails (default: CPU count).")
+    parser.add_argument("--dedup-threshold", type=float, default=DEFAULT_THRESHOLD, help=f"Similarity above which a chunk counts as a near duplicate and is dropped (default: {DEFAULT_THRESHOLD}).")
+    parser.add_argument("--no-dedup", action="store_true", help="Keep duplicate chunks.")
+    parser.add_argument("--full-resync", action="store_true", help="Ignore the sync state and process every matching email again.")
+    parser.add_argument("--trace-file", default="", help="Append a per-stage trace of each account sync to this JSONL file.")
+    parser.add_argument("--metrics-port", type=int, default=0, help="Serve per-stage metrics on http://127.0.0.1:PORT/metrics while syncing.")
     args = parser.parse_args()
+    tracing.configure(args.trace_file, args.metrics_port)
 
     start_date = None
     end_date = None
@@ -123,28 +358,33 @@ def main():
         print("Both start date and end date must be provided together.")
         return
 
-    # Retrieve email credentials from environment variables
-    gmail_username = os.getenv('GMAIL_USERNAME')
-    gmail_password = os.getenv('GMAIL_PASSWORD')
-    outlook_username = os.getenv('OUTLOOK_USERNAME')
-    outlook_password = os.getenv('OUTLOOK_PASSWORD')
-
-    # Connect to Gmail's IMAP server
-    M = imaplib.IMAP4_SSL('imap.gmail.com')
-    M.login(gmail_username, gmail_password)
-    M.select('inbox')
-
-    # Connect to Outlook IMAP server
-    H = imaplib.IMAP4_SSL('imap-mail.outlook.com')
-    H.login(outlook_username, outlook_password)
-    H.select('inbox')
+    global deduplicator
+    if not args.no_dedup:
+        deduplicator = load_or_build_dedup("vault.txt", args.dedup_threshold)
 
-    # Search and process emails from Gmail and Outlook
-    search_and_process_emails(M, "Gmail", args.keyword, start_date, end_date)
-    search_and_process_emails(H, "Outlook", args.keyword, start_date, end_date)
+    state = SyncState(args.state_file)
+    if args.full_resync:
+        state.mailboxes = {}
 
-    M.logout()
-    H.logout()
+    # Sync Gmail and Outlook concurrently, each over its own connection, sharing one pool of parse processes
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.parse_workers or None) as parse_pool, \
+            ThreadPoolExecutor(max_workers=len(ACCOUNTS)) as executor:
+        futures = {
+            executor.submit(sync_account, account, args.mailbox, args.keyword, start_date, end_date, state,
+                            args.batch_size, args.text_only, parse_pool): account[0]
+            for account in ACCOUNTS
+        }
+        total = 0
+        for future, email_source in futures.items():
+            try:
+                total += future.result()
+            except Exception as e:
+                print(f"Failed to sync {email_source}: {str(e)}")
+    print(f"Processed {total} new emails in {time.perf_counter() - start:.1f}s.")
+    if deduplicator:
+        deduplicator.save(dedup_index_path_for("vault.txt"), "vault.txt")
+        print(deduplicator.report())
 
 if __name__ == "__main__":
     main()
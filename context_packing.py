@@ -0,0 +1,200 @@
+import numpy as np
+import tracing
+from chunking import SENTENCE_BOUNDARY
+from token_counter import count_tokens
+
+# Context packing between retrieval and the prompt. The retrieved chunks used to be joined verbatim, so
+# near-duplicate chunks (the same paragraph ingested twice, quoted email replies, overlapping chunks) all
+# went through prompt evaluation. The packer:
+# - orders the retrieved chunks by maximal marginal relevance (MMR): each pick trades its retrieval rank
+#   against its similarity to the chunks already picked, so later passages (the first to be cut by the
+#   budget) are the least novel ones. A chunk is dropped as a duplicate only when it is also the same text
+#   as a picked one (ignoring case and whitespace) or contained in it: templated chunks that differ only in
+#   an ID or a date are nearly identical to an embedding model but are not redundant;
+# - merges picked chunks that are neighbouring rows of the same source (see VaultStore.metadata) into one
+#   passage, removing the overlap the chunker repeated between them;
+# - keeps the passages within a token budget, cutting the last one at a sentence boundary.
+# Similarity is the cosine of the vault embeddings when they are given, else the overlap of the word sets.
+# report() shows the tokens saved per turn and, once a streamed turn has measured the prompt-eval rate,
+# the prompt-eval time that saves.
+MIN_PARTIAL_TOKENS = 32
+MAX_OVERLAP_CHARS = 1000
+
+# Function to cut a text to at most max_tokens, at a sentence boundary when possible
+def truncate_to_tokens(text, max_tokens):
+    if count_tokens(text) <= max_tokens:
+        return text
+    kept, used = [], 0
+    for sentence in SENTENCE_BOUNDARY.split(text):
+        tokens = count_tokens(sentence)
+        if used + tokens > max_tokens:
+            break
+        kept.append(sentence)
+        used += tokens
+    if kept:
+        return " ".join(kept)
+    words, used = [], 0
+    for word in text.split(" "):
+        used += count_tokens(word)
+        if used > max_tokens:
+            break
+        words.append(word)
+    return " ".join(words)
+
+# Function to join two consecutive chunks, dropping the start of the second one if it repeats the end of the first
+def join_overlapping(first, second):
+    limit = min(len(first), len(second), MAX_OVERLAP_CHARS)
+    cut = second.rfind(" ", 0, limit + 1)
+    while cut > 0:
+        if first.endswith(second[:cut]):
+            return first + second[cut:]
+        cut = second.rfind(" ", 0, cut)
+    return first + " " + second
+
+def word_set(text):
+    return frozenset(word.lower() for word in text.split())
+
+def normalize_text(text):
+    return " ".join(text.lower().split())
+
+# Function to map rows to their (source, email uid) from the vault metadata; rows without a source are left out
+def source_keys(rows, vault_content):
+    metadata = getattr(vault_content, "metadata", None)
+    keys = {}
+    if metadata is not None:
+        for row in rows:
+            meta = metadata(row)
+            if meta.get("source"):
+                keys[row] = (meta.get("source"), meta.get("uid"))
+    return keys
+
+class ContextPacker:
+    def __init__(self, max_tokens=1024, mmr_lambda=0.7, redundancy_threshold=0.9, embeddings=None):
+        self.max_tokens = max_tokens
+        self.mmr_lambda = mmr_lambda
+        self.redundancy_threshold = redundancy_threshold
+        self.embeddings = embeddings
+        self.prompt_tokens_per_s = None
+        self.last = None
+        self.total_saved = 0
+
+    def _similarities(self, rows, texts):
+        if self.embeddings is not None:
+            vectors = np.asarray(self.embeddings[rows], dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            return vectors @ vectors.T
+        words = [word_set(text) for text in texts]
+        similarities = np.eye(len(rows), dtype=np.float32)
+        for i in range(len(rows)):
+            for j in range(i + 1, len(rows)):
+                union = len(words[i] | words[j])
+                similarities[i, j] = similarities[j, i] = len(words[i] & words[j]) / union if union else 0.0
+        return similarities
+
+    # Function to mark the pairs of chunks that are similar enough and the same text (or one contained in the other)
+    def _duplicates(self, similarities, texts):
+        normalized = [normalize_text(text) for text in texts]
+        duplicates = np.zeros(similarities.shape, dtype=bool)
+        for i, j in zip(*np.nonzero(similarities >= self.redundancy_threshold)):
+            if i != j and (normalized[i] in normalized[j] or normalized[j] in normalized[i]):
+                duplicates[i, j] = True
+        return duplicates
+
+    # Function to order the ranked chunks with MMR, dropping duplicates; returns (picked positions, redundant count)
+    def _select(self, similarities, duplicates):
+        relevance = 1.0 - np.arange(len(similarities)) / len(similarities)
+        picked, redundant = [], 0
+        remaining = list(range(len(similarities)))
+        while remaining:
+            if picked:
+                closest = similarities[np.ix_(remaining, picked)].max(axis=1)
+                dropped = [i for i, dup in zip(remaining, duplicates[np.ix_(remaining, picked)].any(axis=1)) if dup]
+                if dropped:
+                    redundant += len(dropped)
+                    remaining = [i for i in remaining if i not in dropped]
+                    continue
+                scores = self.mmr_lambda * relevance[remaining] - (1 - self.mmr_lambda) * closest
+                best = remaining[int(np.argmax(scores))]
+            else:
+                best = remaining[0]
+            picked.append(best)
+            remaining.remove(best)
+        return picked, redundant
+
+    # Function to merge picked rows that are consecutive chunks of the same source into passages
+    def _merge(self, rows, texts, keys):
+        text_of = dict(zip(rows, texts))
+        passages, merged, used = [], 0, set()
+        # Passages keep the rank of their best chunk
+        for row in rows:
+            if row in used:
+                continue
+            start = stop = row
+            while start - 1 in text_of and start - 1 not in used and row in keys and keys.get(start - 1) == keys[row]:
+                start -= 1
+            while stop + 1 in text_of and stop + 1 not in used and row in keys and keys.get(stop + 1) == keys[row]:
+                stop += 1
+            text = text_of[start]
+            for neighbour in range(start + 1, stop + 1):
+                text = join_overlapping(text, text_of[neighbour])
+            used.update(range(start, stop + 1))
+            merged += stop - start
+            passages.append(text)
+        return passages, merged
+
+    # Function to turn ranked vault rows into the context passages to send
+    def pack(self, top_indices, vault_content):
+        with tracing.span("pack_context", chunks=len(top_indices)) as span:
+            rows = list(top_indices)
+            texts = [vault_content[row].strip() for row in rows]
+            before = sum(count_tokens(text) for text in texts)
+            if not rows:
+                self.last = None
+                return []
+            keys = source_keys(rows, vault_content)
+            similarities = self._similarities(rows, texts)
+            # Neighbouring chunks of one source continue each other, so they are merged rather than dropped as duplicates
+            for i, row in enumerate(rows):
+                for j, other in enumerate(rows):
+                    if abs(row - other) == 1 and row in keys and keys.get(other) == keys[row]:
+                        similarities[i, j] = 0.0
+            picked, redundant = self._select(similarities, self._duplicates(similarities, texts))
+            passages, merged = self._merge([rows[i] for i in picked], [texts[i] for i in picked], keys)
+
+            packed, used, trimmed = [], 0, 0
+            for passage in passages:
+                tokens = count_tokens(passage)
+                if self.max_tokens and used + tokens > self.max_tokens:
+                    trimmed += 1
+                    if self.max_tokens - used < MIN_PARTIAL_TOKENS:
+                        continue
+                    passage = truncate_to_tokens(passage, self.max_tokens - used)
+                    tokens = count_tokens(passage)
+                    if not passage:
+                        continue
+                packed.append(passage)
+                used += tokens
+
+            self.last = {"chunks_before": len(rows), "passages": len(packed), "redundant": redundant,
+                         "merged": merged, "trimmed": trimmed, "tokens_before": before, "tokens_after": used}
+            self.total_saved += before - used
+            span.set(**self.last)
+            return packed
+
+    # Function to update the prompt-eval rate from the stats of a streamed turn (time to first token is mostly prompt eval)
+    def observe(self, stats):
+        if stats.get("prompt_tokens") and stats.get("ttft_s"):
+            rate = stats["prompt_tokens"] / stats["ttft_s"]
+            self.prompt_tokens_per_s = rate if self.prompt_tokens_per_s is None else 0.7 * self.prompt_tokens_per_s + 0.3 * rate
+
+    def report(self):
+        if self.last is None:
+            return "[context: nothing retrieved]"
+        last = self.last
+        saved = last["tokens_before"] - last["tokens_after"]
+        text = (f"[context: {last['chunks_before']} chunks -> {last['passages']} passages "
+                f"({last['redundant']} duplicates dropped, {last['merged']} merged, {last['trimmed']} trimmed), "
+                f"~{last['tokens_before']} -> ~{last['tokens_after']} tokens, {saved} saved")
+        if self.prompt_tokens_per_s:
+            text += f", ~{saved / self.prompt_tokens_per_s:.2f}s less prompt eval"
+        return text + f"; {self.total_saved} saved this session]"
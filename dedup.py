@@ -0,0 +1,237 @@
+import os
+import re
+import zlib
+import hashlib
+import argparse
+import numpy as np
+from vault_store import VaultStore, append_records, replace_vault, offsets_path_for, metadata_path_for
+
+# Duplicate chunk detection for the ingestion path. Exact duplicates are found by a hash of the
+# normalized chunk text; near-duplicates (quoted email replies, re-uploaded documents with small
+# edits) by MinHash signatures over word shingles, with LSH banding so each new chunk is only
+# compared against the few chunks sharing a band. The signatures are saved next to the vault
+# (vault.txt.dedup.npz) so dedup also works across separate ingestion runs.
+DEFAULT_THRESHOLD = 0.8
+NUM_PERM = 128
+SHINGLE_SIZE = 3
+HASH_PRIME = 4294967311  # smallest prime above 2**32
+WORD_PATTERN = re.compile(r"\w+")
+
+def dedup_index_path_for(vault_path):
+    return vault_path + ".dedup.npz"
+
+# Function to hash the normalized text of a chunk (case and whitespace insensitive)
+def exact_hash(text):
+    normalized = " ".join(text.lower().split())
+    return int.from_bytes(hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest(), "little")
+
+# Function to fingerprint the first rows of the vault without reading it: the row count, their length in
+# bytes (from the offset index) and the text of the first and last of them. The dedup index is saved with
+# the fingerprint of the rows it indexed, so a vault that was replaced or rewritten is not matched against
+# signatures of chunks it no longer has. Returns None when the vault has fewer rows.
+def prefix_fingerprint(store, rows):
+    if rows > len(store):
+        return None
+    end = int(store.offsets[rows, 0]) if rows < len(store) else store.text_end
+    digest = hashlib.sha256(f"{rows}:{end}".encode("utf-8"))
+    if rows:
+        digest.update(store.text(0).encode("utf-8") + b"\n" + store.text(rows - 1).encode("utf-8"))
+    return digest.hexdigest()
+
+# Function to pick the LSH (bands, rows) split whose detection threshold (1/bands)^(1/rows)
+# is the highest one not above the similarity threshold, so candidates are found with good recall
+def lsh_bands(num_perm, threshold):
+    splits = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    below = [(b, r) for b, r in splits if (1 / b) ** (1 / r) <= threshold]
+    return max(below, key=lambda s: (1 / s[0]) ** (1 / s[1])) if below else splits[-1]
+
+class ChunkDeduplicator:
+    def __init__(self, threshold=DEFAULT_THRESHOLD, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE, seed=1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, 1 << 31, num_perm).astype(np.uint64)
+        self.b = rng.randint(0, 1 << 31, num_perm).astype(np.uint64)
+        self.bands, self.rows = lsh_bands(num_perm, threshold)
+        self.hashes = set()
+        self.signatures = []
+        self.buckets = [{} for _ in range(self.bands)]
+        self.lines = 0
+        self.vault_fingerprint = ""
+        self.stats = {"chunks": 0, "kept": 0, "exact": 0, "near": 0, "chars": 0, "kept_chars": 0}
+
+    # Function to compute the MinHash signature of a chunk from its word shingles
+    def signature(self, text):
+        words = WORD_PATTERN.findall(text.lower())
+        k = self.shingle_size
+        shingles = {" ".join(words[i:i + k]) for i in range(max(len(words) - k + 1, 1))}
+        x = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        return ((np.outer(x, self.a) + self.b) % HASH_PRIME).min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    # Function to find an indexed chunk whose estimated Jaccard similarity reaches the threshold
+    def _find_near(self, signature, band_keys):
+        checked = set()
+        for buckets, key in zip(self.buckets, band_keys):
+            for row in buckets.get(key, ()):
+                if row in checked:
+                    continue
+                checked.add(row)
+                if np.count_nonzero(self.signatures[row] == signature) >= self.threshold * self.num_perm:
+                    return row
+        return None
+
+    def _add(self, signature, band_keys):
+        row = len(self.signatures)
+        self.signatures.append(signature)
+        for buckets, key in zip(self.buckets, band_keys):
+            buckets.setdefault(key, []).append(row)
+
+    # Function to classify a chunk as "exact", "near" or None (new) and index it when new
+    def check(self, text):
+        digest = exact_hash(text)
+        if digest in self.hashes:
+            return "exact"
+        signature = self.signature(text)
+        band_keys = self._band_keys(signature)
+        if self._find_near(signature, band_keys) is not None:
+            return "near"
+        self.hashes.add(digest)
+        self._add(signature, band_keys)
+        return None
+
+    # Function to drop duplicate chunks from a stream of chunks, counting what was dropped
+    def filter(self, chunks):
+        for chunk in chunks:
+            chunk = chunk.strip()
+            if chunk and self.keep(chunk):
+                yield chunk
+
+    # Function to decide whether a chunk is kept (not a duplicate), counting it in the stats
+    def keep(self, chunk):
+        self.stats["chunks"] += 1
+        self.stats["chars"] += len(chunk) + 1
+        duplicate = self.check(chunk)
+        if duplicate:
+            self.stats[duplicate] += 1
+            return False
+        self.stats["kept"] += 1
+        self.stats["kept_chars"] += len(chunk) + 1
+        self.lines += 1
+        return True
+
+    # Function to index lines already in the vault, without dropping anything
+    def index_lines(self, lines):
+        for line in lines:
+            line = line.strip()
+            if line:
+                digest = exact_hash(line)
+                if digest not in self.hashes:
+                    self.hashes.add(digest)
+                    signature = self.signature(line)
+                    self._add(signature, self._band_keys(signature))
+            self.lines += 1
+
+    def report(self):
+        stats = self.stats
+        saved = stats["chars"] - stats["kept_chars"]
+        percent = 100 * saved / stats["chars"] if stats["chars"] else 0.0
+        return (f"Dedup: kept {stats['kept']} of {stats['chunks']} chunks ({stats['exact']} exact and "
+                f"{stats['near']} near duplicates dropped), {saved} characters ({percent:.1f}%) not added to the vault")
+
+    # Function to save the signatures together with the fingerprint of the vault rows they cover
+    def save(self, path, vault_path="vault.txt"):
+        store = VaultStore(vault_path)
+        self.vault_fingerprint = prefix_fingerprint(store, self.lines) or ""
+        store.close()
+        signatures = np.stack(self.signatures) if self.signatures else np.zeros((0, self.num_perm), dtype=np.uint32)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(
+                file,
+                hashes=np.fromiter(self.hashes, dtype=np.uint64, count=len(self.hashes)),
+                signatures=signatures,
+                params=np.array([self.num_perm, self.shingle_size, self.seed, self.lines], dtype=np.int64),
+                vault_fingerprint=np.array(self.vault_fingerprint),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, threshold=DEFAULT_THRESHOLD):
+        with np.load(path) as data:
+            num_perm, shingle_size, seed, lines = data["params"].tolist()
+            dedup = cls(threshold, num_perm, shingle_size, seed)
+            dedup.hashes = set(data["hashes"].tolist())
+            for signature in data["signatures"]:
+                dedup._add(signature, dedup._band_keys(signature))
+            dedup.lines = lines
+            dedup.vault_fingerprint = str(data["vault_fingerprint"])
+        return dedup
+
+# Function to load the dedup index of a vault, indexing vault lines it has not seen yet
+# (e.g. the whole vault on first use, or lines appended without dedup). The line count and the prefix
+# fingerprint come from the vault offset index, so an up-to-date dedup index is loaded without reading the vault.
+def load_or_build_dedup(vault_path="vault.txt", threshold=DEFAULT_THRESHOLD, path=None):
+    path = path or dedup_index_path_for(vault_path)
+    dedup = None
+    if os.path.exists(path):
+        try:
+            dedup = ChunkDeduplicator.load(path, threshold)
+        except (ValueError, OSError, KeyError) as e:
+            print(f"Could not read dedup index '{path}': {str(e)}")
+    store = VaultStore(vault_path)
+    if dedup is not None and prefix_fingerprint(store, dedup.lines) != dedup.vault_fingerprint:
+        print(f"Dedup index '{path}' does not match the vault. Rebuilding...")
+        dedup = None
+    if dedup is None:
+        dedup = ChunkDeduplicator(threshold)
+    if dedup.lines < len(store):
+        dedup.index_lines(store.text(row) for row in range(dedup.lines, len(store)))
+    store.close()
+    return dedup
+
+# Function to rewrite a vault without its duplicate lines, keeping each record's metadata;
+# returns the deduplicator with the stats
+def dedup_vault(vault_path, output_path, threshold=DEFAULT_THRESHOLD, batch_size=1024):
+    dedup = ChunkDeduplicator(threshold)
+    for path in (output_path, offsets_path_for(output_path), metadata_path_for(output_path)):
+        if os.path.exists(path):
+            os.remove(path)
+    store = VaultStore(vault_path)
+    texts, metas = [], []
+    for row in range(len(store)):
+        text = store.text(row).strip()
+        if text and dedup.keep(text):
+            texts.append(text)
+            metas.append(store.metadata(row))
+            if len(texts) >= batch_size:
+                append_records(output_path, texts, metas)
+                texts, metas = [], []
+    append_records(output_path, texts, metas)
+    store.close()
+    return dedup
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove duplicate and near-duplicate chunks from a vault")
+    parser.add_argument("--vault", default="vault.txt", help="Vault file (default: vault.txt)")
+    parser.add_argument("--output", help="Write the deduplicated vault here instead of replacing the vault")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Similarity (estimated Jaccard over word shingles) above which chunks are duplicates (default: {DEFAULT_THRESHOLD})")
+    args = parser.parse_args()
+
+    output_path = args.output or args.vault + ".dedup.tmp"
+    dedup = dedup_vault(args.vault, output_path, args.threshold)
+    size_before = os.path.getsize(args.vault)
+    size_after = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+    if not args.output:
+        replace_vault(output_path, args.vault)
+    dedup.save(dedup_index_path_for(args.output or args.vault), args.output or args.vault)
+    print(dedup.report())
+    print(f"Vault size: {size_before} -> {size_after} bytes ({100 * (1 - size_after / max(size_before, 1)):.1f}% smaller)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import re
+import base64
+import quopri
+import binascii
+from email import message_from_bytes
+import chunking
+
+# Parse stage of the email pipeline: raw messages (or fetched text parts) in, cleaned chunks out.
+# Everything here is a plain function of its arguments so it can run in a process pool.
+HTML_SKIP_TAGS = ("script", "style", "head", "title")
+HTML_BLOCK_TAGS = ("p", "div", "br", "li", "tr", "td", "th", "h1", "h2", "h3", "h4", "h5", "h6",
+                   "blockquote", "pre", "table", "ul", "ol", "hr")
+QUOTE_MARKERS = re.compile(r'\s*(?:>\s*){2,}')
+LONG_DASHES = re.compile(r'-{3,}')
+LONG_UNDERSCORES = re.compile(r'_{3,}')
+MULTIPLE_SPACES = re.compile(r'\s{2,}')
+URLS = re.compile(r'https?://\S+|www\.\S+')
+NON_BASE64 = re.compile(rb'[^A-Za-z0-9+/]')
+
+# Function to extract the visible text of an HTML document with lxml, keeping block boundaries as line breaks
+def html_to_text(html_content):
+    # lxml is imported on the first HTML part, so plain-text pipelines never load it
+    import lxml.html
+    from lxml import etree
+    try:
+        document = lxml.html.document_fromstring(html_content)
+    except (etree.ParserError, ValueError):
+        return ""
+    etree.strip_elements(document, *HTML_SKIP_TAGS, with_tail=False)
+    for element in document.iter(*HTML_BLOCK_TAGS):
+        element.tail = "\n" + element.tail if element.tail else "\n"
+    return document.text_content()
+
+# Function to decode the payload of a text part with its declared charset
+def decode_payload(data, charset):
+    try:
+        return data.decode(charset or 'utf-8', errors='replace')
+    except LookupError:
+        return data.decode('utf-8', errors='replace')
+
+# Function to decode base64 leniently: unpadded or truncated input (which strict decoding rejects) is
+# padded, and a dangling last character is dropped
+def decode_base64(data):
+    try:
+        return base64.b64decode(data)
+    except binascii.Error:
+        data = NON_BASE64.sub(b'', data)
+        if len(data) % 4 == 1:
+            data = data[:-1]
+        return base64.b64decode(data + b'=' * (-len(data) % 4))
+
+# Function to decode a body section fetched over IMAP using the encoding and charset from its BODYSTRUCTURE
+def decode_section(data, encoding, charset):
+    encoding = (encoding or "7bit").lower()
+    if encoding == "base64":
+        data = decode_base64(data)
+    elif encoding == "quoted-printable":
+        data = quopri.decodestring(data)
+    return decode_payload(data, charset)
+
+# Function to pick the text parts of a message: attachments are skipped without decoding them, and
+# only one alternative of a multipart/alternative is used (text/plain when there is one, else text/html)
+def select_text_parts(part):
+    if part.get_content_disposition() == 'attachment':
+        return []
+    if part.is_multipart():
+        children = [select_text_parts(child) for child in part.get_payload()]
+        if part.get_content_subtype() == 'alternative':
+            children = [parts for parts in children if parts]
+            plain = [parts for parts in children if any(p.get_content_type() == 'text/plain' for p in parts)]
+            return (plain or children or [[]])[0]
+        return [p for parts in children for p in parts]
+    if part.get_content_type() in ('text/plain', 'text/html'):
+        return [part]
+    return []
+
+# Function to join decoded text parts, given as (content type, text), converting HTML to plain text
+def text_from_parts(parts):
+    return "".join(html_to_text(text) if content_type == 'text/html' else text for content_type, text in parts)
+
+# Function to extract the text content of a raw RFC822 message
+def extract_text(email_bytes):
+    msg = message_from_bytes(email_bytes)
+    return text_from_parts(
+        (part.get_content_type(), decode_payload(part.get_payload(decode=True) or b"", part.get_content_charset()))
+        for part in select_text_parts(msg)
+    )
+
+# Function to clean up email text (quote markers, separators, URLs) and split it into chunks
+def chunk_email_text(text, max_length=1000):
+    # Normalize Unicode characters to the closest ASCII representation
+    text = text.encode('ascii', 'ignore').decode('ascii')
+
+    # Remove sequences of '>' used in email threads
+    text = QUOTE_MARKERS.sub(' ', text)
+
+    # Remove sequences of dashes, underscores, or non-breaking spaces
+    text = LONG_DASHES.sub(' ', text)
+    text = LONG_UNDERSCORES.sub(' ', text)
+    text = MULTIPLE_SPACES.sub(' ', text)  # Collapse multiple spaces into one
+
+    # Replace URLs with a single space, or remove them
+    text = URLS.sub('', text)
+
+    # Normalize whitespace, split into sentences and pack them into chunks
+    return list(chunking.chunk_text(text, max_length))
+
+# Function run in a worker process: parse a batch of fetched emails into chunks.
+# messages is a list of (uid, raw message bytes), or with text_only a list of
+# (uid, [(content type, charset, transfer encoding, section bytes)]). Returns [(uid, chunks)].
+# A message that cannot be parsed gets no chunks, so it does not stop the sync from moving past it.
+def parse_batch(messages, text_only=False, max_length=1000):
+    results = []
+    for uid, content in messages:
+        try:
+            if text_only:
+                text = text_from_parts((content_type, decode_section(data, encoding, charset))
+                                       for content_type, charset, encoding, data in content)
+            else:
+                text = extract_text(content)
+            chunks = chunk_email_text(text, max_length)
+        except Exception as e:
+            print(f"Failed to parse email UID {uid}: {str(e)}")
+            chunks = []
+        results.append((uid, chunks))
+    return results
@@ -1,10 +1,22 @@
-import torch
-import ollama
 import os
-import json
+import time
 from openai import OpenAI
 import argparse
-import yaml
+from embedding_store import load_or_build_embeddings
+from embedder import BatchEmbedder
+from ann_index import load_or_build_index
+from quantization import load_or_build_quantized
+from vector_backend import get_backend
+from retrieval import VaultRetriever
+from query_cache import QueryEmbeddingCache
+from bm25_index import load_or_build_bm25
+from streaming import stream_chat_completion, print_stream_stats
+from history import ConversationHistory, make_llm_summarizer
+from vault_store import VaultStore
+from context_packing import ContextPacker
+from response_cache import ResponseCache, store_version, question_embedding, describe_hit
+from vault_watcher import VaultWatcher
+import tracing
 
 # ANSI escape codes for colors
 PINK = '\033[95m'
@@ -15,6 +27,7 @@ RESET_COLOR = '\033[0m'
 
 def load_config(config_file):
     print("Loading configuration...")
+    import yaml
     try:
         with open(config_file, 'r') as file:
             return yaml.safe_load(file)
@@ -31,76 +44,91 @@ def open_file(filepath):
         print(f"File '{filepath}' not found.")
         return None
 
-def load_or_generate_embeddings(vault_content, embeddings_file):
-    if os.path.exists(embeddings_file):
-        print(f"Loading embeddings from '{embeddings_file}'...")
-        try:
-            with open(embeddings_file, "r", encoding="utf-8") as file:
-                return torch.tensor(json.load(file))
-        except json.JSONDecodeError:
-            print(f"Invalid JSON format in embeddings file '{embeddings_file}'.")
-            embeddings = []
-    else:
-        print(f"No embeddings found. Generating new embeddings...")
-        embeddings = generate_embeddings(vault_content)
-        save_embeddings(embeddings, embeddings_file)
-    return torch.tensor(embeddings)
+def load_or_generate_embeddings(vault_content, embeddings_file, embedder, embeddings_dtype="float32"):
+    matrix = load_or_build_embeddings(
+        vault_content,
+        embeddings_file,
+        embedder.model,
+        lambda content: generate_embeddings(content, embedder),
+        embeddings_dtype,
+    )
+    return matrix
 
-def generate_embeddings(vault_content):
+def generate_embeddings(vault_content, embedder):
     print("Generating embeddings...")
-    embeddings = []
-    for content in vault_content:
-        try:
-            response = ollama.embeddings(model='mxbai-embed-large', prompt=content)
-            embeddings.append(response["embedding"])
-        except Exception as e:
-            print(f"Error generating embeddings: {str(e)}")
-    return embeddings
-
-def save_embeddings(embeddings, embeddings_file):
-    print(f"Saving embeddings to '{embeddings_file}'...")
     try:
-        with open(embeddings_file, "w", encoding="utf-8") as file:
-            json.dump(embeddings, file)
+        return embedder.embed(vault_content)
     except Exception as e:
-        print(f"Error saving embeddings: {str(e)}")
+        print(f"Error generating embeddings: {str(e)}")
+        raise
 
-def get_relevant_context(rewritten_input, vault_embeddings, vault_content, top_k):
+def get_relevant_context(queries, retriever, vault_content, top_k, packer=None):
     print("Retrieving relevant context...")
-    if vault_embeddings.nelement() == 0:
+    if len(retriever) == 0:
         return []
+    if isinstance(queries, str):
+        queries = [queries]
     try:
-        input_embedding = ollama.embeddings(model='mxbai-embed-large', prompt=rewritten_input)["embedding"]
-        cos_scores = torch.cosine_similarity(torch.tensor(input_embedding).unsqueeze(0), vault_embeddings)
-        top_k = min(top_k, len(cos_scores))
-        top_indices = torch.topk(cos_scores, k=top_k)[1].tolist()
+        top_indices = retriever.retrieve(queries, top_k)
+        if packer is not None:
+            return packer.pack(top_indices, vault_content)
         return [vault_content[idx].strip() for idx in top_indices]
     except Exception as e:
         print(f"Error getting relevant context: {str(e)}")
         return []
 
-def ollama_chat(user_input, system_message, vault_embeddings, vault_content, ollama_model, conversation_history, top_k, client):
-    relevant_context = get_relevant_context(user_input, vault_embeddings, vault_content, top_k)
+@tracing.traced("chat_turn")
+def ollama_chat(user_input, system_message, retriever, vault_content, ollama_model, conversation_history, top_k, client, stream=True, packer=None, response_cache=None):
+    relevant_context = get_relevant_context(user_input, retriever, vault_content, top_k, packer)
     if relevant_context:
         context_str = "\n".join(relevant_context)
         print("Context Pulled from Documents: \n\n" + CYAN + context_str + RESET_COLOR)
     else:
         print("No relevant context found.")
+    if packer is not None:
+        print(PINK + packer.report() + RESET_COLOR)
+
+    # The first question of a conversation does not depend on earlier turns, so its answer can come from the cache
+    cache_scope = ollama_model + "\n" + system_message
+    use_cache = response_cache is not None and len(conversation_history) == 0
+    cached, embedding = None, None
+    if use_cache:
+        embedding = question_embedding(retriever, user_input)
+        cached = response_cache.get(cache_scope, relevant_context, user_input, embedding)
 
     user_input_with_context = user_input
     if relevant_context:
         user_input_with_context = context_str + "\n\n" + user_input
 
-    conversation_history.append({"role": "user", "content": user_input_with_context})
-    messages = [{"role": "system", "content": system_message}, *conversation_history]
+    conversation_history.append("user", user_input_with_context, raw=user_input)
+    messages = conversation_history.messages(system_message)
+    print(PINK + conversation_history.report() + RESET_COLOR)
 
     try:
-        response = client.chat.completions.create(
-            model=ollama_model,
-            messages=messages
-        )
-        conversation_history.append({"role": "assistant", "content": response.choices[0].message.content})
-        return response.choices[0].message.content
+        generation_start = time.perf_counter()
+        if cached is not None:
+            response_text = cached["response"]
+            print(PINK + describe_hit(cached) + RESET_COLOR)
+            if stream:
+                print(NEON_GREEN + "Response: \n" + RESET_COLOR + response_text)
+        elif stream:
+            print(NEON_GREEN + "Response: \n" + RESET_COLOR)
+            response_text, stats = stream_chat_completion(client, ollama_model, messages)
+            print_stream_stats(stats)
+            if packer is not None:
+                packer.observe(stats)
+        else:
+            with tracing.span("chat_completion", model=ollama_model, stream=False) as span:
+                response = client.chat.completions.create(
+                    model=ollama_model,
+                    messages=messages
+                )
+                tracing.record_usage(span, response.usage)
+            response_text = response.choices[0].message.content
+        if use_cache and cached is None:
+            response_cache.put(cache_scope, relevant_context, user_input, embedding, response_text, time.perf_counter() - generation_start)
+        conversation_history.append("assistant", response_text)
+        return response_text
     except Exception as e:
         print(f"Error in Ollama chat: {str(e)}")
         return "An error occurred while processing your request."
@@ -114,6 +142,7 @@ def main():
     args = parser.parse_args()
 
     config = load_config(args.config)
+    tracing.configure(config.get("trace_file"), config.get("metrics_port"))
 
     if args.clear_cache and os.path.exists(config["embeddings_file"]):
         print(f"Clearing embeddings cache at '{config['embeddings_file']}'...")
@@ -125,25 +154,123 @@ def main():
     vault_content = []
     if os.path.exists(config["vault_file"]):
         print(f"Loading content from vault '{config['vault_file']}'...")
-        with open(config["vault_file"], "r", encoding='utf-8') as vault_file:
-            vault_content = vault_file.readlines()
+        vault_content = VaultStore(config["vault_file"])
+
+    embedding_model = config.get("embedding_model", "mxbai-embed-large")
+    embedder = BatchEmbedder(
+        embedding_model,
+        batch_size=config.get("embed_batch_size", 32),
+        concurrency=config.get("embed_concurrency", 4),
+        max_retries=config.get("embed_max_retries", 3),
+    )
+    vault_embeddings = load_or_generate_embeddings(
+        vault_content, config["embeddings_file"], embedder, config.get("embeddings_dtype", "float32")
+    )
 
-    vault_embeddings_tensor = load_or_generate_embeddings(vault_content, config["embeddings_file"])
+    ann_index = None
+    if config.get("ann_index", False) and len(vault_embeddings) > 0:
+        ann_index = load_or_build_index(
+            config["embeddings_file"],
+            vault_embeddings,
+            n_lists=config.get("ann_lists") or None,
+            nprobe=config.get("ann_nprobe", 8),
+        )
+    quantized_index = None
+    if config.get("quantization", "none") != "none" and len(vault_embeddings) > 0:
+        quantized_index = load_or_build_quantized(
+            config["embeddings_file"],
+            vault_embeddings,
+            config["quantization"],
+            config.get("rescore_oversample", 4),
+        )
+    query_cache = QueryEmbeddingCache(
+        config.get("query_cache_size", 1024),
+        max_bytes=config.get("query_cache_max_bytes", 64 * 1024 * 1024),
+        ttl=config.get("query_cache_ttl", 3600),
+        path=config.get("query_cache_file") or None,
+    )
+    retrieval_mode = config.get("retrieval_mode", "hybrid")
+    lexical_index = None
+    if retrieval_mode != "dense":
+        lexical_index = load_or_build_bm25(vault_content, config["vault_file"] + ".bm25.npz")
+    retriever = VaultRetriever(vault_embeddings, embedding_model, ann_index, query_cache, lexical_index, retrieval_mode, quantized_index,
+                               get_backend(config.get("vector_backend", "numpy"), config.get("search_workers", 0)))
 
     client = OpenAI(
         base_url=config["ollama_api"]["base_url"],
         api_key=config["ollama_api"]["api_key"]
     )
 
-    conversation_history = []
+    summarizer = make_llm_summarizer(client, config["ollama_model"]) if config.get("history_summarize", False) else None
+    conversation_history = ConversationHistory(
+        config.get("history_max_tokens", 4096),
+        config.get("history_pinned_turns", 0),
+        summarizer=summarizer,
+    )
     system_message = config["system_message"]
+    packer = None
+    if config.get("context_packing", True):
+        packer = ContextPacker(
+            config.get("context_max_tokens", 1024),
+            config.get("context_mmr_lambda", 0.7),
+            config.get("context_redundancy_threshold", 0.9),
+            vault_embeddings,
+        )
+    response_cache = None
+    if config.get("response_cache", False):
+        response_cache = ResponseCache(
+            store_version(config["embeddings_file"]),
+            config.get("response_cache_size", 1024),
+            threshold=config.get("response_cache_threshold", 0.95),
+            path=config.get("response_cache_file") or None,
+        )
+    # Records appended to the vault while running (collect_emails.py, upload.py) are embedded and indexed in the background
+    watcher = None
+    watcher_status = None
+    if config.get("watch_vault", False):
+        if config.get("vector_backend", "numpy") == "sharded":
+            print("watch_vault is not available with the sharded vector backend; the vault is not watched.")
+        else:
+            watcher = VaultWatcher(
+                config["vault_file"],
+                config["embeddings_file"],
+                retriever,
+                vault_content,
+                lambda texts: embedder.embed(texts, show_progress=False),
+                config.get("watch_interval", 2.0),
+            )
+            watcher_status = watcher.status()
+            watcher.start()
 
     while True:
         user_input = input(YELLOW + "Ask a question about your documents (or type 'quit' to exit): " + RESET_COLOR)
         if user_input.lower() == 'quit':
             break
-        response = ollama_chat(user_input, system_message, vault_embeddings_tensor, vault_content, config["ollama_model"], conversation_history, config["top_k"], client)
-        print(NEON_GREEN + "Response: \n\n" + response + RESET_COLOR)
+        if watcher is not None and watcher.status() != watcher_status:
+            # Use the latest epoch of the vault for this turn
+            watcher_status = watcher.status()
+            snapshot = watcher.current
+            retriever, vault_content = snapshot.retriever, snapshot.vault_content
+            print(PINK + watcher.report() + RESET_COLOR)
+            if packer is not None:
+                packer.embeddings = retriever.embeddings
+            if response_cache is not None:
+                response_cache.set_version(snapshot.version)
+        stream = config.get("stream", True)
+        response = ollama_chat(user_input, system_message, retriever, vault_content, config["ollama_model"], conversation_history, config["top_k"], client, stream, packer, response_cache)
+        if not stream:
+            print(NEON_GREEN + "Response: \n\n" + response + RESET_COLOR)
+
+    if watcher is not None:
+        watcher.stop()
+        print(f"Vault watcher: {watcher.stats()}")
+        if response_cache is not None:
+            response_cache.set_version(watcher.current.version)
+    query_cache.save()
+    print(f"Query embedding cache: {query_cache.stats()}")
+    if response_cache is not None:
+        response_cache.save()
+        print(f"Response cache: {response_cache.stats()}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,66 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import ollama
+import tracing
+
+# Batching embedder: sends many chunks per request to Ollama's /api/embed endpoint and keeps
+# several requests in flight from a thread pool. Failed batches are retried with exponential
+# backoff; if a batch still fails the whole call raises, so returned rows always line up with
+# the input chunks.
+class BatchEmbedder:
+    def __init__(self, model, batch_size=32, concurrency=4, max_retries=3, backoff=0.5, host=None):
+        if batch_size < 1 or concurrency < 1:
+            raise ValueError("batch_size and concurrency must be at least 1")
+        self.model = model
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.client = ollama.Client(host=host) if host else ollama.Client()
+
+    def _embed_batch(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                with tracing.span("embed_batch", chunks=len(batch), attempt=attempt) as span:
+                    response = self.client.embed(model=self.model, input=batch)
+                    span.set(prompt_tokens=response.get("prompt_eval_count"),
+                             ollama_total_ms=(response.get("total_duration") or 0) / 1e6)
+                embeddings = response["embeddings"]
+                if len(embeddings) != len(batch):
+                    raise ValueError(f"Ollama returned {len(embeddings)} embeddings for {len(batch)} chunks")
+                return embeddings
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff * (2 ** attempt)
+                print(f"\nError generating embeddings ({str(e)}), retrying in {delay:.1f}s...")
+                time.sleep(delay)
+
+    # Function to embed a list of chunks, returning one embedding per chunk in input order
+    def embed(self, texts, show_progress=True):
+        texts = list(texts)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = [None] * len(batches)
+        done = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = {pool.submit(self._embed_batch, batch): i for i, batch in enumerate(batches)}
+            try:
+                for future in as_completed(futures):
+                    i = futures[future]
+                    results[i] = future.result()
+                    done += len(batches[i])
+                    if show_progress:
+                        elapsed = time.perf_counter() - start
+                        rate = done / elapsed if elapsed > 0 else 0.0
+                        sys.stdout.write(f"\rEmbedded {done}/{len(texts)} chunks ({rate:.1f} chunks/s)")
+                        sys.stdout.flush()
+            except Exception:
+                for pending in futures:
+                    pending.cancel()
+                raise
+        if show_progress and texts:
+            elapsed = time.perf_counter() - start
+            print(f"\nEmbedded {len(texts)} chunks in {elapsed:.1f}s ({len(texts) / max(elapsed, 1e-9):.1f} chunks/s)")
+        return [embedding for batch in results for embedding in batch]
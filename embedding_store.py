@@ -0,0 +1,181 @@
+import os
+import json
+import struct
+import hashlib
+import numpy as np
+
+# Binary embedding store layout:
+#   8 bytes   magic
+#   4 bytes   format version (uint32, little endian)
+#   4 bytes   header length (uint32, little endian)
+#   N bytes   JSON header (model, dim, rows, dtype, vault_checksum)
+#   keys      rows * KEY_SIZE bytes, the content hash of each row's chunk (see chunk_key)
+#   padding   up to DATA_ALIGNMENT so the matrix starts on an aligned offset
+#   matrix    rows * dim contiguous float32/float16 values (row major)
+MAGIC = b"ELRAGEMB"
+FORMAT_VERSION = 2
+KEY_SIZE = 16
+DATA_ALIGNMENT = 64
+SUPPORTED_DTYPES = ("float32", "float16")
+WRITE_BLOCK_ROWS = 4096
+
+# Function to hash the vault content; the hash can be updated with appended lines (see vault_watcher.py)
+def vault_digest(vault_content):
+    digest = hashlib.sha256()
+    for line in vault_content:
+        digest.update(line.encode("utf-8"))
+    return digest
+
+# Function to compute a checksum identifying the exact vault content the embeddings were built from
+def vault_checksum(vault_content):
+    return vault_digest(vault_content).hexdigest()
+
+# Function to compute the cache key of a chunk: a hash of its text plus the embedding model name
+def chunk_key(text, model):
+    digest = hashlib.blake2b(digest_size=KEY_SIZE)
+    digest.update(model.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.digest()
+
+def _keys_offset(header_bytes):
+    return len(MAGIC) + 8 + len(header_bytes)
+
+def _data_offset(header_bytes, rows):
+    offset = _keys_offset(header_bytes) + rows * KEY_SIZE
+    return (offset + DATA_ALIGNMENT - 1) // DATA_ALIGNMENT * DATA_ALIGNMENT
+
+# Function to write embeddings to a binary store (written to a temp file and renamed into place).
+# keys holds one chunk_key per row so later runs can reuse rows whose chunk text has not changed.
+def save_embedding_store(path, embeddings, keys, model, vault_checksum, dtype="float32"):
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported embeddings dtype '{dtype}', expected one of {SUPPORTED_DTYPES}")
+    rows = len(embeddings)
+    if len(keys) != rows:
+        raise ValueError(f"Got {len(keys)} keys for {rows} embedding rows")
+    dim = len(embeddings[0]) if rows else 0
+    header = {
+        "model": model,
+        "dim": dim,
+        "rows": rows,
+        "dtype": dtype,
+        "vault_checksum": vault_checksum,
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_offset = _data_offset(header_bytes, rows)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(MAGIC)
+        file.write(struct.pack("<II", FORMAT_VERSION, len(header_bytes)))
+        file.write(header_bytes)
+        file.write(b"".join(keys))
+        file.write(b"\0" * (data_offset - file.tell()))
+        # Write in blocks so a Python list of embeddings is never converted to one big array at once
+        for start in range(0, rows, WRITE_BLOCK_ROWS):
+            block = np.asarray(embeddings[start:start + WRITE_BLOCK_ROWS], dtype=dtype)
+            if block.ndim != 2 or block.shape[1] != dim:
+                raise ValueError(f"Embedding rows {start}..{start + len(block)} do not have dimension {dim}")
+            file.write(np.ascontiguousarray(block).tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+    return header
+
+# Function to read only the header of a binary store
+def read_store_header(path):
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"'{path}' is not an embedding store")
+        version, header_len = struct.unpack("<II", file.read(8))
+        if version != FORMAT_VERSION:
+            raise ValueError(f"'{path}' has unsupported store version {version}")
+        header_bytes = file.read(header_len)
+    header = json.loads(header_bytes.decode("utf-8"))
+    header["keys_offset"] = _keys_offset(header_bytes)
+    header["data_offset"] = _data_offset(header_bytes, header["rows"])
+    return header
+
+# Function to read the chunk keys of a binary store as a list of bytes, one per row
+def load_store_keys(path, header=None):
+    header = header or read_store_header(path)
+    with open(path, "rb") as file:
+        file.seek(header["keys_offset"])
+        data = file.read(header["rows"] * KEY_SIZE)
+    return [data[i:i + KEY_SIZE] for i in range(0, len(data), KEY_SIZE)]
+
+# Function to open a binary store with mmap; pages are only read from disk when the search touches them.
+# mode 'c' is copy-on-write so callers (e.g. torch.from_numpy) get a writable view without modifying the file.
+def load_embedding_store(path, mode="c"):
+    header = read_store_header(path)
+    if header["dtype"] not in SUPPORTED_DTYPES:
+        raise ValueError(f"'{path}' has unsupported dtype '{header['dtype']}'")
+    if header["rows"] == 0:
+        return header, np.zeros((0, header["dim"]), dtype=header["dtype"])
+    matrix = np.memmap(path, dtype=header["dtype"], mode=mode, offset=header["data_offset"],
+                       shape=(header["rows"], header["dim"]))
+    return header, matrix
+
+# Function to load the embeddings for the vault, embedding only chunks that are not already in the store.
+# Rows are keyed by chunk_key, so unchanged lines are reused wherever they moved, new or edited lines
+# are embedded, and rows for deleted lines are dropped when the store is rewritten.
+def load_or_build_embeddings(vault_content, path, model, embed_fn, dtype="float32"):
+    checksum = vault_checksum(vault_content)
+    keys = [chunk_key(content, model) for content in vault_content]
+
+    header, matrix, cached_keys = None, None, []
+    if os.path.exists(path):
+        try:
+            header, matrix = load_embedding_store(path)
+            cached_keys = load_store_keys(path, header)
+        except (ValueError, OSError) as e:
+            print(f"Could not read embeddings store '{path}': {str(e)}")
+            header, matrix, cached_keys = None, None, []
+    else:
+        print(f"No embeddings found at '{path}'. Generating new embeddings...")
+
+    if header is not None and cached_keys == keys and header["dtype"] == dtype:
+        print(f"Loaded {header['rows']} embeddings from '{path}'.")
+        return matrix
+
+    cached_rows = {key: row for row, key in enumerate(cached_keys)}
+    # Embed each missing chunk once, even if the same line appears several times in the vault
+    missing = {}
+    for idx, key in enumerate(keys):
+        if key not in cached_rows and key not in missing:
+            missing[key] = idx
+    reused = sum(1 for key in keys if key in cached_rows)
+    dropped = len(set(cached_keys) - set(keys))
+    print(f"Embedding {len(missing)} new chunks ({reused} reused, {dropped} dropped)...")
+
+    new_embeddings = embed_fn([vault_content[idx] for idx in missing.values()]) if missing else []
+    if len(new_embeddings) != len(missing):
+        raise ValueError(f"Expected {len(missing)} embeddings but got {len(new_embeddings)}")
+
+    if new_embeddings:
+        dim = len(new_embeddings[0])
+    elif matrix is not None:
+        dim = matrix.shape[1]
+    else:
+        dim = 0
+    if reused and matrix.shape[1] != dim:
+        raise ValueError(f"Embedding dimension changed from {matrix.shape[1]} to {dim}; clear '{path}' first")
+
+    embeddings = np.empty((len(keys), dim), dtype=dtype)
+    new_rows = {key: row for row, key in enumerate(missing)}
+    new_matrix = np.asarray(new_embeddings, dtype=dtype).reshape(len(new_embeddings), dim)
+    cached_src, cached_dst, new_src, new_dst = [], [], [], []
+    for idx, key in enumerate(keys):
+        if key in cached_rows:
+            cached_src.append(cached_rows[key])
+            cached_dst.append(idx)
+        else:
+            new_src.append(new_rows[key])
+            new_dst.append(idx)
+    if cached_dst:
+        embeddings[cached_dst] = matrix[cached_src]
+    if new_dst:
+        embeddings[new_dst] = new_matrix[new_src]
+
+    save_embedding_store(path, embeddings, keys, model, checksum, dtype)
+    return load_embedding_store(path)[1]
@@ -0,0 +1,104 @@
+import tracing
+from token_counter import count_message_tokens
+
+# Conversation history with a token budget.
+# - User messages keep their retrieved context only for the last keep_context_turns turns;
+#   older ones are resent with just the question.
+# - When the prompt goes over max_tokens, the oldest unpinned messages are dropped (optionally folded
+#   into a running summary) down to low_water * max_tokens. Trimming well below the budget, and never
+#   touching the system message and pinned turns, keeps the prompt prefix identical for several turns
+#   so Ollama's KV-cache prefix reuse stays effective.
+class ConversationHistory:
+    def __init__(self, max_tokens=4096, pinned_turns=0, keep_context_turns=1, summarizer=None, low_water=0.75):
+        self.max_tokens = max_tokens
+        self.pinned_turns = pinned_turns
+        self.keep_context_turns = keep_context_turns
+        self.summarizer = summarizer
+        self.low_water = low_water
+        self.turns = []
+        self.summary = None
+        self.dropped_turns = 0
+        self.last_prompt_tokens = 0
+
+    def __len__(self):
+        return len(self.turns)
+
+    # List-style access returns plain messages with the raw (context-free) content
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [{"role": turn["role"], "content": turn["raw"]} for turn in self.turns[index]]
+        turn = self.turns[index]
+        return {"role": turn["role"], "content": turn["raw"]}
+
+    def append(self, role, content, raw=None):
+        self.turns.append({"role": role, "content": content, "raw": content if raw is None else raw})
+
+    # Function to replace the content of the latest message (e.g. the user input with its retrieved context)
+    def update_last(self, content):
+        self.turns[-1]["content"] = content
+
+    def _render(self):
+        user_turns = [i for i, turn in enumerate(self.turns) if turn["role"] == "user"]
+        with_context = set(user_turns[-self.keep_context_turns:]) if self.keep_context_turns > 0 else set()
+        return [
+            {"role": turn["role"], "content": turn["content"] if turn["role"] != "user" or i in with_context else turn["raw"]}
+            for i, turn in enumerate(self.turns)
+        ]
+
+    def _prefix(self, system_message):
+        prefix = [{"role": "system", "content": system_message}]
+        if self.summary:
+            prefix.append({"role": "system", "content": "Summary of the earlier conversation:\n" + self.summary})
+        return prefix
+
+    def _trim(self, system_message):
+        target = int(self.max_tokens * self.low_water)
+        messages = self._render()
+        total = sum(count_message_tokens(m) for m in self._prefix(system_message) + messages)
+        drop = 0
+        # Drop whole messages after the pinned turns, always keeping the latest message
+        while total > target and self.pinned_turns + drop < len(self.turns) - 1:
+            total -= count_message_tokens(messages[self.pinned_turns + drop])
+            drop += 1
+        if drop == 0:
+            return
+        dropped = self.turns[self.pinned_turns:self.pinned_turns + drop]
+        del self.turns[self.pinned_turns:self.pinned_turns + drop]
+        self.dropped_turns += drop
+        if self.summarizer is not None:
+            with tracing.span("summarize_history", messages=len(dropped)):
+                self.summary = self.summarizer(self.summary, [{"role": t["role"], "content": t["raw"]} for t in dropped])
+
+    # Function to build the messages to send: system prefix, pinned turns and the recent turns within budget
+    def messages(self, system_message):
+        messages = self._prefix(system_message) + self._render()
+        if sum(count_message_tokens(m) for m in messages) > self.max_tokens:
+            self._trim(system_message)
+            messages = self._prefix(system_message) + self._render()
+        self.last_prompt_tokens = sum(count_message_tokens(m) for m in messages)
+        return messages
+
+    def report(self):
+        return f"[prompt: ~{self.last_prompt_tokens} tokens, {len(self.turns)} messages kept, {self.dropped_turns} dropped]"
+
+# Function to build a summarizer that condenses dropped turns with the chat model
+def make_llm_summarizer(client, model, max_tokens=300):
+    def summarize(previous_summary, dropped_messages):
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in dropped_messages)
+        if previous_summary:
+            transcript = f"Earlier summary: {previous_summary}\n{transcript}"
+        prompt = f"""Summarize the following conversation in a few sentences, keeping names, numbers and facts the user may refer back to.
+Return ONLY the summary.
+
+{transcript}
+"""
+        response = client.chat.completions.create(
+            model=model,
+            messages=[{"role": "system", "content": prompt}],
+            max_tokens=max_tokens,
+            temperature=0.1,
+        )
+        tracing.annotate(prompt_tokens=response.usage.prompt_tokens if response.usage else None,
+                         completion_tokens=response.usage.completion_tokens if response.usage else None)
+        return response.choices[0].message.content.strip()
+    return summarize
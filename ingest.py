@@ -0,0 +1,256 @@
+import os
+import json
+import glob
+import time
+import hashlib
+import argparse
+import tempfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import tracing
+from chunking import chunk_text, read_blocks, append_chunks_to_vault
+from dedup import DEFAULT_THRESHOLD, load_or_build_dedup, dedup_index_path_for
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".json")
+MANIFEST_PATH = "ingest_manifest.json"
+PAGES_PER_TASK = 16
+HASH_BLOCK_SIZE = 1 << 20
+
+# Function to expand files, directories and glob patterns into the supported files they contain
+def iter_input_files(patterns):
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if any(c in pattern for c in "*?[") else [pattern]
+        for match in matches:
+            if os.path.isdir(match):
+                for root, dirs, files in os.walk(match):
+                    dirs.sort()
+                    for name in sorted(files):
+                        if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                            yield os.path.join(root, name)
+            elif os.path.isfile(match) and match.lower().endswith(SUPPORTED_EXTENSIONS):
+                yield match
+
+# Function to identify a file by path, size and mtime, plus its content hash when use_hash is set
+def file_fingerprint(path, use_hash=False):
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime}
+    if use_hash:
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+        fingerprint["sha256"] = digest.hexdigest()
+    return fingerprint
+
+# Record of the files already appended to the vault, so re-runs skip them. Each recorded file is appended
+# as one JSON line to a journal next to the manifest (ingest_manifest.json.journal), which is replayed on
+# load and folded into the manifest by save(), so recording a file costs the same however many there are.
+class IngestManifest:
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.files = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as file:
+                    self.files = json.load(file)["files"]
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Could not read ingest manifest '{path}': {str(e)}")
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                        self.files[entry.pop("path")] = entry
+                    except (ValueError, KeyError):
+                        # A line cut short by an interrupted run
+                        continue
+            # Start this run with an empty journal, so nothing is appended after a cut-short line
+            self.save()
+        self.hashes = {entry["sha256"] for entry in self.files.values() if "sha256" in entry}
+
+    def is_ingested(self, path, fingerprint):
+        entry = self.files.get(os.path.abspath(path))
+        if entry and entry["size"] == fingerprint["size"] and entry["mtime"] == fingerprint["mtime"]:
+            return True
+        return "sha256" in fingerprint and fingerprint["sha256"] in self.hashes
+
+    def record(self, path, fingerprint, chunks):
+        entry = {**fingerprint, "chunks": chunks, "ingested_at": time.time()}
+        self.files[os.path.abspath(path)] = entry
+        if "sha256" in fingerprint:
+            self.hashes.add(fingerprint["sha256"])
+        with open(self.journal_path, "a", encoding="utf-8") as file:
+            file.write(json.dumps({"path": os.path.abspath(path), **entry}) + "\n")
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({"files": self.files}, file)
+        os.replace(tmp_path, self.path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+# Function run in a worker process: extract the text of pages [start, stop) of a PDF
+def extract_pdf_pages(path, start, stop):
+    import PyPDF2
+    reader = PyPDF2.PdfReader(path)
+    texts = []
+    for page_num in range(start, stop):
+        page_text = reader.pages[page_num].extract_text()
+        if page_text:
+            texts.append(page_text + " ")
+    return texts
+
+# Function to stream the text pieces of a .txt or .json file
+def iter_file_pieces(path):
+    if path.lower().endswith(".json"):
+        with open(path, "r", encoding="utf-8") as json_file:
+            data = json.load(json_file)
+        # Flatten the JSON data into a stream of text pieces
+        yield from json.JSONEncoder(ensure_ascii=False).iterencode(data)
+    else:
+        with open(path, "r", encoding="utf-8") as txt_file:
+            yield from read_blocks(txt_file)
+
+# Executor that runs each task right away in this process, used with a single worker (e.g. one file
+# from upload.py), where starting a worker process would cost more than the extraction itself
+class InlineExecutor:
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+# Function to collect PDF page texts in page order; all ranges must succeed before anything is written
+def collect_pdf_results(futures):
+    return [text for future in futures for text in future.result()]
+
+# Function to chunk a file into a temporary file, one chunk per line, so a file that fails halfway
+# (a bad page, a decoding error) leaves nothing in the vault and nothing in the dedup index
+def stage_chunks(pieces, max_length, overlap):
+    staged = tempfile.TemporaryFile("w+", encoding="utf-8")
+    try:
+        for chunk in chunk_text(pieces, max_length, overlap):
+            staged.write(" ".join(chunk.splitlines()) + "\n")
+        staged.seek(0)
+    except BaseException:
+        staged.close()
+        raise
+    return staged
+
+# Function to ingest files into the vault. PDFs are split into page ranges that are extracted by a
+# process pool (or in this process with workers=1); the main process is the single writer that chunks
+# each file in order and, once the whole file is chunked, appends it to the vault and records it in the
+# manifest. Files already in the manifest (same path, size and mtime, or same content hash) are skipped,
+# and chunks that duplicate or nearly duplicate one already in the vault are dropped
+# (set dedup_threshold to None to keep everything).
+@tracing.traced("ingest")
+def ingest_files(paths, vault_path="vault.txt", manifest_path=MANIFEST_PATH, workers=None, use_hash=False,
+                 max_length=1000, overlap=0, dedup_threshold=DEFAULT_THRESHOLD):
+    manifest = IngestManifest(manifest_path)
+    dedup = load_or_build_dedup(vault_path, dedup_threshold) if dedup_threshold is not None else None
+    stats = {"files": 0, "skipped": 0, "failed": 0, "chunks": 0, "pages": 0}
+    start_time = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    max_pending_tasks = workers * 4
+    pending = deque()
+    pending_tasks = 0
+
+    def write_next():
+        nonlocal pending_tasks
+        path, fingerprint, futures = pending.popleft()
+        pending_tasks -= len(futures or [])
+        try:
+            with tracing.span("ingest_file", path=path, pages=len(futures or [])) as span:
+                pieces = collect_pdf_results(futures) if futures is not None else iter_file_pieces(path)
+                with stage_chunks(pieces, max_length, overlap) as staged:
+                    chunks = (line.rstrip("\n") for line in staged)
+                    count = append_chunks_to_vault(dedup.filter(chunks) if dedup else chunks, vault_path,
+                                                   metadata={"source": os.path.abspath(path)})
+                    # Journaled right away, so a later failure or an interrupted run does not ingest the file again
+                    manifest.record(path, fingerprint, count)
+                span.set(chunks=count)
+        except Exception as e:
+            print(f"Failed to ingest '{path}': {str(e)}")
+            stats["failed"] += 1
+            return
+        stats["files"] += 1
+        stats["chunks"] += count
+        print(f"Ingested '{path}' ({count} chunks)")
+
+    with ProcessPoolExecutor(max_workers=workers) if workers > 1 else InlineExecutor() as pool:
+        for path in paths:
+            try:
+                fingerprint = file_fingerprint(path, use_hash)
+            except OSError as e:
+                print(f"Failed to read '{path}': {str(e)}")
+                stats["failed"] += 1
+                continue
+            if manifest.is_ingested(path, fingerprint):
+                print(f"Skipping '{path}' (already ingested)")
+                stats["skipped"] += 1
+                continue
+            futures = None
+            if path.lower().endswith(".pdf"):
+                # PyPDF2 is only imported once a PDF is ingested
+                import PyPDF2
+                try:
+                    num_pages = len(PyPDF2.PdfReader(path).pages)
+                except Exception as e:
+                    print(f"Failed to open PDF '{path}': {str(e)}")
+                    stats["failed"] += 1
+                    continue
+                futures = [pool.submit(extract_pdf_pages, path, page, min(page + PAGES_PER_TASK, num_pages))
+                           for page in range(0, num_pages, PAGES_PER_TASK)]
+                stats["pages"] += num_pages
+                pending_tasks += len(futures)
+            pending.append((path, fingerprint, futures))
+            # Keep a bounded number of extraction tasks queued ahead of the writer
+            while pending and pending_tasks > max_pending_tasks:
+                write_next()
+        while pending:
+            write_next()
+    manifest.save()
+    if dedup:
+        dedup.save(dedup_index_path_for(vault_path), vault_path)
+        stats["duplicates"] = dedup.stats["exact"] + dedup.stats["near"]
+        stats["dedup_report"] = dedup.report()
+
+    stats["seconds"] = time.perf_counter() - start_time
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest PDF, text and JSON files into the vault")
+    parser.add_argument("paths", nargs="+", help="Files, directories or glob patterns (e.g. 'docs/**/*.pdf')")
+    parser.add_argument("--vault", default="vault.txt", help="Vault file to append to (default: vault.txt)")
+    parser.add_argument("--manifest", default=MANIFEST_PATH, help=f"Record of ingested files (default: {MANIFEST_PATH})")
+    parser.add_argument("--workers", type=int, default=0, help="PDF extraction processes, 1 to extract in this process (default: CPU count)")
+    parser.add_argument("--hash", action="store_true", help="Also skip files whose content hash was already ingested")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Maximum chunk length in characters (default: 1000)")
+    parser.add_argument("--chunk-overlap", type=int, default=0, help="Characters of overlap between chunks (default: 0)")
+    parser.add_argument("--dedup-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Similarity above which a chunk counts as a near duplicate and is dropped (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--no-dedup", action="store_true", help="Keep duplicate chunks")
+    parser.add_argument("--trace-file", default="", help="Append a per-stage trace to this JSONL file (summarize with python tracing.py FILE)")
+    parser.add_argument("--metrics-port", type=int, default=0, help="Serve per-stage metrics on http://127.0.0.1:PORT/metrics while running")
+    args = parser.parse_args()
+    tracing.configure(args.trace_file, args.metrics_port)
+
+    stats = ingest_files(iter_input_files(args.paths), args.vault, args.manifest, args.workers or None,
+                         args.hash, args.chunk_size, args.chunk_overlap, None if args.no_dedup else args.dedup_threshold)
+    if "dedup_report" in stats:
+        print(stats["dedup_report"])
+    print(f"Ingested {stats['files']} files ({stats['pages']} PDF pages, {stats['chunks']} chunks), "
+          f"skipped {stats['skipped']}, failed {stats['failed']} in {stats['seconds']:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,25 @@
-import torch
-import ollama
 import os
+import time
 from openai import OpenAI
 import argparse
 import json
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from embedding_store import load_or_build_embeddings
+from embedder import BatchEmbedder
+from ann_index import load_or_build_index
+from quantization import load_or_build_quantized
+from vector_backend import get_backend
+from retrieval import VaultRetriever, merge_results, query_similarity
+from query_cache import QueryEmbeddingCache
+from bm25_index import load_or_build_bm25
+from streaming import stream_chat_completion, print_stream_stats
+from history import ConversationHistory, make_llm_summarizer
+from vault_store import VaultStore
+from context_packing import ContextPacker
+from response_cache import ResponseCache, store_version, question_embedding, describe_hit
+from vault_watcher import VaultWatcher
+import tracing
 
 # ANSI escape codes for colors
 PINK = '\033[95m'
@@ -17,18 +33,17 @@ def open_file(filepath):
     with open(filepath, 'r', encoding='utf-8') as infile:
         return infile.read()
 
-# Function to get relevant context from the vault based on user input
-def get_relevant_context(rewritten_input, vault_embeddings, vault_content, top_k=3):
-    if vault_embeddings.nelement() == 0:  # Check if the tensor has any elements
+# Function to get relevant context from the vault based on one or more queries
+def get_relevant_context(queries, retriever, vault_content, top_k=3, packer=None):
+    if len(retriever) == 0:  # Check if the vault has any embeddings
         return []
-    # Encode the rewritten input
-    input_embedding = ollama.embeddings(model='mxbai-embed-large', prompt=rewritten_input)["embedding"]
-    # Compute cosine similarity between the input and vault embeddings
-    cos_scores = torch.cosine_similarity(torch.tensor(input_embedding).unsqueeze(0), vault_embeddings)
-    # Adjust top_k if it's greater than the number of available scores
-    top_k = min(top_k, len(cos_scores))
-    # Sort the scores and get the top-k indices
-    top_indices = torch.topk(cos_scores, k=top_k)[1].tolist()
+    if isinstance(queries, str):
+        queries = [queries]
+    # Encode all queries in one request and score them against the vault in a single matrix multiply
+    top_indices = retriever.retrieve(queries, top_k)
+    if packer is not None:
+        # Drop redundant chunks, merge neighbouring ones and keep the context within the token budget
+        return packer.pack(top_indices, vault_content)
     # Get the corresponding context from the vault
     relevant_context = [vault_content[idx].strip() for idx in top_indices]
     return relevant_context
@@ -53,20 +68,61 @@ def rewrite_query(user_input_json, conversation_history, ollama_model):
     
     Rewritten query: 
     """
-    response = client.chat.completions.create(
-        model=ollama_model,
-        messages=[{"role": "system", "content": prompt}],
-        max_tokens=200,
-        n=1,
-        temperature=0.1,
-    )
+    with tracing.span("rewrite_query", model=ollama_model) as span:
+        response = client.chat.completions.create(
+            model=ollama_model,
+            messages=[{"role": "system", "content": prompt}],
+            max_tokens=200,
+            n=1,
+            temperature=0.1,
+        )
+        tracing.record_usage(span, response.usage)
     rewritten_query = response.choices[0].message.content.strip()
     return json.dumps({"Rewritten Query": rewritten_query})
    
-def ollama_chat(user_input, system_message, vault_embeddings, vault_content, ollama_model, conversation_history):
-    conversation_history.append({"role": "user", "content": user_input})
+# Function to rewrite the query while speculatively retrieving context for the raw input in parallel.
+# If the rewritten query lands close to the raw one in embedding space the speculative results are
+# reused, otherwise the rewritten query is searched and both top-k sets are merged.
+def pipelined_rewrite_and_retrieve(user_input, retriever, vault_content, ollama_model, conversation_history, top_k=3, threshold=0.9, packer=None):
+    query_json = {
+        "Query": user_input,
+        "Rewritten Query": ""
+    }
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        # Run the rewrite in the current trace context so its span is part of this turn
+        rewrite_future = pool.submit(contextvars.copy_context().run, rewrite_query, json.dumps(query_json), conversation_history, ollama_model)
+        speculative_results = []
+        if len(retriever) > 0:
+            raw_embedding = retriever.embed_queries([user_input])[0]
+            speculative_results = retriever.search([raw_embedding], retriever.search_depth(top_k))
+        rewritten_query = json.loads(rewrite_future.result())["Rewritten Query"]
+    print(PINK + "Original Query: " + user_input + RESET_COLOR)
+    print(PINK + "Rewritten Query: " + rewritten_query + RESET_COLOR)
+    if len(retriever) == 0:
+        return []
+
+    # Same dense depth as retriever.retrieve(), so pipelining changes the latency and not the ranking
+    depth = retriever.search_depth(top_k)
+    rewritten_embedding = retriever.embed_queries([rewritten_query])[0]
+    similarity = query_similarity(raw_embedding, rewritten_embedding)
+    if similarity >= threshold:
+        print(PINK + f"Reusing speculative retrieval (query similarity {similarity:.3f})" + RESET_COLOR)
+        top_indices = merge_results(speculative_results, depth)
+    else:
+        print(PINK + f"Merging speculative and rewritten retrieval (query similarity {similarity:.3f})" + RESET_COLOR)
+        top_indices = merge_results(speculative_results + retriever.search([rewritten_embedding], depth), depth)
+    top_indices = retriever.fuse_lexical([user_input, rewritten_query], top_indices, top_k)
+    if packer is not None:
+        return packer.pack(top_indices, vault_content)
+    return [vault_content[idx].strip() for idx in top_indices]
+
+@tracing.traced("chat_turn")
+def ollama_chat(user_input, system_message, retriever, vault_content, ollama_model, conversation_history, stream=True, pipeline=False, speculative_threshold=0.9, packer=None, response_cache=None):
+    conversation_history.append("user", user_input)
     
-    if len(conversation_history) > 1:
+    if len(conversation_history) > 1 and pipeline and retriever.mode != "lexical":
+        relevant_context = pipelined_rewrite_and_retrieve(user_input, retriever, vault_content, ollama_model, conversation_history, threshold=speculative_threshold, packer=packer)
+    elif len(conversation_history) > 1:
         query_json = {
             "Query": user_input,
             "Rewritten Query": ""
@@ -76,42 +132,107 @@ def ollama_chat(user_input, system_message, vault_embeddings, vault_content, oll
         rewritten_query = rewritten_query_data["Rewritten Query"]
         print(PINK + "Original Query: " + user_input + RESET_COLOR)
         print(PINK + "Rewritten Query: " + rewritten_query + RESET_COLOR)
+        # Score the original and rewritten queries together and merge their results
+        relevant_context = get_relevant_context([user_input, rewritten_query], retriever, vault_content, packer=packer)
     else:
-        rewritten_query = user_input
+        relevant_context = get_relevant_context([user_input], retriever, vault_content, packer=packer)
     
-    relevant_context = get_relevant_context(rewritten_query, vault_embeddings, vault_content)
     if relevant_context:
         context_str = "\n".join(relevant_context)
         print("Context Pulled from Documents: \n\n" + CYAN + context_str + RESET_COLOR)
     else:
         print(CYAN + "No relevant context found." + RESET_COLOR)
+    if packer is not None:
+        print(PINK + packer.report() + RESET_COLOR)
+    
+    # The first query of a conversation is not rewritten from earlier turns, so its answer can come from the cache
+    cache_scope = ollama_model + "\n" + system_message
+    use_cache = response_cache is not None and len(conversation_history) == 1
+    cached, embedding = None, None
+    if use_cache:
+        embedding = question_embedding(retriever, user_input)
+        cached = response_cache.get(cache_scope, relevant_context, user_input, embedding)
     
     user_input_with_context = user_input
     if relevant_context:
         user_input_with_context = user_input + "\n\nRelevant Context:\n" + context_str
     
-    conversation_history[-1]["content"] = user_input_with_context
+    conversation_history.update_last(user_input_with_context)
     
-    messages = [
-        {"role": "system", "content": system_message},
-        *conversation_history
-    ]
+    # Older turns are sent without their retrieved context and trimmed to the token budget
+    messages = conversation_history.messages(system_message)
+    print(PINK + conversation_history.report() + RESET_COLOR)
     
-    response = client.chat.completions.create(
-        model=ollama_model,
-        messages=messages,
-        max_tokens=2000,
-    )
+    if cached is not None:
+        response_text = cached["response"]
+        print(PINK + describe_hit(cached) + RESET_COLOR)
+        if stream:
+            print(NEON_GREEN + "Response: \n" + RESET_COLOR + response_text)
+    else:
+        generation_start = time.perf_counter()
+        if stream:
+            # Print tokens as they arrive instead of waiting for the whole response
+            print(NEON_GREEN + "Response: \n" + RESET_COLOR)
+            response_text, stats = stream_chat_completion(client, ollama_model, messages, max_tokens=2000)
+            print_stream_stats(stats)
+            if packer is not None:
+                packer.observe(stats)
+        else:
+            with tracing.span("chat_completion", model=ollama_model, stream=False) as span:
+                response = client.chat.completions.create(
+                    model=ollama_model,
+                    messages=messages,
+                    max_tokens=2000,
+                )
+                tracing.record_usage(span, response.usage)
+            response_text = response.choices[0].message.content
+        if use_cache:
+            response_cache.put(cache_scope, relevant_context, user_input, embedding, response_text, time.perf_counter() - generation_start)
     
-    conversation_history.append({"role": "assistant", "content": response.choices[0].message.content})
+    conversation_history.append("assistant", response_text)
     
-    return response.choices[0].message.content
+    return response_text
 
 # Parse command-line arguments
 print(NEON_GREEN + "Parsing command-line arguments..." + RESET_COLOR)
 parser = argparse.ArgumentParser(description="Ollama Chat")
 parser.add_argument("--model", default="llama3", help="Ollama model to use (default: llama3)")
+parser.add_argument("--embeddings-file", default="vault_embeddings.bin", help="Binary embeddings store (default: vault_embeddings.bin)")
+parser.add_argument("--embed-batch-size", type=int, default=32, help="Chunks per embedding request (default: 32)")
+parser.add_argument("--embed-concurrency", type=int, default=4, help="Embedding requests in flight (default: 4)")
+parser.add_argument("--retrieval", choices=["dense", "hybrid", "lexical"], default="hybrid", help="dense (embeddings), hybrid (embeddings + BM25) or lexical (BM25 only, no query embedding) (default: hybrid)")
+parser.add_argument("--ann", action="store_true", help="Use the approximate nearest-neighbour index for retrieval")
+parser.add_argument("--ann-lists", type=int, default=0, help="Number of ANN index lists (default: sqrt of the vault size)")
+parser.add_argument("--ann-nprobe", type=int, default=8, help="ANN lists searched per query; higher is slower with better recall (default: 8)")
+parser.add_argument("--quantize", choices=["none", "int8", "binary"], default="none", help="Search int8 or binary codes of the embeddings and rescore the best candidates exactly (default: none)")
+parser.add_argument("--rescore-oversample", type=int, default=4, help="Candidates rescored per result with --quantize (default: 4)")
+parser.add_argument("--backend", choices=["numpy", "torch", "sharded"], default="numpy", help="Vector math backend for exact search; torch is only imported when selected, sharded searches in worker processes (default: numpy)")
+parser.add_argument("--search-workers", type=int, default=0, help="Worker processes with --backend sharded (default: one per core)")
+parser.add_argument("--query-cache-size", type=int, default=1024, help="Query embeddings kept in the cache (default: 1024)")
+parser.add_argument("--query-cache-ttl", type=float, default=3600, help="Seconds before a cached query embedding expires (default: 3600)")
+parser.add_argument("--pipeline", action="store_true", help="Run query rewriting in parallel with speculative retrieval on the raw query")
+parser.add_argument("--speculative-threshold", type=float, default=0.9, help="Query similarity above which speculative results are reused (default: 0.9)")
+parser.add_argument("--history-max-tokens", type=int, default=4096, help="Token budget for the conversation sent to the model (default: 4096)")
+parser.add_argument("--history-pinned-turns", type=int, default=0, help="Messages at the start of the conversation that are never dropped (default: 0)")
+parser.add_argument("--summarize-history", action="store_true", help="Summarize dropped turns instead of discarding them")
+parser.add_argument("--context-max-tokens", type=int, default=1024, help="Token budget for the retrieved context sent with each question, 0 for no limit (default: 1024)")
+parser.add_argument("--mmr-lambda", type=float, default=0.7, help="Relevance vs diversity when picking context chunks, 1.0 keeps the retrieval order (default: 0.7)")
+parser.add_argument("--redundancy-threshold", type=float, default=0.9, help="Similarity above which a context chunk with the same text as one already picked (or contained in it) is dropped as a duplicate (default: 0.9)")
+parser.add_argument("--no-context-packing", dest="context_packing", action="store_false", help="Send the retrieved chunks verbatim instead of packing them")
+parser.add_argument("--response-cache", action="store_true", help="Reuse answers to near-identical first queries asked against the same context")
+parser.add_argument("--response-cache-threshold", type=float, default=0.95, help="Query embedding similarity for a cached answer to be reused (default: 0.95)")
+parser.add_argument("--response-cache-size", type=int, default=1024, help="Answers kept in the response cache (default: 1024)")
+parser.add_argument("--response-cache-file", default="", help="Persist the response cache to this file between sessions")
+parser.add_argument("--watch-vault", action="store_true", help="Embed and index records appended to the vault while the chat is running")
+parser.add_argument("--watch-interval", type=float, default=2.0, help="Seconds between checks of the vault with --watch-vault (default: 2)")
+parser.add_argument("--no-stream", dest="stream", action="store_false", help="Wait for the full response instead of streaming tokens")
+parser.add_argument("--trace-file", default="", help="Append a per-stage trace of every turn to this JSONL file (summarize with python tracing.py FILE)")
+parser.add_argument("--metrics-port", type=int, default=0, help="Serve per-stage latency and token metrics on http://127.0.0.1:PORT/metrics")
+parser.add_argument("--query-cache-file", default="", help="Persist the query embedding cache to this file between sessions")
 args = parser.parse_args()
+if args.watch_vault and args.backend == "sharded":
+    parser.error("--watch-vault is not available with --backend sharded")
+tracing.configure(args.trace_file, args.metrics_port)
 
 # Configuration for the Ollama API client
 print(NEON_GREEN + "Initializing Ollama API client..." + RESET_COLOR)
@@ -122,33 +243,96 @@ client = OpenAI(
 
 # Load the vault content
 print(NEON_GREEN + "Loading vault content..." + RESET_COLOR)
+# Chunks are read lazily by row from the indexed record store instead of holding every line in memory
 vault_content = []
 if os.path.exists("vault.txt"):
-    with open("vault.txt", "r", encoding='utf-8') as vault_file:
-        vault_content = vault_file.readlines()
-
-# Generate embeddings for the vault content using Ollama
-print(NEON_GREEN + "Generating embeddings for the vault content..." + RESET_COLOR)
-vault_embeddings = []
-for content in vault_content:
-    response = ollama.embeddings(model='mxbai-embed-large', prompt=content)
-    vault_embeddings.append(response["embedding"])
-
-# Convert to tensor and print embeddings
-print("Converting embeddings to tensor...")
-vault_embeddings_tensor = torch.tensor(vault_embeddings) 
+    vault_content = VaultStore("vault.txt")
+
+# Batching embedder used to generate embeddings for new vault content
+embedder = BatchEmbedder('mxbai-embed-large', batch_size=args.embed_batch_size, concurrency=args.embed_concurrency)
+
+# Load the embeddings from the binary store, only generating them if the vault has changed
+print(NEON_GREEN + "Loading embeddings for the vault content..." + RESET_COLOR)
+vault_embeddings = load_or_build_embeddings(vault_content, args.embeddings_file, embedder.model, embedder.embed)
+
+# Print the embeddings (a zero-copy view over the memory-mapped store)
 print("Embeddings for each line in the vault:")
-print(vault_embeddings_tensor)
+print(vault_embeddings)
+
+# Load or build the optional ANN index next to the embeddings store
+ann_index = None
+if args.ann and len(vault_embeddings):
+    ann_index = load_or_build_index(args.embeddings_file, vault_embeddings, n_lists=args.ann_lists or None, nprobe=args.ann_nprobe)
+
+# Load or build the optional int8/binary codes next to the embeddings store
+quantized_index = None
+if args.quantize != "none" and len(vault_embeddings):
+    quantized_index = load_or_build_quantized(args.embeddings_file, vault_embeddings, args.quantize, args.rescore_oversample)
+
+# Lexical (BM25) index over the vault lines, updated incrementally as lines are appended
+lexical_index = None
+if args.retrieval != "dense":
+    lexical_index = load_or_build_bm25(vault_content, "vault.txt.bm25.npz")
+
+# Cache of query embeddings so repeated questions skip the embedding round trip
+query_cache = QueryEmbeddingCache(args.query_cache_size, ttl=args.query_cache_ttl, path=args.query_cache_file or None)
+
+# Retriever with the vault norms precomputed once, used for every query
+retriever = VaultRetriever(vault_embeddings, embedder.model, ann_index, query_cache, lexical_index, args.retrieval, quantized_index,
+                           get_backend(args.backend, args.search_workers))
+
+# Context packer: removes redundant chunks, merges neighbouring chunks and keeps the context within its token budget
+packer = ContextPacker(args.context_max_tokens, args.mmr_lambda, args.redundancy_threshold, vault_embeddings) if args.context_packing else None
+
+# Cache of answers, tied to the current vault and embeddings so it is dropped when either changes
+response_cache = None
+if args.response_cache:
+    response_cache = ResponseCache(store_version(args.embeddings_file), args.response_cache_size,
+                                   threshold=args.response_cache_threshold, path=args.response_cache_file or None)
 
 # Conversation loop
 print("Starting conversation loop...")
-conversation_history = []
+summarizer = make_llm_summarizer(client, args.model) if args.summarize_history else None
+conversation_history = ConversationHistory(args.history_max_tokens, args.history_pinned_turns, summarizer=summarizer)
 system_message = "You are a helpful assistant that is an expert at extracting the most useful information from a given text. Also bring in extra relevant infromation to the user query from outside the given context."
 
+# Background watcher: records appended to the vault (upload.py, collect_emails.py) are embedded and indexed
+# without a restart, and each turn uses the latest epoch of the vault
+watcher = None
+watcher_status = None
+if args.watch_vault:
+    watcher = VaultWatcher("vault.txt", args.embeddings_file, retriever, vault_content,
+                           lambda texts: embedder.embed(texts, show_progress=False), args.watch_interval)
+    watcher_status = watcher.status()
+    watcher.start()
+
 while True:
     user_input = input(YELLOW + "Ask a query about your documents (or type 'quit' to exit): " + RESET_COLOR)
     if user_input.lower() == 'quit':
         break
     
-    response = ollama_chat(user_input, system_message, vault_embeddings_tensor, vault_content, args.model, conversation_history)
-    print(NEON_GREEN + "Response: \n\n" + response + RESET_COLOR)
+    if watcher is not None and watcher.status() != watcher_status:
+        watcher_status = watcher.status()
+        snapshot = watcher.current
+        retriever, vault_content = snapshot.retriever, snapshot.vault_content
+        print(PINK + watcher.report() + RESET_COLOR)
+        if packer is not None:
+            packer.embeddings = retriever.embeddings
+        if response_cache is not None:
+            response_cache.set_version(snapshot.version)
+
+    response = ollama_chat(user_input, system_message, retriever, vault_content, args.model, conversation_history, args.stream, args.pipeline, args.speculative_threshold, packer, response_cache)
+    if not args.stream:
+        print(NEON_GREEN + "Response: \n\n" + response + RESET_COLOR)
+
+# Save the embeddings of the chunks added while running, then the caches for the next session
+if watcher is not None:
+    watcher.stop()
+    print(f"Vault watcher: {watcher.stats()}")
+    if response_cache is not None:
+        response_cache.set_version(watcher.current.version)
+query_cache.save()
+print(f"Query embedding cache: {query_cache.stats()}")
+if response_cache is not None:
+    response_cache.save()
+    print(f"Response cache: {response_cache.stats()}")
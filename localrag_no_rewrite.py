@@ -1,8 +1,22 @@
-import torch
-import ollama
 import os
+import time
 from openai import OpenAI
 import argparse
+from embedding_store import load_or_build_embeddings
+from embedder import BatchEmbedder
+from ann_index import load_or_build_index
+from quantization import load_or_build_quantized
+from vector_backend import get_backend
+from retrieval import VaultRetriever
+from query_cache import QueryEmbeddingCache
+from bm25_index import load_or_build_bm25
+from streaming import stream_chat_completion, print_stream_stats
+from history import ConversationHistory, make_llm_summarizer
+from vault_store import VaultStore
+from context_packing import ContextPacker
+from response_cache import ResponseCache, store_version, question_embedding, describe_hit
+from vault_watcher import VaultWatcher
+import tracing
 
 # ANSI escape codes for colors
 PINK = '\033[95m'
@@ -16,63 +30,123 @@ def open_file(filepath):
     with open(filepath, 'r', encoding='utf-8') as infile:
         return infile.read()
 
-# Function to get relevant context from the vault based on user input
-def get_relevant_context(rewritten_input, vault_embeddings, vault_content, top_k=3):
-    if vault_embeddings.nelement() == 0:  # Check if the tensor has any elements
+# Function to get relevant context from the vault based on one or more queries
+def get_relevant_context(queries, retriever, vault_content, top_k=3, packer=None):
+    if len(retriever) == 0:  # Check if the vault has any embeddings
         return []
-    # Encode the rewritten input
-    input_embedding = ollama.embeddings(model='mxbai-embed-large', prompt=rewritten_input)["embedding"]
-    # Compute cosine similarity between the input and vault embeddings
-    cos_scores = torch.cosine_similarity(torch.tensor(input_embedding).unsqueeze(0), vault_embeddings)
-    # Adjust top_k if it's greater than the number of available scores
-    top_k = min(top_k, len(cos_scores))
-    # Sort the scores and get the top-k indices
-    top_indices = torch.topk(cos_scores, k=top_k)[1].tolist()
+    if isinstance(queries, str):
+        queries = [queries]
+    # Encode all queries in one request and score them against the vault in a single matrix multiply
+    top_indices = retriever.retrieve(queries, top_k)
+    if packer is not None:
+        # Drop redundant chunks, merge neighbouring ones and keep the context within the token budget
+        return packer.pack(top_indices, vault_content)
     # Get the corresponding context from the vault
     relevant_context = [vault_content[idx].strip() for idx in top_indices]
     return relevant_context
 
 # Function to interact with the Ollama model
-def ollama_chat(user_input, system_message, vault_embeddings, vault_content, ollama_model, conversation_history):
+@tracing.traced("chat_turn")
+def ollama_chat(user_input, system_message, retriever, vault_content, ollama_model, conversation_history, stream=True, packer=None, response_cache=None):
     # Get relevant context from the vault
-    relevant_context = get_relevant_context(user_input, vault_embeddings_tensor, vault_content, top_k=3)
+    relevant_context = get_relevant_context(user_input, retriever, vault_content, top_k=3, packer=packer)
     if relevant_context:
         # Convert list to a single string with newlines between items
         context_str = "\n".join(relevant_context)
         print("Context Pulled from Documents: \n\n" + CYAN + context_str + RESET_COLOR)
     else:
         print(CYAN + "No relevant context found." + RESET_COLOR)
+    if packer is not None:
+        print(PINK + packer.report() + RESET_COLOR)
+    
+    # The first question of a conversation does not depend on earlier turns, so its answer can come from the cache
+    cache_scope = ollama_model + "\n" + system_message
+    use_cache = response_cache is not None and len(conversation_history) == 0
+    cached, embedding = None, None
+    if use_cache:
+        embedding = question_embedding(retriever, user_input)
+        cached = response_cache.get(cache_scope, relevant_context, user_input, embedding)
     
     # Prepare the user's input by concatenating it with the relevant context
     user_input_with_context = user_input
     if relevant_context:
         user_input_with_context = context_str + "\n\n" + user_input
     
-    # Append the user's input to the conversation history
-    conversation_history.append({"role": "user", "content": user_input_with_context})
+    # Append the user's input to the conversation history (older turns are resent without their context)
+    conversation_history.append("user", user_input_with_context, raw=user_input)
     
-    # Create a message history including the system message and the conversation history
-    messages = [
-        {"role": "system", "content": system_message},
-        *conversation_history
-    ]
+    # Create a message history including the system message and the conversation history within the token budget
+    messages = conversation_history.messages(system_message)
+    print(PINK + conversation_history.report() + RESET_COLOR)
     
-    # Send the completion request to the Ollama model
-    response = client.chat.completions.create(
-        model=ollama_model,
-        messages=messages
-    )
+    if cached is not None:
+        response_text = cached["response"]
+        print(PINK + describe_hit(cached) + RESET_COLOR)
+        if stream:
+            print(NEON_GREEN + "Response: \n" + RESET_COLOR + response_text)
+    else:
+        generation_start = time.perf_counter()
+        # Send the completion request to the Ollama model, streaming tokens as they arrive
+        if stream:
+            print(NEON_GREEN + "Response: \n" + RESET_COLOR)
+            response_text, stats = stream_chat_completion(client, ollama_model, messages)
+            print_stream_stats(stats)
+            if packer is not None:
+                packer.observe(stats)
+        else:
+            with tracing.span("chat_completion", model=ollama_model, stream=False) as span:
+                response = client.chat.completions.create(
+                    model=ollama_model,
+                    messages=messages
+                )
+                tracing.record_usage(span, response.usage)
+            response_text = response.choices[0].message.content
+        if use_cache:
+            response_cache.put(cache_scope, relevant_context, user_input, embedding, response_text, time.perf_counter() - generation_start)
     
     # Append the model's response to the conversation history
-    conversation_history.append({"role": "assistant", "content": response.choices[0].message.content})
+    conversation_history.append("assistant", response_text)
     
     # Return the content of the response from the model
-    return response.choices[0].message.content
+    return response_text
 
 # Parse command-line arguments
 parser = argparse.ArgumentParser(description="Ollama Chat")
 parser.add_argument("--model", default="dolphin-llama3", help="Ollama model to use (default: llama3)")
+parser.add_argument("--embeddings-file", default="vault_embeddings.bin", help="Binary embeddings store (default: vault_embeddings.bin)")
+parser.add_argument("--embed-batch-size", type=int, default=32, help="Chunks per embedding request (default: 32)")
+parser.add_argument("--embed-concurrency", type=int, default=4, help="Embedding requests in flight (default: 4)")
+parser.add_argument("--retrieval", choices=["dense", "hybrid", "lexical"], default="hybrid", help="dense (embeddings), hybrid (embeddings + BM25) or lexical (BM25 only, no query embedding) (default: hybrid)")
+parser.add_argument("--ann", action="store_true", help="Use the approximate nearest-neighbour index for retrieval")
+parser.add_argument("--ann-lists", type=int, default=0, help="Number of ANN index lists (default: sqrt of the vault size)")
+parser.add_argument("--ann-nprobe", type=int, default=8, help="ANN lists searched per query; higher is slower with better recall (default: 8)")
+parser.add_argument("--quantize", choices=["none", "int8", "binary"], default="none", help="Search int8 or binary codes of the embeddings and rescore the best candidates exactly (default: none)")
+parser.add_argument("--rescore-oversample", type=int, default=4, help="Candidates rescored per result with --quantize (default: 4)")
+parser.add_argument("--backend", choices=["numpy", "torch", "sharded"], default="numpy", help="Vector math backend for exact search; torch is only imported when selected, sharded searches in worker processes (default: numpy)")
+parser.add_argument("--search-workers", type=int, default=0, help="Worker processes with --backend sharded (default: one per core)")
+parser.add_argument("--query-cache-size", type=int, default=1024, help="Query embeddings kept in the cache (default: 1024)")
+parser.add_argument("--query-cache-ttl", type=float, default=3600, help="Seconds before a cached query embedding expires (default: 3600)")
+parser.add_argument("--history-max-tokens", type=int, default=4096, help="Token budget for the conversation sent to the model (default: 4096)")
+parser.add_argument("--history-pinned-turns", type=int, default=0, help="Messages at the start of the conversation that are never dropped (default: 0)")
+parser.add_argument("--summarize-history", action="store_true", help="Summarize dropped turns instead of discarding them")
+parser.add_argument("--context-max-tokens", type=int, default=1024, help="Token budget for the retrieved context sent with each question, 0 for no limit (default: 1024)")
+parser.add_argument("--mmr-lambda", type=float, default=0.7, help="Relevance vs diversity when picking context chunks, 1.0 keeps the retrieval order (default: 0.7)")
+parser.add_argument("--redundancy-threshold", type=float, default=0.9, help="Similarity above which a context chunk with the same text as one already picked (or contained in it) is dropped as a duplicate (default: 0.9)")
+parser.add_argument("--no-context-packing", dest="context_packing", action="store_false", help="Send the retrieved chunks verbatim instead of packing them")
+parser.add_argument("--response-cache", action="store_true", help="Reuse answers to near-identical first questions asked against the same context")
+parser.add_argument("--response-cache-threshold", type=float, default=0.95, help="Question embedding similarity for a cached answer to be reused (default: 0.95)")
+parser.add_argument("--response-cache-size", type=int, default=1024, help="Answers kept in the response cache (default: 1024)")
+parser.add_argument("--response-cache-file", default="", help="Persist the response cache to this file between sessions")
+parser.add_argument("--watch-vault", action="store_true", help="Embed and index records appended to the vault while the chat is running")
+parser.add_argument("--watch-interval", type=float, default=2.0, help="Seconds between checks of the vault with --watch-vault (default: 2)")
+parser.add_argument("--no-stream", dest="stream", action="store_false", help="Wait for the full response instead of streaming tokens")
+parser.add_argument("--trace-file", default="", help="Append a per-stage trace of every turn to this JSONL file (summarize with python tracing.py FILE)")
+parser.add_argument("--metrics-port", type=int, default=0, help="Serve per-stage latency and token metrics on http://127.0.0.1:PORT/metrics")
+parser.add_argument("--query-cache-file", default="", help="Persist the query embedding cache to this file between sessions")
 args = parser.parse_args()
+if args.watch_vault and args.backend == "sharded":
+    parser.error("--watch-vault is not available with --backend sharded")
+tracing.configure(args.trace_file, args.metrics_port)
 
 # Configuration for the Ollama API client
 client = OpenAI(
@@ -81,30 +155,94 @@ client = OpenAI(
 )
 
 # Load the vault content
+# Chunks are read lazily by row from the indexed record store instead of holding every line in memory
 vault_content = []
 if os.path.exists("vault.txt"):
-    with open("vault.txt", "r", encoding='utf-8') as vault_file:
-        vault_content = vault_file.readlines()
+    vault_content = VaultStore("vault.txt")
 
-# Generate embeddings for the vault content using Ollama
-vault_embeddings = []
-for content in vault_content:
-    response = ollama.embeddings(model='mxbai-embed-large', prompt=content)
-    vault_embeddings.append(response["embedding"])
+# Batching embedder used to generate embeddings for new vault content
+embedder = BatchEmbedder('mxbai-embed-large', batch_size=args.embed_batch_size, concurrency=args.embed_concurrency)
 
-# Convert to tensor and print embeddings
-vault_embeddings_tensor = torch.tensor(vault_embeddings) 
+# Load the embeddings from the binary store, only generating them if the vault has changed
+vault_embeddings = load_or_build_embeddings(vault_content, args.embeddings_file, embedder.model, embedder.embed)
+
+# Print the embeddings (a zero-copy view over the memory-mapped store)
 print("Embeddings for each line in the vault:")
-print(vault_embeddings_tensor)
+print(vault_embeddings)
+
+# Load or build the optional ANN index next to the embeddings store
+ann_index = None
+if args.ann and len(vault_embeddings):
+    ann_index = load_or_build_index(args.embeddings_file, vault_embeddings, n_lists=args.ann_lists or None, nprobe=args.ann_nprobe)
+
+# Load or build the optional int8/binary codes next to the embeddings store
+quantized_index = None
+if args.quantize != "none" and len(vault_embeddings):
+    quantized_index = load_or_build_quantized(args.embeddings_file, vault_embeddings, args.quantize, args.rescore_oversample)
+
+# Lexical (BM25) index over the vault lines, updated incrementally as lines are appended
+lexical_index = None
+if args.retrieval != "dense":
+    lexical_index = load_or_build_bm25(vault_content, "vault.txt.bm25.npz")
+
+# Cache of query embeddings so repeated questions skip the embedding round trip
+query_cache = QueryEmbeddingCache(args.query_cache_size, ttl=args.query_cache_ttl, path=args.query_cache_file or None)
+
+# Retriever with the vault norms precomputed once, used for every query
+retriever = VaultRetriever(vault_embeddings, embedder.model, ann_index, query_cache, lexical_index, args.retrieval, quantized_index,
+                           get_backend(args.backend, args.search_workers))
+
+# Context packer: removes redundant chunks, merges neighbouring chunks and keeps the context within its token budget
+packer = ContextPacker(args.context_max_tokens, args.mmr_lambda, args.redundancy_threshold, vault_embeddings) if args.context_packing else None
+
+# Cache of answers, tied to the current vault and embeddings so it is dropped when either changes
+response_cache = None
+if args.response_cache:
+    response_cache = ResponseCache(store_version(args.embeddings_file), args.response_cache_size,
+                                   threshold=args.response_cache_threshold, path=args.response_cache_file or None)
 
 # Conversation loop
-conversation_history = []
+summarizer = make_llm_summarizer(client, args.model) if args.summarize_history else None
+conversation_history = ConversationHistory(args.history_max_tokens, args.history_pinned_turns, summarizer=summarizer)
 system_message = "You are a helpful assistant that is an expert at extracting the most useful information from a given text"
 
+# Background watcher: records appended to the vault (upload.py, collect_emails.py) are embedded and indexed
+# without a restart, and each turn uses the latest epoch of the vault
+watcher = None
+watcher_status = None
+if args.watch_vault:
+    watcher = VaultWatcher("vault.txt", args.embeddings_file, retriever, vault_content,
+                           lambda texts: embedder.embed(texts, show_progress=False), args.watch_interval)
+    watcher_status = watcher.status()
+    watcher.start()
+
 while True:
     user_input = input(YELLOW + "Ask a question about your documents (or type 'quit' to exit): " + RESET_COLOR)
     if user_input.lower() == 'quit':
         break
 
-    response = ollama_chat(user_input, system_message, vault_embeddings_tensor, vault_content, args.model, conversation_history)
-    print(NEON_GREEN + "Response: \n\n" + response + RESET_COLOR)
+    if watcher is not None and watcher.status() != watcher_status:
+        watcher_status = watcher.status()
+        snapshot = watcher.current
+        retriever, vault_content = snapshot.retriever, snapshot.vault_content
+        print(PINK + watcher.report() + RESET_COLOR)
+        if packer is not None:
+            packer.embeddings = retriever.embeddings
+        if response_cache is not None:
+            response_cache.set_version(snapshot.version)
+
+    response = ollama_chat(user_input, system_message, retriever, vault_content, args.model, conversation_history, args.stream, packer, response_cache)
+    if not args.stream:
+        print(NEON_GREEN + "Response: \n\n" + response + RESET_COLOR)
+
+# Save the embeddings of the chunks added while running, then the caches for the next session
+if watcher is not None:
+    watcher.stop()
+    print(f"Vault watcher: {watcher.stats()}")
+    if response_cache is not None:
+        response_cache.set_version(watcher.current.version)
+query_cache.save()
+print(f"Query embedding cache: {query_cache.stats()}")
+if response_cache is not None:
+    response_cache.save()
+    print(f"Response cache: {response_cache.stats()}")
@@ -0,0 +1,187 @@
+import os
+import time
+import argparse
+import numpy as np
+from embedding_store import load_embedding_store, read_store_header
+
+QUANTIZATIONS = ("int8", "binary")
+DEFAULT_OVERSAMPLE = 4
+QUANTIZE_BLOCK_ROWS = 65536
+# Rows of int8 codes converted to float32 at a time while scoring, small enough to stay in cache
+SCORE_BLOCK_ROWS = 4096
+# Bits set in every byte value, used when np.bitwise_count is not available (NumPy < 2.0)
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def _popcount(bits):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits).sum(axis=-1, dtype=np.int32)
+    return POPCOUNT_TABLE[bits].sum(axis=-1, dtype=np.int32)
+
+# Compact codes for the vault embeddings. The first pass scores every row on the codes only:
+#   int8    each dimension of the normalized rows is scaled to -127..127 (1 byte per dimension)
+#   binary  one bit per dimension, the sign of the row minus the vault mean, scored by Hamming distance
+# The best top_k * oversample rows are then rescored exactly against the full-precision embeddings
+# (the memory-mapped store on disk), so only those candidate rows are ever read from the float matrix.
+class QuantizedIndex:
+    def __init__(self, kind, codes, row_norms, scale=None, mean=None, vault_checksum="", oversample=DEFAULT_OVERSAMPLE):
+        if kind not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{kind}', expected one of {QUANTIZATIONS}")
+        self.kind = kind
+        self.codes = codes
+        self.row_norms = row_norms
+        self.scale = scale
+        self.mean = mean
+        self.vault_checksum = vault_checksum
+        self.oversample = oversample
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.row_norms.nbytes
+
+    @classmethod
+    def build(cls, embeddings, kind="int8", vault_checksum="", oversample=DEFAULT_OVERSAMPLE):
+        if kind not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{kind}', expected one of {QUANTIZATIONS}")
+        rows, dim = embeddings.shape
+        blocks = range(0, rows, QUANTIZE_BLOCK_ROWS)
+        # First pass: row norms plus the per-dimension range (int8) or mean (binary) of the normalized rows
+        row_norms = np.empty(rows, dtype=np.float32)
+        max_abs = np.zeros(dim, dtype=np.float32)
+        total = np.zeros(dim, dtype=np.float64)
+        for start in blocks:
+            block = np.asarray(embeddings[start:start + QUANTIZE_BLOCK_ROWS], dtype=np.float32)
+            row_norms[start:start + len(block)] = np.linalg.norm(block, axis=1)
+            block = _normalize(block)
+            np.maximum(max_abs, np.abs(block).max(axis=0), out=max_abs)
+            total += block.sum(axis=0)
+        row_norms[row_norms == 0] = 1.0
+
+        scale, mean = None, None
+        if kind == "int8":
+            scale = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+            codes = np.empty((rows, dim), dtype=np.int8)
+        else:
+            mean = (total / max(rows, 1)).astype(np.float32)
+            codes = np.empty((rows, (dim + 7) // 8), dtype=np.uint8)
+        index = cls(kind, codes, row_norms, scale, mean, vault_checksum, oversample)
+        for start in blocks:
+            codes[start:start + QUANTIZE_BLOCK_ROWS] = index.encode(embeddings[start:start + QUANTIZE_BLOCK_ROWS])
+        return index
+
+    # Function to compute the codes of embedding rows with this index's scale (int8) or mean (binary)
+    def encode(self, embeddings):
+        block = _normalize(embeddings)
+        if self.kind == "int8":
+            return np.clip(np.rint(block / self.scale), -127, 127).astype(np.int8)
+        return np.packbits(block > self.mean, axis=1)
+
+    # Function to return a new index with rows appended, leaving this one unchanged for searches in progress.
+    # New rows are coded with the existing scale or mean (int8 values outside the range are clipped); the
+    # codes are rebuilt when the store has changed on the next start.
+    def with_rows(self, new_embeddings, vault_checksum=""):
+        row_norms = np.linalg.norm(np.asarray(new_embeddings, dtype=np.float32), axis=1)
+        row_norms[row_norms == 0] = 1.0
+        return QuantizedIndex(self.kind, np.concatenate([self.codes, self.encode(new_embeddings)]),
+                              np.concatenate([self.row_norms, row_norms]), self.scale, self.mean,
+                              vault_checksum, self.oversample)
+
+    # Function to score all rows against a batch of normalized queries using the codes only (higher is better)
+    def approximate_scores(self, queries):
+        scores = np.empty((len(queries), len(self)), dtype=np.float32)
+        if self.kind == "int8":
+            scaled = queries * self.scale
+            for start in range(0, len(self), SCORE_BLOCK_ROWS):
+                block = self.codes[start:start + SCORE_BLOCK_ROWS]
+                scores[:, start:start + len(block)] = scaled @ block.astype(np.float32).T
+        else:
+            query_bits = np.packbits(queries > self.mean, axis=1)
+            for i, bits in enumerate(query_bits):
+                scores[i] = -_popcount(np.bitwise_xor(self.codes, bits))
+        return scores
+
+    # Function to return the top_k (row indices, cosine scores) per query embedding: candidates from the
+    # codes, rescored exactly against the full-precision embeddings
+    def search(self, query_embeddings, embeddings, top_k, oversample=None):
+        queries = _normalize(np.atleast_2d(query_embeddings))
+        top_k = min(top_k, len(self))
+        depth = min(top_k * (oversample or self.oversample), len(self))
+        approximate = self.approximate_scores(queries)
+        results = []
+        for query, scores in zip(queries, approximate):
+            candidates = np.argpartition(-scores, depth - 1)[:depth] if depth < len(scores) else np.arange(len(scores))
+            # Sorted row ids keep reads from the memory-mapped matrix sequential
+            candidates.sort()
+            exact = (np.asarray(embeddings[candidates], dtype=np.float32) @ query) / self.row_norms[candidates]
+            best = np.argpartition(-exact, top_k - 1)[:top_k]
+            best = best[np.argsort(-exact[best])]
+            results.append((candidates[best], exact[best]))
+        return results
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        arrays = {"codes": self.codes, "row_norms": self.row_norms, "kind": np.array(self.kind),
+                  "vault_checksum": np.array(self.vault_checksum)}
+        if self.scale is not None:
+            arrays["scale"] = self.scale
+        if self.mean is not None:
+            arrays["mean"] = self.mean
+        with open(tmp_path, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, oversample=DEFAULT_OVERSAMPLE):
+        with np.load(path) as data:
+            return cls(str(data["kind"]), data["codes"], data["row_norms"],
+                       data["scale"] if "scale" in data else None, data["mean"] if "mean" in data else None,
+                       str(data["vault_checksum"]), oversample)
+
+# Function to get the quantized codes file that lives next to an embedding store
+def quantized_path_for(store_path, kind):
+    return f"{store_path}.{kind}.npz"
+
+# Function to load the quantized codes for an embedding store, rebuilding them if the store has changed
+def load_or_build_quantized(store_path, embeddings, kind="int8", oversample=DEFAULT_OVERSAMPLE):
+    checksum = read_store_header(store_path)["vault_checksum"]
+    path = quantized_path_for(store_path, kind)
+    if os.path.exists(path):
+        try:
+            index = QuantizedIndex.load(path, oversample)
+            if index.vault_checksum == checksum and len(index) == len(embeddings) and index.kind == kind:
+                print(f"Loaded {kind} codes for {len(index)} embeddings from '{path}'.")
+                return index
+            print(f"Quantized codes '{path}' are out of date. Rebuilding...")
+        except (ValueError, OSError, KeyError) as e:
+            print(f"Could not read quantized codes '{path}': {str(e)}")
+    start = time.perf_counter()
+    index = QuantizedIndex.build(embeddings, kind, vault_checksum=checksum, oversample=oversample)
+    index.save(path)
+    print(f"Built {kind} codes ({index.nbytes / (1024 * 1024):.1f} MB) in {time.perf_counter() - start:.1f}s.")
+    return index
+
+def main():
+    parser = argparse.ArgumentParser(description="Build int8 or binary codes for the vault embeddings")
+    parser.add_argument("--embeddings-file", default="vault_embeddings.bin", help="Binary embeddings store")
+    parser.add_argument("--quantize", choices=QUANTIZATIONS, default="int8", help="Kind of codes to build (default: int8)")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the codes even if they are up to date")
+    args = parser.parse_args()
+
+    _, embeddings = load_embedding_store(args.embeddings_file)
+    path = quantized_path_for(args.embeddings_file, args.quantize)
+    if args.rebuild and os.path.exists(path):
+        os.remove(path)
+    index = load_or_build_quantized(args.embeddings_file, embeddings, args.quantize)
+    print(f"Float32 matrix: {embeddings.shape[0] * embeddings.shape[1] * 4 / (1024 * 1024):.1f} MB, "
+          f"{args.quantize} codes: {index.nbytes / (1024 * 1024):.1f} MB")
+
+if __name__ == "__main__":
+    main()
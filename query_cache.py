@@ -0,0 +1,103 @@
+import os
+import re
+import json
+import time
+import threading
+from array import array
+from collections import OrderedDict
+
+ENTRY_OVERHEAD_BYTES = 200
+
+# Function to normalize a query so trivially different phrasings share a cache entry
+def normalize_query(text):
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+# Bounded LRU cache of query embeddings keyed by (embedding model, normalized query text).
+# Entries are evicted when the cache exceeds max_entries or max_bytes, and expire after ttl seconds.
+# The cache can be persisted to a JSON file between sessions.
+class QueryEmbeddingCache:
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=3600, path=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path = path
+        self.entries = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def _entry_bytes(embedding):
+        return embedding.itemsize * len(embedding) + ENTRY_OVERHEAD_BYTES
+
+    def _expired(self, created):
+        return self.ttl is not None and self.ttl > 0 and time.time() - created > self.ttl
+
+    def _remove(self, key):
+        created, embedding = self.entries.pop(key)
+        self.size_bytes -= self._entry_bytes(embedding)
+
+    def get(self, text, model):
+        key = (model, normalize_query(text))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or self._expired(entry[0]):
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+
+    def put(self, text, model, embedding, created=None):
+        key = (model, normalize_query(text))
+        embedding = array("f", embedding)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (created or time.time(), embedding)
+            self.size_bytes += self._entry_bytes(embedding)
+            while self.entries and (len(self.entries) > self.max_entries or self.size_bytes > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        with self.lock:
+            data = [[model, text, created, embedding.tolist()]
+                    for (model, text), (created, embedding) in self.entries.items()
+                    if not self._expired(created)]
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(tmp_path, path)
+
+    def load(self, path=None):
+        path = path or self.path
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Could not load query cache '{path}': {str(e)}")
+            return
+        for model, text, created, embedding in data:
+            if not self._expired(created):
+                self.put(text, model, embedding, created)
@@ -0,0 +1,447 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import httpx
+import ollama
+from embedding_store import load_or_build_embeddings
+from embedder import BatchEmbedder
+from ann_index import load_or_build_index
+from quantization import load_or_build_quantized
+from vector_backend import get_backend
+from retrieval import VaultRetriever, RETRIEVAL_MODES
+from query_cache import QueryEmbeddingCache
+from bm25_index import load_or_build_bm25
+from history import ConversationHistory
+from vault_store import VaultStore
+from response_cache import ResponseCache, store_version
+from vault_watcher import VaultWatcher
+
+# Long-running server mode: the vault, embeddings and indexes are loaded once and shared by every session.
+#   POST /query   {"query": "...", "top_k": 3}                        -> relevant vault chunks
+#   POST /chat    {"session": "...", "message": "...", "top_k": 3}    -> model answer with retrieved context
+#   DELETE /sessions/<id>                                             -> forget a conversation
+#   GET /stats                                                        -> sessions, request and batching counters
+# Each session keeps its own ConversationHistory. All sessions share one pool of keep-alive connections
+# to Ollama, and query embeddings requested within a few milliseconds of each other are sent as one
+# /api/embed request (EmbeddingBatcher).
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+MAX_TOP_K = 100
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                413: "Payload Too Large", 500: "Internal Server Error", 502: "Bad Gateway"}
+DEFAULT_SYSTEM_MESSAGE = "You are a helpful assistant that is an expert at extracting the most useful information from a given text"
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+# Function to read the Content-Length header; anything but a non-negative integer is a client error
+def parse_content_length(value):
+    if not value:
+        return 0
+    if not (value.isascii() and value.isdigit()):
+        raise HTTPError(400, "Invalid Content-Length header")
+    return int(value)
+
+# Function to read top_k from a request body: a positive integer up to MAX_TOP_K, else a 400 error
+def parse_top_k(body, default):
+    top_k = body.get("top_k", default)
+    if isinstance(top_k, bool) or not isinstance(top_k, int) or not 1 <= top_k <= MAX_TOP_K:
+        raise HTTPError(400, f"'top_k' must be an integer from 1 to {MAX_TOP_K}")
+    return top_k
+
+# Collects query embeddings requested by concurrent sessions and sends them to Ollama in one request.
+# The first text starts a window of window_ms; everything that arrives before it closes (or until
+# max_batch texts are waiting) goes into the same /api/embed call. Cached queries skip the batch.
+class EmbeddingBatcher:
+    def __init__(self, client, model, window_ms=5, max_batch=64, query_cache=None):
+        self.client = client
+        self.model = model
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.query_cache = query_cache
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+        self.stats = {"texts": 0, "cached": 0, "requests": 0, "batched_texts": 0, "max_batch": 0}
+
+    # Function to embed several texts, returning one embedding per text
+    async def embed(self, texts):
+        loop = asyncio.get_running_loop()
+        embeddings = []
+        for text in texts:
+            self.stats["texts"] += 1
+            cached = self.query_cache.get(text, self.model) if self.query_cache is not None else None
+            if cached is not None:
+                self.stats["cached"] += 1
+                future = loop.create_future()
+                future.set_result(cached)
+            else:
+                future = loop.create_future()
+                self.pending.append((text, future))
+            embeddings.append(future)
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.pending and self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+        return list(await asyncio.gather(*embeddings))
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        while self.pending:
+            batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+            task = asyncio.get_running_loop().create_task(self._send(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _send(self, batch):
+        # Identical texts in the same window are embedded once
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self.stats["requests"] += 1
+        self.stats["batched_texts"] += len(texts)
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(texts))
+        try:
+            response = await self.client.embed(model=self.model, input=texts)
+            by_text = dict(zip(texts, response["embeddings"]))
+            if len(by_text) != len(texts):
+                raise ValueError(f"Ollama returned {len(response['embeddings'])} embeddings for {len(texts)} texts")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for text, future in batch:
+            if self.query_cache is not None:
+                self.query_cache.put(text, self.model, by_text[text])
+            if not future.done():
+                future.set_result(by_text[text])
+
+# Per-session conversation state, dropped after ttl seconds without a request
+class SessionStore:
+    def __init__(self, max_tokens=4096, pinned_turns=0, ttl=3600):
+        self.max_tokens = max_tokens
+        self.pinned_turns = pinned_turns
+        self.ttl = ttl
+        self.sessions = {}
+
+    # Function to return (session id, session), creating a new session for a missing or unknown id
+    def get(self, session_id=None):
+        self.expire()
+        session = self.sessions.get(session_id) if session_id else None
+        if session is None:
+            session_id = session_id or uuid.uuid4().hex
+            session = {"history": ConversationHistory(self.max_tokens, self.pinned_turns), "lock": asyncio.Lock()}
+            self.sessions[session_id] = session
+        session["last_used"] = time.monotonic()
+        return session_id, session
+
+    def remove(self, session_id):
+        return self.sessions.pop(session_id, None) is not None
+
+    def expire(self):
+        if not self.ttl:
+            return
+        now = time.monotonic()
+        for session_id in [s for s, session in self.sessions.items()
+                           if now - session["last_used"] > self.ttl and not session["lock"].locked()]:
+            del self.sessions[session_id]
+
+    def __len__(self):
+        return len(self.sessions)
+
+class RAGServer:
+    def __init__(self, retriever, vault_content, client, batcher, model, sessions,
+                 system_message=DEFAULT_SYSTEM_MESSAGE, top_k=3, max_tokens=2000, response_cache=None, watcher=None):
+        self.retriever = retriever
+        self.vault_content = vault_content
+        self.client = client
+        self.batcher = batcher
+        self.model = model
+        self.sessions = sessions
+        self.system_message = system_message
+        self.top_k = top_k
+        self.max_tokens = max_tokens
+        self.response_cache = response_cache
+        self.watcher = watcher
+        self.started = time.time()
+        self.stats = {"connections": 0, "requests": 0, "errors": 0, "query": 0, "chat": 0}
+
+    # Function to return the retriever and vault of the latest epoch (see vault_watcher.py); a request uses one epoch throughout
+    def snapshot(self):
+        if self.watcher is None:
+            return self.retriever, self.vault_content
+        current = self.watcher.current
+        return current.retriever, current.vault_content
+
+    # Function to get the relevant vault chunks for the queries; the vault search runs in a worker thread
+    async def get_relevant_context(self, queries, top_k):
+        retriever, vault_content = self.snapshot()
+        if len(retriever) == 0 and retriever.mode != "lexical":
+            return []
+        if retriever.mode == "lexical":
+            top_indices = await asyncio.to_thread(retriever.retrieve, queries, top_k)
+        else:
+            embeddings = await self.batcher.embed(queries)
+            depth = retriever.search_depth(top_k)
+
+            def search():
+                return retriever.fuse_lexical(queries, retriever.search_merged(embeddings, depth), top_k)
+            top_indices = await asyncio.to_thread(search)
+        return [vault_content[idx].strip() for idx in top_indices]
+
+    async def handle_query(self, body):
+        query = body.get("query")
+        if not isinstance(query, str) or not query.strip():
+            raise HTTPError(400, "'query' must be a non-empty string")
+        self.stats["query"] += 1
+        start = time.perf_counter()
+        context = await self.get_relevant_context([query], parse_top_k(body, self.top_k))
+        return {"context": context, "retrieval_s": time.perf_counter() - start}
+
+    async def handle_chat(self, body):
+        message = body.get("message")
+        if not isinstance(message, str) or not message.strip():
+            raise HTTPError(400, "'message' must be a non-empty string")
+        top_k = parse_top_k(body, self.top_k)
+        self.stats["chat"] += 1
+        session_id, session = self.sessions.get(body.get("session"))
+        # Turns of one session are answered in order; different sessions run concurrently
+        async with session["lock"]:
+            history = session["history"]
+            start = time.perf_counter()
+            context = await self.get_relevant_context([message], top_k)
+            retrieval_s = time.perf_counter() - start
+            # The user turn is only added once retrieval succeeded, and removed again if the turn fails
+            # later, so a failed request leaves the session as it was and the question can be retried
+            history.append("user", message + "\n\nRelevant Context:\n" + "\n".join(context) if context else message, raw=message)
+            try:
+                # The first turn of a session does not depend on earlier turns, so its answer can come from the cache
+                cached, embedding = None, None
+                use_cache = self.response_cache is not None and len(history) == 1
+                if use_cache:
+                    if self.retriever.mode != "lexical":
+                        embedding = (await self.batcher.embed([message]))[0]
+                    cached = self.response_cache.get(self.model + "\n" + self.system_message, context, message, embedding)
+                messages = history.messages(self.system_message)
+                if cached is not None:
+                    response_text = cached["response"]
+                else:
+                    generation_start = time.perf_counter()
+                    response = await self.client.chat(model=self.model, messages=messages,
+                                                      options={"num_predict": self.max_tokens})
+                    response_text = response["message"]["content"]
+                    if use_cache:
+                        self.response_cache.put(self.model + "\n" + self.system_message, context, message, embedding,
+                                                response_text, time.perf_counter() - generation_start)
+            except Exception:
+                history.turns.pop()
+                raise
+            history.append("assistant", response_text)
+        return {"session": session_id, "response": response_text, "context": context, "cached": cached is not None,
+                "retrieval_s": retrieval_s, "total_s": time.perf_counter() - start,
+                "prompt_tokens": history.last_prompt_tokens}
+
+    def handle_stats(self):
+        batcher = self.batcher.stats
+        return {
+            "uptime_s": time.time() - self.started,
+            "vault_rows": len(self.snapshot()[1]),
+            "sessions": len(self.sessions),
+            **self.stats,
+            "embedding": {**batcher, "avg_batch": batcher["batched_texts"] / batcher["requests"] if batcher["requests"] else 0.0},
+            "query_cache": self.batcher.query_cache.stats() if self.batcher.query_cache is not None else None,
+            "response_cache": self.response_cache.stats() if self.response_cache is not None else None,
+            "vault_watcher": self.watcher.stats() if self.watcher is not None else None,
+        }
+
+    async def dispatch(self, method, path, body):
+        if path == "/query":
+            if method != "POST":
+                raise HTTPError(405, "Use POST")
+            return await self.handle_query(body)
+        if path == "/chat":
+            if method != "POST":
+                raise HTTPError(405, "Use POST")
+            return await self.handle_chat(body)
+        if path == "/stats" and method == "GET":
+            return self.handle_stats()
+        if path.startswith("/sessions/") and method == "DELETE":
+            return {"removed": self.sessions.remove(path[len("/sessions/"):])}
+        raise HTTPError(404, f"No route for {method} {path}")
+
+    # Function to read one HTTP/1.1 request; returns None when the client closed the connection
+    async def read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(413, "Request headers too large")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        length = parse_content_length(headers.get("content-length", ""))
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+        return method.upper(), target.split("?", 1)[0], body, keep_alive
+
+    async def handle_connection(self, reader, writer):
+        self.stats["connections"] += 1
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await self.read_request(reader)
+                    if request is None:
+                        break
+                    method, path, raw_body, keep_alive = request
+                    self.stats["requests"] += 1
+                    try:
+                        body = json.loads(raw_body) if raw_body else {}
+                    except ValueError:
+                        raise HTTPError(400, "Request body is not valid JSON")
+                    if not isinstance(body, dict):
+                        raise HTTPError(400, "Request body must be a JSON object")
+                    status, payload = 200, await self.dispatch(method, path, body)
+                except HTTPError as e:
+                    self.stats["errors"] += 1
+                    status, payload = e.status, {"error": e.message}
+                except (ollama.ResponseError, httpx.HTTPError) as e:
+                    self.stats["errors"] += 1
+                    status, payload = 502, {"error": f"Ollama request failed: {str(e)}"}
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    break
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    status, payload = 500, {"error": str(e)}
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTP_REASONS.get(status, 'Error')}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+# Function to load the vault, embeddings and indexes once, shared by every session
+def load_retriever(args):
+    vault_content = []
+    if os.path.exists(args.vault):
+        print(f"Loading content from vault '{args.vault}'...")
+        vault_content = VaultStore(args.vault)
+    embedder = BatchEmbedder(args.embedding_model, batch_size=args.embed_batch_size, host=args.ollama_host or None)
+    vault_embeddings = load_or_build_embeddings(vault_content, args.embeddings_file, embedder.model, embedder.embed)
+    ann_index = None
+    if args.ann and len(vault_embeddings):
+        ann_index = load_or_build_index(args.embeddings_file, vault_embeddings, n_lists=args.ann_lists or None, nprobe=args.ann_nprobe)
+    quantized_index = None
+    if args.quantize != "none" and len(vault_embeddings):
+        quantized_index = load_or_build_quantized(args.embeddings_file, vault_embeddings, args.quantize, args.rescore_oversample)
+    lexical_index = None
+    if args.retrieval != "dense":
+        lexical_index = load_or_build_bm25(vault_content, args.vault + ".bm25.npz")
+    retriever = VaultRetriever(vault_embeddings, embedder.model, ann_index, None, lexical_index, args.retrieval, quantized_index,
+                               get_backend(args.backend, args.search_workers))
+    return retriever, vault_content
+
+async def serve(args, retriever, vault_content):
+    # One pool of keep-alive connections to Ollama shared by all sessions
+    limits = httpx.Limits(max_connections=args.ollama_connections, max_keepalive_connections=args.ollama_connections)
+    client = ollama.AsyncClient(host=args.ollama_host or None, limits=limits)
+    query_cache = QueryEmbeddingCache(args.query_cache_size, ttl=args.query_cache_ttl, path=args.query_cache_file or None)
+    batcher = EmbeddingBatcher(client, retriever.embedding_model, args.batch_window_ms, args.max_embed_batch, query_cache)
+    sessions = SessionStore(args.history_max_tokens, args.history_pinned_turns, args.session_ttl)
+    response_cache = None
+    if args.response_cache:
+        response_cache = ResponseCache(store_version(args.embeddings_file), args.response_cache_size,
+                                       threshold=args.response_cache_threshold, path=args.response_cache_file or None)
+    # Records appended to the vault while serving are embedded and indexed in the background
+    watcher = None
+    if args.watch_vault:
+        embedder = BatchEmbedder(retriever.embedding_model, batch_size=args.embed_batch_size, host=args.ollama_host or None)
+        on_swap = (lambda snapshot: response_cache.set_version(snapshot.version)) if response_cache is not None else None
+        watcher = VaultWatcher(args.vault, args.embeddings_file, retriever, vault_content,
+                               lambda texts: embedder.embed(texts, show_progress=False), args.watch_interval, on_swap).start()
+    rag_server = RAGServer(retriever, vault_content, client, batcher, args.model, sessions, top_k=args.top_k,
+                           response_cache=response_cache, watcher=watcher)
+    server = await asyncio.start_server(rag_server.handle_connection, args.host, args.port, limit=MAX_HEADER_BYTES)
+    print(f"Serving {len(vault_content)} vault chunks on http://{args.host}:{args.port} (model {args.model})")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if watcher is not None:
+            watcher.stop()
+        if response_cache is not None:
+            response_cache.save()
+        query_cache.save()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve RAG queries and chat sessions over HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on (default: 8000)")
+    parser.add_argument("--model", default="llama3", help="Ollama model to use (default: llama3)")
+    parser.add_argument("--embedding-model", default="mxbai-embed-large", help="Ollama embedding model (default: mxbai-embed-large)")
+    parser.add_argument("--ollama-host", default="", help="Ollama URL (default: OLLAMA_HOST or http://localhost:11434)")
+    parser.add_argument("--ollama-connections", type=int, default=16, help="Keep-alive connections to Ollama shared by all sessions (default: 16)")
+    parser.add_argument("--vault", default="vault.txt", help="Vault file (default: vault.txt)")
+    parser.add_argument("--embeddings-file", default="vault_embeddings.bin", help="Binary embeddings store (default: vault_embeddings.bin)")
+    parser.add_argument("--embed-batch-size", type=int, default=32, help="Chunks per embedding request when embedding the vault (default: 32)")
+    parser.add_argument("--retrieval", choices=RETRIEVAL_MODES, default="hybrid", help="dense, hybrid or lexical retrieval (default: hybrid)")
+    parser.add_argument("--top-k", type=int, default=3, help="Vault chunks retrieved per query (default: 3)")
+    parser.add_argument("--ann", action="store_true", help="Use the approximate nearest-neighbour index for retrieval")
+    parser.add_argument("--ann-lists", type=int, default=0, help="Number of ANN index lists (default: sqrt of the vault size)")
+    parser.add_argument("--ann-nprobe", type=int, default=8, help="ANN lists searched per query (default: 8)")
+    parser.add_argument("--quantize", choices=["none", "int8", "binary"], default="none", help="Search int8 or binary codes with exact rescoring (default: none)")
+    parser.add_argument("--rescore-oversample", type=int, default=4, help="Candidates rescored per result with --quantize (default: 4)")
+    parser.add_argument("--backend", choices=["numpy", "torch", "sharded"], default="numpy", help="Vector math backend for exact search (default: numpy)")
+    parser.add_argument("--search-workers", type=int, default=0, help="Worker processes with --backend sharded (default: one per core)")
+    parser.add_argument("--batch-window-ms", type=float, default=5, help="How long query embeddings are collected into one request (default: 5)")
+    parser.add_argument("--max-embed-batch", type=int, default=64, help="Most query embeddings per request (default: 64)")
+    parser.add_argument("--query-cache-size", type=int, default=1024, help="Query embeddings kept in the cache (default: 1024)")
+    parser.add_argument("--query-cache-ttl", type=float, default=3600, help="Seconds before a cached query embedding expires (default: 3600)")
+    parser.add_argument("--query-cache-file", default="", help="Persist the query embedding cache to this file between restarts")
+    parser.add_argument("--response-cache", action="store_true", help="Reuse answers to near-identical first questions of a session against the same context")
+    parser.add_argument("--response-cache-threshold", type=float, default=0.95, help="Question embedding similarity for a cached answer to be reused (default: 0.95)")
+    parser.add_argument("--response-cache-size", type=int, default=1024, help="Answers kept in the response cache (default: 1024)")
+    parser.add_argument("--response-cache-file", default="", help="Persist the response cache to this file between runs")
+    parser.add_argument("--watch-vault", action="store_true", help="Embed and index records appended to the vault while serving")
+    parser.add_argument("--watch-interval", type=float, default=2.0, help="Seconds between checks of the vault with --watch-vault (default: 2)")
+    parser.add_argument("--history-max-tokens", type=int, default=4096, help="Token budget for each session's conversation (default: 4096)")
+    parser.add_argument("--history-pinned-turns", type=int, default=0, help="Messages at the start of a conversation that are never dropped (default: 0)")
+    parser.add_argument("--session-ttl", type=float, default=3600, help="Seconds before an idle session is dropped (default: 3600)")
+    args = parser.parse_args()
+    if not 1 <= args.top_k <= MAX_TOP_K:
+        parser.error(f"--top-k must be from 1 to {MAX_TOP_K}")
+    if args.watch_vault and args.backend == "sharded":
+        parser.error("--watch-vault is not available with --backend sharded")
+
+    retriever, vault_content = load_retriever(args)
+    try:
+        asyncio.run(serve(args, retriever, vault_content))
+    except KeyboardInterrupt:
+        print("Server stopped.")
+
+if __name__ == "__main__":
+    main()
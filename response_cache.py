@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+import numpy as np
+import tracing
+from embedding_store import read_store_header
+from query_cache import normalize_query
+
+ENTRY_OVERHEAD_BYTES = 300
+
+# Function to identify the vault version an answer was generated from: the embedding model and the vault
+# checksum recorded in the embedding store header (rewritten whenever the vault or the embeddings change)
+def store_version(store_path):
+    try:
+        header = read_store_header(store_path)
+    except (OSError, ValueError):
+        return ""
+    return f"{header['model']}:{header['vault_checksum']}"
+
+# Function to hash the retrieved context, so answers are only reused for the same chunks
+def context_key(context):
+    return hashlib.blake2b("\n".join(context).encode("utf-8"), digest_size=16).hexdigest()
+
+# Semantic cache of model answers for stateless questions (every turn without conversation history, or
+# the first turn of a conversation). An answer is reused when the chat model and system message are the
+# same, the retrieved context is the same chunk set, and the question's embedding is within threshold
+# cosine similarity of the cached question (or, without an embedding, the normalized text is equal).
+# All entries belong to one vault version; set_version() with a different version drops them, so an
+# answer is never served after the vault or its embeddings changed. Entries are evicted LRU when the
+# cache exceeds max_entries or max_bytes, expire after ttl seconds, and can be persisted to a JSON file.
+class ResponseCache:
+    def __init__(self, version="", max_entries=1024, max_bytes=32 * 1024 * 1024, threshold=0.95, ttl=86400, path=None):
+        self.version = version
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.threshold = threshold
+        self.ttl = ttl
+        self.path = path
+        self.entries = OrderedDict()
+        self.buckets = {}
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_s = 0.0
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def _expired(self, created):
+        return self.ttl is not None and self.ttl > 0 and time.time() - created > self.ttl
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        bucket = self.buckets[key[:2]]
+        bucket.discard(key)
+        if not bucket:
+            del self.buckets[key[:2]]
+        self.size_bytes -= entry["bytes"]
+
+    # Function to switch to a new vault version, dropping every answer generated from another one
+    def set_version(self, version):
+        with self.lock:
+            if version == self.version:
+                return
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.buckets.clear()
+            self.size_bytes = 0
+            self.version = version
+
+    # Function to return the cached answer entry for a question, or None
+    def get(self, scope, context, query, embedding=None):
+        with tracing.span("response_cache_lookup") as span:
+            bucket_key = (scope, context_key(context))
+            text = normalize_query(query)
+            with self.lock:
+                best, best_similarity = None, -1.0
+                for key in self.buckets.get(bucket_key, ()):
+                    entry = self.entries[key]
+                    if key[2] == text:
+                        similarity = 1.0
+                    elif embedding is not None and entry["embedding"] is not None:
+                        cached = np.frombuffer(entry["embedding"], dtype=np.float32)
+                        vector = np.asarray(embedding, dtype=np.float32)
+                        denominator = np.linalg.norm(cached) * np.linalg.norm(vector)
+                        similarity = float(cached @ vector / denominator) if denominator > 0 else 0.0
+                    else:
+                        continue
+                    if similarity > best_similarity:
+                        best, best_similarity = key, similarity
+                if best is not None and self._expired(self.entries[best]["created"]):
+                    self._remove(best)
+                    best = None
+                if best is None or best_similarity < self.threshold:
+                    self.misses += 1
+                    span.set(hit=False)
+                    return None
+                self.entries.move_to_end(best)
+                entry = self.entries[best]
+                self.hits += 1
+                self.saved_s += entry["seconds"]
+                span.set(hit=True, similarity=best_similarity)
+                return {"response": entry["response"], "similarity": best_similarity, "seconds": entry["seconds"]}
+
+    # Function to cache an answer; seconds is how long generating it took (reported as time saved on hits)
+    def put(self, scope, context, query, embedding, response, seconds=0.0):
+        with self.lock:
+            self._insert((scope, context_key(context), normalize_query(query)), embedding, response, seconds, time.time())
+
+    def _insert(self, key, embedding, response, seconds, created):
+        embedding = array("f", embedding) if embedding is not None else None
+        size = len(response.encode("utf-8")) + ENTRY_OVERHEAD_BYTES
+        if embedding is not None:
+            size += embedding.itemsize * len(embedding)
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = {"embedding": embedding, "response": response, "seconds": seconds,
+                             "created": created, "bytes": size}
+        self.buckets.setdefault(key[:2], set()).add(key)
+        self.size_bytes += size
+        while self.entries and (len(self.entries) > self.max_entries or self.size_bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "generation_s_saved": self.saved_s,
+        }
+
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        with self.lock:
+            data = {"version": self.version,
+                    "entries": [[scope, context_hash, text, entry["embedding"].tolist() if entry["embedding"] is not None else None,
+                                 entry["response"], entry["seconds"], entry["created"]]
+                                for (scope, context_hash, text), entry in self.entries.items()
+                                if not self._expired(entry["created"])]}
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(tmp_path, path)
+
+    def load(self, path=None):
+        path = path or self.path
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Could not load response cache '{path}': {str(e)}")
+            return
+        if data.get("version") != self.version:
+            # Answers from another version of the vault are not loaded
+            self.invalidations += 1
+            return
+        with self.lock:
+            for scope, context_hash, text, embedding, response, seconds, created in data.get("entries", []):
+                if not self._expired(created):
+                    self._insert((scope, context_hash, text), embedding, response, seconds, created)
+
+# Function to embed a question for the cache lookup (a query cache hit right after retrieval); lexical
+# retrieval makes no embeddings, so there only questions with the same normalized text match
+def question_embedding(retriever, query):
+    if retriever.mode == "lexical" or len(retriever) == 0:
+        return None
+    return retriever.embed_queries([query])[0]
+
+# Function to describe a cache hit for the chat scripts
+def describe_hit(cached):
+    return f"[cached answer: question similarity {cached['similarity']:.3f}, ~{cached['seconds']:.1f}s of generation skipped]"
@@ -0,0 +1,201 @@
+import copy
+import numpy as np
+import ollama
+import tracing
+from vector_backend import get_backend
+
+RRF_K = 60
+# How many candidates per ranking are fused, as a multiple of top_k
+FUSION_DEPTH = 4
+RETRIEVAL_MODES = ("dense", "hybrid", "lexical")
+
+# Function to compute the cosine similarity of two query embeddings
+def query_similarity(a, b):
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    denominator = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(a @ b / denominator) if denominator > 0 else 0.0
+
+# Function to merge several (indices, scores) result lists, keeping each row's best score
+def merge_results(results, top_k):
+    best = {}
+    for indices, scores in results:
+        for idx, score in zip(indices, scores):
+            if score > best.get(idx, float("-inf")):
+                best[idx] = score
+    return sorted(best, key=best.get, reverse=True)[:top_k]
+
+# Function to fuse several rankings (lists of row ids, best first) with reciprocal rank fusion
+def reciprocal_rank_fusion(rankings, top_k, k=RRF_K):
+    scores = {}
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking):
+            scores[idx] = scores.get(idx, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)[:top_k]
+
+# Function to merge two (indices, scores) result lists best first, shifting the second list's row ids by offset
+def merge_ranked(first, second, offset, top_k):
+    ranked = list(zip(first[1], first[0])) + [(score, idx + offset) for idx, score in zip(second[0], second[1])]
+    ranked.sort(key=lambda pair: pair[0], reverse=True)
+    return [idx for _, idx in ranked[:top_k]], [score for score, _ in ranked[:top_k]]
+
+# Read-only view of two embedding matrices one after the other (e.g. the memory-mapped store and rows
+# appended since it was written), indexed by row like a single matrix without copying either of them
+class StackedRows:
+    def __init__(self, base, tail):
+        self.base = base
+        self.tail = tail
+        self.dtype = tail.dtype
+        self.shape = (len(base) + len(tail), tail.shape[1])
+        self.ndim = 2
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        rows = len(self.base)
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return np.concatenate([np.asarray(self.base[start:min(stop, rows)]),
+                                       np.asarray(self.tail[max(start - rows, 0):max(stop - rows, 0)])])
+            index = np.arange(start, stop, step)
+        if np.ndim(index) == 0:
+            index = int(index)
+            if index < 0:
+                index += len(self)
+            return self.base[index] if index < rows else self.tail[index - rows]
+        index = np.asarray(index, dtype=np.int64)
+        in_base = index < rows
+        out = np.empty((len(index), self.shape[1]), dtype=self.dtype)
+        out[in_base] = self.base[index[in_base]]
+        out[~in_base] = self.tail[index[~in_base] - rows]
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        matrix = self[0:len(self)]
+        return matrix if dtype is None else matrix.astype(dtype)
+
+# Retrieval over the vault embeddings. The vault row norms are computed once at load time, so each
+# search is a single matrix multiply of the (normalized) queries against the vault matrix followed by
+# one scaling step, instead of cosine_similarity recomputing every row norm per query. The
+# embeddings are used in place (e.g. the memory-mapped store), so no normalized copy of the vault is
+# kept in RAM. Several queries (original, rewritten, expansions) can be scored in the same GEMM.
+# With a lexical (BM25) index, mode "hybrid" fuses the dense and lexical rankings with reciprocal rank
+# fusion, and mode "lexical" answers from the lexical index alone without any embedding call.
+# With a quantized index (int8 or binary codes), every row is scored on the codes and only the best
+# candidates are rescored against the embeddings, so the float matrix is never scanned in full.
+# The vector math runs on a pluggable backend (vector_backend.py): NumPy by default, torch only when
+# backend="torch" is selected, or a backend object such as a ShardedBackend searching in worker processes.
+class VaultRetriever:
+    def __init__(self, embeddings, embedding_model='mxbai-embed-large', ann_index=None, query_cache=None,
+                 lexical_index=None, mode="dense", quantized_index=None, backend="numpy", row_norms=None):
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+        if mode != "dense" and lexical_index is None:
+            raise ValueError(f"Retrieval mode '{mode}' needs a lexical index")
+        self.embeddings = embeddings
+        self.embedding_model = embedding_model
+        self.ann_index = ann_index
+        self.query_cache = query_cache
+        self.lexical_index = lexical_index
+        self.mode = mode
+        self.quantized_index = quantized_index
+        self.backend = get_backend(backend) if isinstance(backend, str) else backend
+        # The quantized index keeps its own row norms for rescoring; known row norms skip the pass over the vault
+        if quantized_index is not None:
+            row_norms = quantized_index.row_norms
+        self.vault_matrix, self.inv_norms = self.backend.prepare(embeddings, row_norms)
+        # Prepared (matrix, inverse norms) of rows appended after the vault matrix, see with_tail()
+        self.tail = None
+
+    # Function to return a retriever over this one's rows plus tail rows appended after them. The prepared
+    # vault matrix (e.g. the memory-mapped store) is shared rather than copied and exact search scores the
+    # tail separately; the indexes given must already cover the tail rows.
+    def with_tail(self, tail, tail_row_norms, ann_index=None, lexical_index=None, quantized_index=None):
+        retriever = copy.copy(self)
+        retriever.embeddings = StackedRows(self.embeddings, tail)
+        retriever.ann_index = ann_index
+        retriever.lexical_index = lexical_index
+        retriever.quantized_index = quantized_index
+        retriever.tail = self.backend.prepare(tail, tail_row_norms)
+        return retriever
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    # Function to embed several queries with a single Ollama request, skipping queries found in the cache
+    def embed_queries(self, queries):
+        queries = list(queries)
+        with tracing.span("embed_query", queries=len(queries)) as span:
+            if self.query_cache is None:
+                return self._embed(queries, span)
+            embeddings = [self.query_cache.get(query, self.embedding_model) for query in queries]
+            missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+            span.set(cached=len(queries) - len(missing))
+            if missing:
+                response = self._embed([queries[i] for i in missing], span)
+                for i, embedding in zip(missing, response):
+                    self.query_cache.put(queries[i], self.embedding_model, embedding)
+                    embeddings[i] = embedding
+            return embeddings
+
+    def _embed(self, queries, span):
+        response = ollama.embed(model=self.embedding_model, input=queries)
+        # Timings reported by Ollama (nanoseconds), next to the round trip measured by the span
+        span.set(prompt_tokens=response.get("prompt_eval_count"),
+                 ollama_total_ms=(response.get("total_duration") or 0) / 1e6,
+                 ollama_load_ms=(response.get("load_duration") or 0) / 1e6)
+        return response["embeddings"]
+
+    # Function to return a list of (top indices, cosine scores) per query embedding
+    def search(self, query_embeddings, top_k):
+        if len(self) == 0 or len(query_embeddings) == 0:
+            return [([], []) for _ in query_embeddings]
+        with tracing.span("vault_search", rows=len(self), queries=len(query_embeddings), top_k=top_k):
+            return self._search(query_embeddings, top_k)
+
+    def _search(self, query_embeddings, top_k):
+        if self.ann_index is not None:
+            results = []
+            for query in query_embeddings:
+                indices, scores = self.ann_index.search(query, self.embeddings, top_k)
+                results.append((indices.tolist(), scores.tolist()))
+            return results
+        if self.quantized_index is not None:
+            results = self.quantized_index.search(query_embeddings, self.embeddings, top_k)
+            return [(indices.tolist(), scores.tolist()) for indices, scores in results]
+        results = self.backend.top_k(self.vault_matrix, self.inv_norms, query_embeddings, top_k)
+        if self.tail is not None:
+            tail_results = self.backend.top_k(*self.tail, query_embeddings, top_k)
+            results = [merge_ranked(base, tail, len(self.vault_matrix), top_k) for base, tail in zip(results, tail_results)]
+        return results
+
+    # Function to score several queries at once and merge their top-k lists, keeping each row's best score
+    def search_merged(self, query_embeddings, top_k):
+        return merge_results(self.search(query_embeddings, top_k), top_k)
+
+    # Function to return how many dense results to fetch for a final top-k: hybrid mode fetches deeper so
+    # reciprocal rank fusion with the lexical rankings has candidates to reorder
+    def search_depth(self, top_k):
+        return top_k * FUSION_DEPTH if self.mode == "hybrid" else top_k
+
+    # Function to fuse a dense ranking with the lexical rankings of the queries (hybrid mode only)
+    def fuse_lexical(self, queries, dense_ranking, top_k):
+        if self.mode != "hybrid":
+            return dense_ranking[:top_k]
+        depth = top_k * FUSION_DEPTH
+        with tracing.span("lexical_search", queries=len(queries)):
+            lexical_rankings = [self.lexical_index.search(query, depth)[0] for query in queries]
+        return reciprocal_rank_fusion([dense_ranking] + lexical_rankings, top_k)
+
+    # Function to return the top-k vault rows for the queries using the configured retrieval mode
+    def retrieve(self, queries, top_k):
+        if self.mode == "lexical":
+            # Lexical fast path: no embedding round trip at all
+            with tracing.span("lexical_search", queries=len(queries)):
+                return reciprocal_rank_fusion([self.lexical_index.search(query, top_k)[0] for query in queries], top_k)
+        if len(self) == 0:
+            return []
+        dense_ranking = self.search_merged(self.embed_queries(queries), self.search_depth(top_k))
+        return self.fuse_lexical(queries, dense_ranking, top_k)
@@ -0,0 +1,106 @@
+import os
+import atexit
+import itertools
+import multiprocessing
+from multiprocessing import shared_memory
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from vector_backend import NumpyBackend, NORM_BLOCK_ROWS, normalize_queries, top_k_rows
+
+# Exact search split over worker processes. The embedding store is cut into contiguous row ranges
+# (shards); every search sends the normalized queries to all shards, each worker scores its shard and
+# returns its own top-k, and the per-shard lists are merged into the global top-k. Nothing is copied:
+# the workers are forked after the store is memory-mapped and the inverse row norms are placed in a
+# shared memory block, so every process reads the same pages. The norms themselves are computed by the
+# workers in parallel when the backend is prepared.
+# Forking is used because the chat scripts are plain scripts that a spawned worker would re-run; where
+# fork is not available (Windows) the shards are searched by a thread pool instead (NumPy releases the
+# GIL in the matrix multiply). If threadpoolctl is installed, each worker limits BLAS to one thread so
+# the workers do not oversubscribe the cores.
+_states = {}
+_state_ids = itertools.count()
+
+def _limit_blas_threads():
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(1)
+
+# Function run in a worker: compute the inverse row norms of rows [start, stop) into shared memory
+def _shard_norms(state_id, start, stop):
+    state = _states[state_id]
+    for block_start in range(start, stop, NORM_BLOCK_ROWS):
+        block = np.asarray(state["matrix"][block_start:min(block_start + NORM_BLOCK_ROWS, stop)], dtype=np.float32)
+        state["inv_norms"][block_start:block_start + len(block)] = 1.0 / np.maximum(np.linalg.norm(block, axis=1), 1e-12)
+
+# Function run in a worker: top-k of rows [start, stop) for the queries, as global row ids
+def _shard_top_k(state_id, start, stop, queries, top_k):
+    state = _states[state_id]
+    scores = state["backend"].scores(state["matrix"][start:stop], state["inv_norms"][start:stop], queries)
+    indices, top_scores = top_k_rows(scores, top_k)
+    return indices + start, top_scores
+
+# Function to split rows into at most shards contiguous (start, stop) ranges of about the same size
+def shard_ranges(rows, shards):
+    bounds = np.linspace(0, rows, max(1, min(shards, rows)) + 1).astype(np.int64)
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+class ShardedBackend:
+    name = "sharded"
+
+    def __init__(self, workers=0, shards=0):
+        self.workers = workers or os.cpu_count() or 1
+        self.shards = shards or self.workers
+        self.pool = None
+        self.norms_memory = None
+        self.state_id = None
+        self.ranges = []
+        self.fallback = None
+
+    # Function to shard the memory-mapped store, start the workers and compute the row norms
+    def prepare(self, embeddings, row_norms=None):
+        if len(embeddings) == 0:
+            self.fallback = NumpyBackend()
+            return self.fallback.prepare(embeddings, row_norms)
+        rows = len(embeddings)
+        self.norms_memory = shared_memory.SharedMemory(create=True, size=rows * 4)
+        inv_norms = np.ndarray((rows,), dtype=np.float32, buffer=self.norms_memory.buf)
+        self.state_id = next(_state_ids)
+        _states[self.state_id] = {"matrix": embeddings, "inv_norms": inv_norms, "backend": NumpyBackend()}
+        self.ranges = shard_ranges(rows, self.shards)
+        if "fork" in multiprocessing.get_all_start_methods():
+            self.pool = multiprocessing.get_context("fork").Pool(self.workers, initializer=_limit_blas_threads)
+        else:
+            self.pool = ThreadPool(self.workers)
+        atexit.register(self.close)
+        if row_norms is not None:
+            inv_norms[:] = 1.0 / row_norms
+        else:
+            self.pool.starmap(_shard_norms, [(self.state_id, start, stop) for start, stop in self.ranges])
+        return embeddings, inv_norms
+
+    # Function to return a list of (top indices, cosine scores) per query embedding, merged over the shards
+    def top_k(self, matrix, inv_norms, query_embeddings, top_k):
+        if self.fallback is not None:
+            return self.fallback.top_k(matrix, inv_norms, query_embeddings, top_k)
+        queries = normalize_queries(query_embeddings)
+        results = self.pool.starmap(_shard_top_k, [(self.state_id, start, stop, queries, top_k) for start, stop in self.ranges])
+        indices = np.concatenate([shard_indices for shard_indices, _ in results], axis=1)
+        order, top_scores = top_k_rows(np.concatenate([shard_scores for _, shard_scores in results], axis=1), top_k)
+        top_indices = np.take_along_axis(indices, order, axis=1)
+        return list(zip(top_indices.tolist(), top_scores.tolist()))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        _states.pop(self.state_id, None)
+        if self.norms_memory is not None:
+            try:
+                self.norms_memory.close()
+            except BufferError:
+                pass  # a retriever still holds a view of the norms; the block goes away with the process
+            self.norms_memory.unlink()
+            self.norms_memory = None
@@ -0,0 +1,68 @@
+import sys
+import time
+import tracing
+
+NEON_GREEN = '\033[92m'
+PINK = '\033[95m'
+RESET_COLOR = '\033[0m'
+
+# Function to stream a chat completion, printing tokens as they arrive.
+# Returns the full response text and per-turn timing stats (time to first token, tokens/sec).
+def stream_chat_completion(client, model, messages, out=sys.stdout, **kwargs):
+    with tracing.span("chat_completion", model=model, stream=True) as span:
+        response_text, stats = _stream_chat_completion(client, model, messages, out, **kwargs)
+        span.set(prompt_tokens=stats["prompt_tokens"], completion_tokens=stats["completion_tokens"],
+                 ttft_ms=stats["ttft_s"] * 1000, tokens_per_s=stats["tokens_per_s"])
+    return response_text, stats
+
+def _stream_chat_completion(client, model, messages, out, **kwargs):
+    start = time.perf_counter()
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+        **kwargs,
+    )
+    parts = []
+    first_token_at = None
+    usage = None
+    chunk_count = 0
+    out.write(NEON_GREEN)
+    try:
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            parts.append(delta)
+            chunk_count += 1
+            out.write(delta)
+            out.flush()
+    finally:
+        out.write(RESET_COLOR + "\n")
+        out.flush()
+    end = time.perf_counter()
+
+    # Ollama sends one token per chunk, so the chunk count stands in when usage is not reported
+    completion_tokens = usage.completion_tokens if usage else chunk_count
+    generation_time = end - first_token_at if first_token_at is not None else 0.0
+    stats = {
+        "ttft_s": (first_token_at or end) - start,
+        "total_s": end - start,
+        "prompt_tokens": usage.prompt_tokens if usage else None,
+        "completion_tokens": completion_tokens,
+        "tokens_per_s": completion_tokens / generation_time if generation_time > 0 else 0.0,
+    }
+    return "".join(parts), stats
+
+# Function to print the timing stats of a streamed turn
+def print_stream_stats(stats):
+    prompt = f"{stats['prompt_tokens']} prompt tokens, " if stats["prompt_tokens"] is not None else ""
+    print(PINK + f"[time to first token: {stats['ttft_s']:.2f}s, {prompt}{stats['completion_tokens']} tokens "
+          f"at {stats['tokens_per_s']:.1f} tokens/s, total {stats['total_s']:.2f}s]" + RESET_COLOR)
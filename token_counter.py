@@ -0,0 +1,16 @@
+import re
+
+# Fast local token estimate, close enough to BPE tokenizers (llama3, mistral) for budgeting:
+# short words and punctuation are one token each, longer words roughly one token per 4 characters.
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def count_tokens(text):
+    tokens = 0
+    for piece in TOKEN_PATTERN.findall(text):
+        tokens += 1 if len(piece) <= 4 else (len(piece) + 3) // 4
+    return tokens
+
+# Function to estimate the tokens of a chat message including the role/template overhead
+def count_message_tokens(message):
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
@@ -0,0 +1,299 @@
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+import functools
+import contextvars
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Per-stage tracing for the chat and ingestion pipelines. Code marks its stages with
+#     with tracing.span("vault_search", rows=n) as span:
+#         ...
+#         span.set(prompt_tokens=...)
+# Spans opened inside another span on the same thread become its children; a span with no parent is a
+# trace of its own and is written as one JSON line (with all its child spans) to the trace file when it
+# ends. Every span also updates in-memory Prometheus-style histograms per stage, which can be served on
+# a /metrics endpoint. Tracing is off until configure() is called with a trace file or metrics port; when
+# off, span() returns a shared no-op span, so the instrumentation costs next to nothing.
+TRACE_FILE_ENV = "RAG_TRACE_FILE"
+METRICS_PORT_ENV = "RAG_METRICS_PORT"
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_ATTRS = ("prompt_tokens", "completion_tokens")
+MAX_SPANS_PER_TRACE = 10000
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class Span:
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.parent = None
+        self.root = self
+        self.spans = []
+        self.dropped = 0
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        if self.parent is not None:
+            self.root = self.parent.root
+        else:
+            self.trace_id = uuid.uuid4().hex[:16]
+            self.wall_start = time.time()
+        self.token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        _current_span.reset(self.token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer.finish(self)
+        return False
+
+    def record(self):
+        return {"name": self.name, "parent": self.parent.name if self.parent is not None else None,
+                "start_ms": (self.start - self.root.start) * 1000, "duration_ms": self.duration * 1000,
+                "attrs": self.attrs}
+
+# Histograms of stage durations and counters of tokens, rendered in the Prometheus text format
+class StageMetrics:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.stages = {}
+        self.tokens = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds, attrs):
+        with self.lock:
+            counts = self.stages.setdefault(stage, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts["buckets"][i] += 1
+            counts["sum"] += seconds
+            counts["count"] += 1
+            for kind in TOKEN_ATTRS:
+                value = attrs.get(kind)
+                if isinstance(value, (int, float)):
+                    self.tokens[(stage, kind)] = self.tokens.get((stage, kind), 0) + value
+            if "error" in attrs:
+                self.errors[stage] = self.errors.get(stage, 0) + 1
+
+    def render(self):
+        lines = ["# HELP rag_stage_duration_seconds Time spent in each pipeline stage",
+                 "# TYPE rag_stage_duration_seconds histogram"]
+        with self.lock:
+            for stage, counts in sorted(self.stages.items()):
+                for bound, count in zip(self.buckets, counts["buckets"]):
+                    lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {counts["count"]}')
+                lines.append(f'rag_stage_duration_seconds_sum{{stage="{stage}"}} {counts["sum"]:.6f}')
+                lines.append(f'rag_stage_duration_seconds_count{{stage="{stage}"}} {counts["count"]}')
+            lines += ["# HELP rag_tokens_total Tokens reported by Ollama per stage", "# TYPE rag_tokens_total counter"]
+            for (stage, kind), value in sorted(self.tokens.items()):
+                lines.append(f'rag_tokens_total{{stage="{stage}",kind="{kind.split("_")[0]}"}} {value}')
+            lines += ["# HELP rag_stage_errors_total Stages that ended with an exception", "# TYPE rag_stage_errors_total counter"]
+            for stage, value in sorted(self.errors.items()):
+                lines.append(f'rag_stage_errors_total{{stage="{stage}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.file = None
+        self.metrics = StageMetrics()
+        self.metrics_server = None
+        self.lock = threading.Lock()
+
+    def span(self, name, **attrs):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, attrs)
+
+    def finish(self, span):
+        self.metrics.observe(span.name, span.duration, span.attrs)
+        root = span.root
+        if span is not root:
+            if len(root.spans) < MAX_SPANS_PER_TRACE:
+                root.spans.append(span.record())
+            else:
+                root.dropped += 1
+            return
+        if self.file is None:
+            return
+        record = {"trace_id": span.trace_id, "name": span.name, "start": span.wall_start,
+                  "duration_ms": span.duration * 1000, "attrs": span.attrs, "spans": span.spans}
+        if span.dropped:
+            record["dropped_spans"] = span.dropped
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock:
+            if self.file is not None:
+                self.file.write(line)
+                self.file.flush()
+
+    def configure(self, path=None, metrics_port=None, metrics_host="127.0.0.1"):
+        self.close()
+        if path:
+            self.path = path
+            self.file = open(path, "a", encoding="utf-8")
+        if metrics_port:
+            self.metrics_server = start_metrics_server(self.metrics, metrics_port, metrics_host)
+        self.enabled = self.file is not None or self.metrics_server is not None
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+            self.metrics_server = None
+        self.enabled = False
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = self.server.metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+# Function to serve the metrics on http://host:port/metrics from a background thread
+def start_metrics_server(metrics, port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+tracer = Tracer()
+
+# Function to open a span on the default tracer
+def span(name, **attrs):
+    return tracer.span(name, **attrs)
+
+# Function to add attributes (e.g. token counts) to the innermost open span
+def annotate(**attrs):
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attrs)
+
+# Decorator running the whole function inside a span
+def traced(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Function to record a duration measured outside a span (e.g. how stale the index was) in the stage histograms
+def observe(stage, seconds, **attrs):
+    if tracer.enabled:
+        tracer.metrics.observe(stage, seconds, attrs)
+
+# Function to turn tracing on; path and port fall back to the RAG_TRACE_FILE and RAG_METRICS_PORT environment variables
+def configure(path=None, metrics_port=None):
+    path = path or os.getenv(TRACE_FILE_ENV) or None
+    metrics_port = metrics_port or int(os.getenv(METRICS_PORT_ENV, "0") or 0)
+    if path or metrics_port:
+        tracer.configure(path, metrics_port)
+    return tracer.enabled
+
+# Function to copy token counts from an OpenAI-style usage object onto a span
+def record_usage(span, usage):
+    if usage is not None:
+        span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+
+# Function to read the trace records of one or more JSONL files, skipping lines that are not valid JSON
+def read_traces(paths):
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+def percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+# Function to summarize durations and tokens per stage: {stage: {count, p50_ms, p90_ms, p99_ms, ...}}
+def summarize(traces, name=None):
+    durations, tokens, errors = {}, {}, {}
+    for trace in traces:
+        if name and trace["name"] != name:
+            continue
+        for record in [trace] + trace.get("spans", []):
+            stage = record["name"]
+            durations.setdefault(stage, []).append(record["duration_ms"])
+            attrs = record.get("attrs") or {}
+            for kind in TOKEN_ATTRS:
+                if isinstance(attrs.get(kind), (int, float)):
+                    tokens.setdefault(stage, {}).setdefault(kind, 0)
+                    tokens[stage][kind] += attrs[kind]
+            if "error" in attrs:
+                errors[stage] = errors.get(stage, 0) + 1
+    summary = {}
+    for stage, values in durations.items():
+        values.sort()
+        summary[stage] = {"count": len(values), "p50_ms": percentile(values, 50), "p90_ms": percentile(values, 90),
+                          "p99_ms": percentile(values, 99), "max_ms": values[-1], "total_ms": sum(values),
+                          "errors": errors.get(stage, 0), **tokens.get(stage, {})}
+    return summary
+
+def print_summary(summary, out=sys.stdout):
+    out.write(f"{'stage':<22} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} "
+              f"{'errors':>6} {'prompt tok':>10} {'compl tok':>10}\n")
+    for stage, stats in sorted(summary.items(), key=lambda item: -item[1]["total_ms"]):
+        out.write(f"{stage:<22} {stats['count']:>7} {stats['p50_ms']:>9.1f} {stats['p90_ms']:>9.1f} "
+                  f"{stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f} {stats['errors']:>6} "
+                  f"{stats.get('prompt_tokens', ''):>10} {stats.get('completion_tokens', ''):>10}\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize trace files: latency percentiles and tokens per stage")
+    parser.add_argument("paths", nargs="+", help="Trace files (JSONL) written with --trace-file")
+    parser.add_argument("--name", help="Only include traces with this root name (e.g. chat_turn, ingest, email_sync)")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    summary = summarize(read_traces(args.paths), args.name)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+import os
+import json
+import mmap
+import time
+import struct
+import hashlib
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Indexed record store over the vault. vault.txt stays a plain text file with one chunk per line, so
+# anything that reads it keeps working; two sidecar files turn it into a record store:
+#   vault.txt.idx         64-byte header, then one (text offset, metadata offset) uint64 pair per row
+#   vault.txt.meta.jsonl  one JSON object per record (source, email uid, date, ingest time)
+# Readers keep only the offsets in memory and read chunk text through mmap by row id.
+# Appends hold a lock file (vault.txt.lock) and write the metadata, then the text, then the index, each
+# as a single append. A crash in between leaves at most lines that are not indexed yet; they are indexed
+# (without metadata) the next time the store is opened, like lines appended to vault.txt by other tools.
+# Readers never write to vault.txt: a last line without its line ending (another tool still writing it)
+# is left out of the index until it is complete. Only an append completes it first.
+# If the indexed rows no longer match the vault (it was rewritten or edited), the index is rebuilt.
+INDEX_MAGIC = b"ELRAGIDX"
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct("<8sIIQQQ16s")
+INDEX_HEADER_SIZE = 64
+ROW_SIZE = 16
+DIGEST_SIZE = 16
+SCAN_BLOCK_SIZE = 1 << 24
+
+def offsets_path_for(vault_path):
+    return vault_path + ".idx"
+
+def metadata_path_for(vault_path):
+    return vault_path + ".meta.jsonl"
+
+def lock_path_for(vault_path):
+    return vault_path + ".lock"
+
+# Exclusive lock on the vault's lock file, held while the vault or its index is written
+class VaultLock:
+    def __init__(self, vault_path):
+        self.path = lock_path_for(vault_path)
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "a+b")
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+
+def _file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+def _read_range(path, start, end):
+    with open(path, "rb") as file:
+        file.seek(start)
+        return file.read(end - start)
+
+def _write_all(path, data):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+def _read_header(index_path):
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, "rb") as file:
+        data = file.read(INDEX_HEADER_SIZE)
+    if len(data) < INDEX_HEADER_SIZE:
+        return None
+    magic, version, _, rows, text_end, meta_end, last_digest = INDEX_HEADER.unpack_from(data)
+    if magic != INDEX_MAGIC or version != INDEX_VERSION:
+        return None
+    if _file_size(index_path) < INDEX_HEADER_SIZE + rows * ROW_SIZE:
+        return None
+    return {"rows": rows, "text_end": text_end, "meta_end": meta_end, "last_digest": last_digest}
+
+def _write_header(file, header):
+    file.seek(0)
+    file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0, header["rows"], header["text_end"],
+                                 header["meta_end"], header["last_digest"]).ljust(INDEX_HEADER_SIZE, b"\0"))
+
+def _read_rows(index_path, start, stop):
+    with open(index_path, "rb") as file:
+        file.seek(INDEX_HEADER_SIZE + start * ROW_SIZE)
+        data = file.read((stop - start) * ROW_SIZE)
+    return np.frombuffer(data, dtype="<u8").reshape(-1, 2)
+
+# Function to check that the indexed rows still describe the start of the vault file
+def _index_matches(vault_path, index_path, header):
+    if header["text_end"] > _file_size(vault_path):
+        return False
+    if header["rows"] == 0:
+        return header["text_end"] == 0
+    last_start = int(_read_rows(index_path, header["rows"] - 1, header["rows"])[0, 0])
+    return _digest(_read_range(vault_path, last_start, header["text_end"])) == header["last_digest"]
+
+# Function to bring the offset index up to date with the vault file. Must be called with the VaultLock held.
+# Complete lines past the indexed end are indexed without metadata; a last line without a newline is left
+# out, unless complete_last_line is set (appends), which writes its newline first.
+def _update_index(vault_path, complete_last_line=False):
+    index_path = offsets_path_for(vault_path)
+    meta_size = _file_size(metadata_path_for(vault_path))
+    header = _read_header(index_path)
+    if header is not None and not _index_matches(vault_path, index_path, header):
+        print(f"Vault index '{index_path}' does not match '{vault_path}'. Rebuilding...")
+        header = None
+    if header is None:
+        header = {"rows": 0, "text_end": 0, "meta_end": meta_size, "last_digest": bytes(DIGEST_SIZE)}
+        with open(index_path, "wb") as file:
+            _write_header(file, header)
+
+    vault_size = _file_size(vault_path)
+    if vault_size == header["text_end"]:
+        return header
+    if complete_last_line and _read_range(vault_path, vault_size - 1, vault_size) != b"\n":
+        _write_all(vault_path, b"\n")
+        vault_size += 1
+    line_ends = []
+    with open(vault_path, "rb") as file:
+        file.seek(header["text_end"])
+        position = header["text_end"]
+        while position < vault_size:
+            block = file.read(min(SCAN_BLOCK_SIZE, vault_size - position))
+            if not block:
+                break
+            line_ends.append(np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10) + position + 1)
+            position += len(block)
+    line_ends = np.concatenate(line_ends).astype("<u8")
+    if not len(line_ends):
+        return header
+    text_end = int(line_ends[-1])
+    starts = np.concatenate([[header["text_end"]], line_ends[:-1]]).astype("<u8")
+    rows = np.empty((len(starts), 2), dtype="<u8")
+    rows[:, 0] = starts
+    rows[:, 1] = meta_size
+    header = {
+        "rows": header["rows"] + len(starts),
+        "text_end": text_end,
+        "meta_end": meta_size,
+        "last_digest": _digest(_read_range(vault_path, int(starts[-1]), text_end)),
+    }
+    with open(index_path, "r+b") as file:
+        file.seek(INDEX_HEADER_SIZE + (header["rows"] - len(starts)) * ROW_SIZE)
+        file.write(rows.tobytes())
+        file.truncate()
+        _write_header(file, header)
+    return header
+
+# Function to append records to the vault atomically. metadata is one dict for all texts or a list with one
+# dict per text; an ingest time is added unless the metadata already has one. Newlines inside a text are replaced by spaces.
+# Returns the number of records written.
+def append_records(vault_path, texts, metadata=None):
+    lines = []
+    metas = []
+    per_row = isinstance(metadata, (list, tuple))
+    for i, text in enumerate(texts):
+        text = " ".join(text.splitlines()).strip()
+        if not text:
+            continue
+        lines.append(text.encode("utf-8") + b"\n")
+        metas.append(metadata[i] if per_row else metadata)
+    if not lines:
+        return 0
+    now = time.time()
+    meta_lines = [json.dumps({"ingested_at": now, **(meta or {})}, ensure_ascii=False).encode("utf-8") + b"\n"
+                  for meta in metas]
+
+    with VaultLock(vault_path):
+        header = _update_index(vault_path, complete_last_line=True)
+        meta_path = metadata_path_for(vault_path)
+        meta_start = _file_size(meta_path)
+        rows = np.empty((len(lines), 2), dtype="<u8")
+        rows[:, 0] = header["text_end"] + np.concatenate([[0], np.cumsum([len(line) for line in lines[:-1]])])
+        rows[:, 1] = meta_start + np.concatenate([[0], np.cumsum([len(line) for line in meta_lines[:-1]])])
+        meta_data = b"".join(meta_lines)
+        text_data = b"".join(lines)
+        _write_all(meta_path, meta_data)
+        _write_all(vault_path, text_data)
+        with open(offsets_path_for(vault_path), "r+b") as file:
+            file.seek(INDEX_HEADER_SIZE + header["rows"] * ROW_SIZE)
+            file.write(rows.tobytes())
+            _write_header(file, {
+                "rows": header["rows"] + len(lines),
+                "text_end": header["text_end"] + len(text_data),
+                "meta_end": meta_start + len(meta_data),
+                "last_digest": _digest(lines[-1]),
+            })
+    return len(lines)
+
+# Function to move a vault and its sidecar files to a new path (e.g. to replace the vault with a rewritten copy)
+def replace_vault(src_path, dst_path):
+    with VaultLock(dst_path):
+        for path_for in (metadata_path_for, offsets_path_for):
+            if os.path.exists(path_for(src_path)):
+                os.replace(path_for(src_path), path_for(dst_path))
+            elif os.path.exists(path_for(dst_path)):
+                os.remove(path_for(dst_path))
+        os.replace(src_path, dst_path)
+    if os.path.exists(lock_path_for(src_path)):
+        os.remove(lock_path_for(src_path))
+
+# Read side of the record store. Indexing and iteration mirror the list returned by readlines()
+# (each line ends with "\n"), so a VaultStore can be passed wherever the vault lines were.
+class VaultStore:
+    def __init__(self, vault_path="vault.txt"):
+        self.path = vault_path
+        self.offsets = np.zeros((0, 2), dtype="<u8")
+        self.text_end = 0
+        self.meta_end = 0
+        self._file = None
+        self._map = None
+        self.refresh()
+
+    # Function to pick up records appended since the store was opened
+    def refresh(self):
+        if not os.path.exists(self.path):
+            return
+        with VaultLock(self.path):
+            header = _update_index(self.path)
+            offsets = _read_rows(offsets_path_for(self.path), 0, header["rows"])
+        self.close()
+        self.offsets = offsets
+        self.text_end = header["text_end"]
+        self.meta_end = header["meta_end"]
+        if self.text_end:
+            self._file = open(self.path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = self._file = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _range(self, row, column, end):
+        start = int(self.offsets[row, column])
+        stop = int(self.offsets[row + 1, column]) if row + 1 < len(self.offsets) else end
+        return start, stop
+
+    # Function to return the text of a record without its line ending
+    def text(self, row):
+        start, stop = self._range(row, 0, self.text_end)
+        return self._map[start:stop].decode("utf-8", errors="replace").rstrip("\r\n")
+
+    # Function to return the metadata of a record ({} for lines added without metadata)
+    def metadata(self, row):
+        start, stop = self._range(row, 1, self.meta_end)
+        if stop <= start:
+            return {}
+        line = _read_range(metadata_path_for(self.path), start, stop).split(b"\n", 1)[0]
+        try:
+            return json.loads(line)
+        except ValueError:
+            return {}
+
+    # Function to return one record with its line ending; iterate over the store rather than slicing it,
+    # so the vault is never copied into a list
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            raise TypeError("VaultStore does not support slicing; iterate over it instead")
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("vault row out of range")
+        return self.text(index) + "\n"
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self.text(row) + "\n"
@@ -0,0 +1,273 @@
+import os
+import time
+import threading
+import numpy as np
+import tracing
+from embedding_store import (chunk_key, vault_digest, read_store_header, load_store_keys, load_embedding_store,
+                             save_embedding_store, SUPPORTED_DTYPES)
+from retrieval import VaultRetriever
+from vault_store import VaultStore
+
+# Live vault watching. A background thread polls vault.txt for records appended by upload.py,
+# collect_emails.py or any other tool, embeds only the new chunks and publishes a new snapshot (epoch)
+# of the vault and its indexes. Nothing a search is using is modified:
+# - the memory-mapped embedding store stays as it is; only the appended rows are kept in memory, in a
+#   tail buffer with spare rows. New rows are written past the rows visible to the current epoch, so
+#   earlier epochs keep a consistent view (the buffer is reallocated at twice the size when it is full),
+#   and exact search scores the store and the tail separately (VaultRetriever.with_tail);
+# - the lexical, ANN and quantized indexes are extended copy-on-write (with_documents / with_rows);
+# - the new epoch is a new VaultStore and VaultRetriever, published by replacing watcher.current.
+# Once the tail grows past COMPACT_MIN_ROWS and 1/COMPACT_FRACTION of the store, the store is rewritten
+# with the tail rows (block by block from the memory map) and mapped again, and the tail starts over.
+# A chat turn takes watcher.current once and uses it throughout, so a turn never mixes two epochs.
+# Each update runs in a "vault_update" span (its duration is the update cost); the freshness lag, from
+# the time the first new record was ingested to the swap, goes to the "vault_freshness_lag" histogram.
+# A vault that was rewritten rather than appended to (e.g. by dedup.py) is reported and needs a restart.
+# stop() compacts as well, so the next start does not embed the new chunks again.
+DEFAULT_INTERVAL = 2.0
+MIN_BUFFER_ROWS = 1024
+COMPACT_MIN_ROWS = 16384
+COMPACT_FRACTION = 8
+
+# One published epoch of the vault: the records and the retriever built over them
+class VaultSnapshot:
+    def __init__(self, epoch, vault_content, retriever, version):
+        self.epoch = epoch
+        self.vault_content = vault_content
+        self.retriever = retriever
+        self.version = version
+
+class VaultWatcher:
+    def __init__(self, vault_path, store_path, retriever, vault_content, embed_fn, interval=DEFAULT_INTERVAL, on_swap=None):
+        if getattr(retriever.backend, "name", "") == "sharded":
+            raise ValueError("Vault watching is not available with the sharded backend")
+        self.vault_path = vault_path
+        self.store_path = store_path
+        self.embed_fn = embed_fn
+        self.interval = interval
+        self.on_swap = on_swap
+        try:
+            header = read_store_header(store_path)
+            self.model = header["model"]
+            self.dtype = header["dtype"]
+            self.store_checksum = header["vault_checksum"]
+        except (OSError, ValueError):
+            self.model, self.dtype, self.store_checksum = retriever.embedding_model, "float32", ""
+        if self.dtype not in SUPPORTED_DTYPES:
+            self.dtype = "float32"
+        version = f"{self.model}:{self.store_checksum}" if self.store_checksum else ""
+        self.current = VaultSnapshot(0, vault_content, retriever, version)
+        self.text_end = getattr(vault_content, "text_end", 0)
+        # Retriever over the rows in the store; every epoch extends it with the tail rows
+        self.base = retriever
+        # Filled on the first update: running vault hash and chunk keys; the tail buffer holds the appended rows
+        self.digest = None
+        self.keys = None
+        self.buffer = None
+        self.norms = None
+        self.tail_rows = 0
+        self.compactions = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.updates = 0
+        self.rows_added = 0
+        self.update_s = 0.0
+        self.last_update_s = 0.0
+        self.last_lag_s = 0.0
+        self.max_lag_s = 0.0
+        self.errors = 0
+        self.last_error = None
+        self.rewritten = False
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="vault-watcher", daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.poll()
+
+    # Function to check the vault once and publish a new epoch if records were appended; returns the rows added
+    def poll(self):
+        with self.lock:
+            if self.rewritten:
+                return 0
+            try:
+                size = os.path.getsize(self.vault_path)
+            except OSError:
+                return 0
+            if size == self.text_end:
+                return 0
+            try:
+                return self._update()
+            except Exception as e:
+                # Ollama unreachable or the like: keep serving the current epoch and retry on the next poll
+                self.errors += 1
+                self.last_error = str(e)
+                return 0
+
+    def _update(self):
+        snapshot = self.current
+        old = snapshot.vault_content
+        rows = len(old)
+        store = VaultStore(self.vault_path)
+        if len(store) < rows or (rows and not (np.array_equal(store.offsets[:rows], old.offsets)
+                                                and store.text(rows - 1) == old.text(rows - 1))):
+            store.close()
+            self.rewritten = True
+            return 0
+        if len(store) == rows:
+            # Only a partial line so far; it is indexed once its line ending is written
+            store.close()
+            return 0
+        with tracing.span("vault_update", rows=len(store) - rows) as span:
+            start = time.perf_counter()
+            texts = [store[row] for row in range(rows, len(store))]
+            ingested_at = store.metadata(rows).get("ingested_at")
+            if self.digest is None:
+                self._load_state(snapshot)
+
+            embed_start = time.perf_counter()
+            new_embeddings = np.asarray(self.embed_fn(texts), dtype=np.float32)
+            if len(new_embeddings) != len(texts):
+                raise ValueError(f"Expected {len(texts)} embeddings but got {len(new_embeddings)}")
+            embed_s = time.perf_counter() - embed_start
+
+            index_start = time.perf_counter()
+            tail, tail_norms = self._append_rows(new_embeddings)
+            digest = self.digest.copy()
+            for text in texts:
+                digest.update(text.encode("utf-8"))
+            checksum = digest.hexdigest()
+            retriever = snapshot.retriever
+            lexical_index = retriever.lexical_index.with_documents(texts) if retriever.lexical_index is not None else None
+            ann_index = retriever.ann_index.with_rows(new_embeddings, checksum) if retriever.ann_index is not None else None
+            quantized_index = None
+            if retriever.quantized_index is not None:
+                quantized_index = retriever.quantized_index.with_rows(new_embeddings, checksum)
+            if len(self.base) == 0:
+                retriever = VaultRetriever(tail, retriever.embedding_model, ann_index, retriever.query_cache, lexical_index,
+                                           retriever.mode, quantized_index, retriever.backend, tail_norms)
+            else:
+                retriever = self.base.with_tail(tail, tail_norms, ann_index, lexical_index, quantized_index)
+            self.tail_rows = len(tail)
+            self.digest = digest
+            self.keys.extend(chunk_key(text, self.model) for text in texts)
+            self.current = VaultSnapshot(snapshot.epoch + 1, store, retriever, f"{self.model}:{checksum}")
+            self.text_end = store.text_end
+
+            lag = time.time() - (ingested_at if isinstance(ingested_at, (int, float)) else os.path.getmtime(self.vault_path))
+            seconds = time.perf_counter() - start
+            self.updates += 1
+            self.rows_added += len(texts)
+            self.update_s += seconds
+            self.last_update_s = seconds
+            self.last_lag_s = lag
+            self.max_lag_s = max(self.max_lag_s, lag)
+            span.set(embed_s=embed_s, index_s=time.perf_counter() - index_start, lag_s=lag, epoch=self.current.epoch)
+        tracing.observe("vault_freshness_lag", lag)
+        if self.on_swap is not None:
+            self.on_swap(self.current)
+        if self.tail_rows >= max(COMPACT_MIN_ROWS, len(self.base) // COMPACT_FRACTION):
+            self._compact()
+        return len(texts)
+
+    # Function to set up the running vault hash and the chunk keys of the store on the first update
+    def _load_state(self, snapshot):
+        self.digest = vault_digest(snapshot.vault_content)
+        self.keys = []
+        if self.store_checksum and self.digest.hexdigest() == self.store_checksum:
+            self.keys = load_store_keys(self.store_path)
+
+    # Function to write new rows after the visible tail rows, reallocating when the buffer is full; returns the new views
+    def _append_rows(self, new_embeddings):
+        rows = self.tail_rows
+        total = rows + len(new_embeddings)
+        dim = new_embeddings.shape[1]
+        if len(self.base) and self.base.embeddings.shape[1] != dim:
+            raise ValueError(f"Embedding dimension changed from {self.base.embeddings.shape[1]} to {dim}")
+        if self.buffer is None or total > len(self.buffer):
+            buffer = np.empty((max(2 * total, MIN_BUFFER_ROWS), dim), dtype=self.dtype)
+            norms = np.empty(len(buffer), dtype=np.float32)
+            if rows:
+                buffer[:rows] = self.buffer[:rows]
+                norms[:rows] = self.norms[:rows]
+            self.buffer, self.norms = buffer, norms
+        self.buffer[rows:total] = new_embeddings
+        norms = np.linalg.norm(new_embeddings, axis=1)
+        self.norms[rows:total] = np.where(norms > 0, norms, 1.0)
+        return self.buffer[:total], self.norms[:total]
+
+    # Function to rewrite the store with the tail rows, map it again and publish an epoch over it with an empty tail
+    def _compact(self):
+        snapshot = self.current
+        if not self.tail_rows or len(self.keys) != len(snapshot.vault_content):
+            return False
+        try:
+            # Another process may have rebuilt the store meanwhile; its rows would not line up with ours
+            if read_store_header(self.store_path)["vault_checksum"] != self.store_checksum:
+                return False
+            checksum = self.digest.hexdigest()
+            save_embedding_store(self.store_path, snapshot.retriever.embeddings, self.keys, self.model, checksum, self.dtype)
+            _, embeddings = load_embedding_store(self.store_path)
+        except (OSError, ValueError) as e:
+            self.errors += 1
+            self.last_error = f"could not save the new embeddings to '{self.store_path}': {str(e)}"
+            return False
+        row_norms = self.norms[:self.tail_rows]
+        if len(self.base):
+            row_norms = np.concatenate([1.0 / np.asarray(self.base.inv_norms, dtype=np.float32), row_norms])
+        retriever = snapshot.retriever
+        self.base = VaultRetriever(embeddings, retriever.embedding_model, retriever.ann_index, retriever.query_cache,
+                                   retriever.lexical_index, retriever.mode, retriever.quantized_index, retriever.backend,
+                                   row_norms)
+        self.store_checksum = checksum
+        # Earlier epochs still read the old buffer, so the next rows go to a new one
+        self.buffer = self.norms = None
+        self.tail_rows = 0
+        self.compactions += 1
+        self.current = VaultSnapshot(snapshot.epoch + 1, snapshot.vault_content, self.base, snapshot.version)
+        return True
+
+    # Function to stop watching and save the embeddings of the new rows to the store
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            self._compact()
+        if self.last_error and self.last_error.startswith("could not save"):
+            print(f"Vault watcher: {self.last_error}")
+
+    def stats(self):
+        return {
+            "epoch": self.current.epoch,
+            "rows": len(self.current.vault_content),
+            "updates": self.updates,
+            "rows_added": self.rows_added,
+            "tail_rows": self.tail_rows,
+            "compactions": self.compactions,
+            "update_s": self.update_s,
+            "last_update_s": self.last_update_s,
+            "last_lag_s": self.last_lag_s,
+            "max_lag_s": self.max_lag_s,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "rewritten": self.rewritten,
+        }
+
+    # Function to return what the chat scripts report on: a change means a new epoch, a new error or a rewritten vault
+    def status(self):
+        return self.current.epoch, self.errors, self.rewritten
+
+    # Function to describe the latest update for the chat scripts
+    def report(self):
+        if self.rewritten:
+            return "[vault: the vault was rewritten; restart to load it]"
+        text = (f"[vault: {self.rows_added} new chunks indexed in {self.updates} updates, now {len(self.current.vault_content)}; "
+                f"last update {self.last_update_s:.2f}s, {self.last_lag_s:.1f}s after ingest")
+        if self.last_error:
+            text += f"; last error: {self.last_error}"
+        return text + "]"
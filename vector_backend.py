@@ -0,0 +1,97 @@
+import numpy as np
+
+# Vector math used by exact retrieval: row norms of the vault matrix and the top-k of the scaled query
+# scores. NumPy is the default; torch is only imported when the torch backend is selected, so the chat
+# scripts start without loading it. The sharded backend (sharded_search.py) splits the search over
+# worker processes.
+NORM_BLOCK_ROWS = 65536
+# float16 rows converted to float32 at a time while scoring. NumPy has no float16 matrix multiply and the
+# conversion dominates (about 10x slower than a float32 store), so float16 stores search faster with torch.
+SCORE_BLOCK_ROWS = 16384
+
+def normalize_queries(query_embeddings):
+    queries = np.asarray(query_embeddings, dtype=np.float32)
+    return queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+# Function to return the top_k columns of each row of a score matrix, best first: (indices, scores) arrays
+def top_k_rows(scores, top_k):
+    k = min(top_k, scores.shape[1])
+    if k < scores.shape[1]:
+        top_indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top_indices = np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+    top_scores = np.take_along_axis(scores, top_indices, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return np.take_along_axis(top_indices, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+class NumpyBackend:
+    name = "numpy"
+
+    # Function to return (matrix, inverse row norms) for the embeddings, without copying the matrix;
+    # known row norms (e.g. from a quantized index) skip the pass over the vault
+    def prepare(self, embeddings, row_norms=None):
+        matrix = np.asarray(embeddings)
+        if row_norms is not None:
+            return matrix, (1.0 / row_norms).astype(np.float32)
+        inv_norms = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), NORM_BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + NORM_BLOCK_ROWS], dtype=np.float32)
+            inv_norms[start:start + len(block)] = 1.0 / np.maximum(np.linalg.norm(block, axis=1), 1e-12)
+        return matrix, inv_norms
+
+    # Function to return the cosine scores of the query embeddings against every row, shape (queries, rows)
+    def scores(self, matrix, inv_norms, query_embeddings):
+        queries = normalize_queries(query_embeddings)
+        if matrix.dtype == np.float32:
+            scores = queries @ matrix.T
+        else:
+            scores = np.empty((len(queries), len(matrix)), dtype=np.float32)
+            for start in range(0, len(matrix), SCORE_BLOCK_ROWS):
+                block = np.asarray(matrix[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+                scores[:, start:start + len(block)] = queries @ block.T
+        scores *= inv_norms
+        return scores
+
+    # Function to return a list of (top indices, cosine scores) per query embedding
+    def top_k(self, matrix, inv_norms, query_embeddings, top_k):
+        top_indices, top_scores = top_k_rows(self.scores(matrix, inv_norms, query_embeddings), top_k)
+        return list(zip(top_indices.tolist(), top_scores.tolist()))
+
+class TorchBackend:
+    name = "torch"
+
+    def __init__(self):
+        import torch
+        self.torch = torch
+
+    def prepare(self, embeddings, row_norms=None):
+        torch = self.torch
+        matrix = torch.from_numpy(np.asarray(embeddings))
+        if row_norms is not None:
+            return matrix, torch.from_numpy((1.0 / row_norms).astype(np.float32))
+        inv_norms = torch.empty(len(embeddings), dtype=torch.float32)
+        for start in range(0, len(embeddings), NORM_BLOCK_ROWS):
+            block = matrix[start:start + NORM_BLOCK_ROWS].float()
+            inv_norms[start:start + len(block)] = 1.0 / torch.linalg.vector_norm(block, dim=1).clamp_min(1e-12)
+        return matrix, inv_norms
+
+    def top_k(self, matrix, inv_norms, query_embeddings, top_k):
+        torch = self.torch
+        queries = torch.as_tensor(np.asarray(query_embeddings, dtype=np.float32))
+        queries = queries / torch.linalg.vector_norm(queries, dim=1, keepdim=True).clamp_min(1e-12)
+        scores = (queries.to(matrix.dtype) @ matrix.T).float() * inv_norms
+        top_scores, top_indices = torch.topk(scores, k=min(top_k, len(matrix)), dim=1)
+        return list(zip(top_indices.tolist(), top_scores.tolist()))
+
+BACKENDS = ("numpy", "torch", "sharded")
+
+# Function to create a backend by name; workers is the process count of the sharded backend (0: one per core)
+def get_backend(name="numpy", workers=0):
+    if name == "numpy":
+        return NumpyBackend()
+    if name == "torch":
+        return TorchBackend()
+    if name == "sharded":
+        from sharded_search import ShardedBackend
+        return ShardedBackend(workers)
+    raise ValueError(f"Unknown vector backend '{name}', expected one of {BACKENDS}")